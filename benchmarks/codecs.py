@@ -0,0 +1,103 @@
+"""
+Compares the installed JSON backends (see modules/utils/codec.py) on
+recorded payloads: the fixtures of benchmarks/fixtures, plus the responses
+of the archives written by `main.py --http-mode record` when --archive-dir
+is given.
+
+    python -m benchmarks.codecs [--repeat N] [--archive-dir ./state/http] [--output PATH]
+"""
+
+import argparse, glob, gzip, json, os, platform, sys, time
+from datetime import datetime
+
+from modules.utils import codec
+from modules.utils.logger import Logger
+
+from .run import load_fixtures
+
+logger = Logger('Benchmark')
+
+
+def fixture_payloads():
+    """{source: [body bytes]} of the fixture pages and detail responses."""
+    payloads = {}
+    for name, fixture in load_fixtures().items():
+        bodies = payloads[name] = [json.dumps(page, ensure_ascii=False).encode("utf-8") for page in fixture["pages"]]
+        details = (fixture.get("details") or {}).get("ads")
+        if details:
+            bodies.append(json.dumps(list(details.values()), ensure_ascii=False).encode("utf-8"))
+    return payloads
+
+
+def archive_payloads(directory: str):
+    """{source: [body bytes]} of the JSON responses recorded in `directory`."""
+    payloads = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz"))):
+        name = os.path.basename(path).split(".")[0]
+        with gzip.open(path, "rb") as f:
+            entries = [json.loads(line) for line in f]
+        bodies = [entry["text"].encode("utf-8") for entry in entries if entry.get("status") == 200 and "text" in entry]
+        if bodies:
+            payloads[f"{name} (recorded)"] = bodies
+    return payloads
+
+
+def bench(backend: codec.JsonCodec, bodies, repeat: int):
+    size = sum(map(len, bodies))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for body in bodies:
+            backend.decode(body)
+    decode = time.perf_counter() - started
+
+    documents = [backend.decode(body) for body in bodies]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            backend.encode(document)
+    encode = time.perf_counter() - started
+
+    return {
+        "bytes": size,
+        "decode_seconds": round(decode, 6),
+        "decode_mb_per_second": round(size * repeat / decode / 1e6, 1) if decode else None,
+        "encode_seconds": round(encode, 6),
+        "encode_mb_per_second": round(size * repeat / encode / 1e6, 1) if encode else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the JSON backends on recorded payloads")
+    parser.add_argument("--repeat", type=int, default=50, metavar="N", help="passes over each payload")
+    parser.add_argument("--archive-dir", metavar="DIR", help="also use the responses recorded in DIR")
+    parser.add_argument("--output", default="./state/benchmark-codecs.json", metavar="PATH", help="where to write the results")
+    args = parser.parse_args(argv)
+
+    payloads = fixture_payloads()
+    if args.archive_dir:
+        payloads.update(archive_payloads(args.archive_dir))
+
+    backends = [codec.get_codec(name) for name in codec.available()]
+    results = {}
+    for name, bodies in payloads.items():
+        results[name] = {backend.name: bench(backend, bodies, args.repeat) for backend in backends}
+        logger.info(f"{name}: " + " | ".join(
+            f"{backend} decode {r['decode_mb_per_second']} MB/s, encode {r['encode_mb_per_second']} MB/s"
+            for backend, r in results[name].items()
+        ))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "generated_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "backends": [backend.name for backend in backends],
+            "repeat": args.repeat,
+            "results": results
+        }, f, indent=2)
+    logger.success(f"Results written to {args.output}")
+    Logger.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
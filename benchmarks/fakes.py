@@ -0,0 +1,122 @@
+import json
+
+from modules.utils.db import MongoDB
+
+
+class FakeResponse:
+    """Enough of a tls_client response for the modules: status, body and json()."""
+
+    def __init__(self, body: bytes, status_code: int = 200):
+        self.status_code = status_code
+        self.content = body
+        self.headers = {"content-type": "application/json"}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+
+class FakeSession:
+    """
+    Stand-in for tls_client.Session answering from a fixture's "details"
+    route: a GET whose URL contains `match` gets the recorded ads whose IDs
+    end the URL (comma separated), anything else is a 404.
+    """
+
+    def __init__(self, details: dict = None):
+        self.details = details or {}
+        self.headers = {}
+        self.proxies = {}
+        self.requests = 0
+
+    def get(self, url: str, **kwargs):
+        self.requests += 1
+        match = self.details.get("match")
+        if match and match in url:
+            ads = self.details["ads"]
+            ids = url.rsplit("/", 1)[-1].split(",")
+            return FakeResponse(json.dumps([ads[i] for i in ids if i in ads]).encode("utf-8"))
+        return FakeResponse(b"{}", 404)
+
+    def post(self, url: str, **kwargs):
+        return self.get(url, **kwargs)
+
+    def close(self):
+        pass
+
+
+class _BulkResult:
+
+    def __init__(self, result: dict):
+        self.bulk_api_result = result
+
+
+class MemoryCollection:
+    """
+    In-memory collection keyed by (source, id), implementing the queries the
+    crawler sends: find() by source and id (scalar, $in or an $or of both)
+    and bulk_write() of UpdateOne $set operations.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = {}
+
+    def create_index(self, keys, **options):
+        return options.get("name")
+
+    def _keys(self, query: dict):
+        if "$or" in query:
+            return [key for sub in query["$or"] for key in self._keys(sub)]
+        ids = query.get("id")
+        if isinstance(ids, dict):
+            ids = ids.get("$in", [])
+        elif ids is not None:
+            ids = [ids]
+        if ids is None:
+            return [key for key in self.docs if key[0] == query.get("source")]
+        return [(query.get("source"), ad_id) for ad_id in ids]
+
+    def find(self, query: dict = None, projection: dict = None):
+        fields = [k for k, v in (projection or {}).items() if v and k != "_id"]
+        for key in self._keys(query or {}):
+            doc = self.docs.get(key)
+            if doc is not None:
+                yield {k: doc[k] for k in fields if k in doc} if fields else dict(doc)
+
+    def bulk_write(self, requests, ordered: bool = True):
+        result = {"nUpserted": 0, "nModified": 0, "nMatched": 0}
+        for request in requests:
+            query, update, upsert = request._filter, request._doc, request._upsert
+            key = (query.get("source"), query.get("id"))
+            doc = self.docs.get(key)
+            if doc is None:
+                if upsert:
+                    self.docs[key] = {**query, **update.get("$set", {})}
+                    result["nUpserted"] += 1
+                continue
+            result["nMatched"] += 1
+            changes = {k: v for k, v in update.get("$set", {}).items() if doc.get(k) != v}
+            if changes:
+                doc.update(changes)
+                result["nModified"] += 1
+        return _BulkResult(result)
+
+
+class MemoryMongo(MongoDB):
+    """MongoDB whose collections are MemoryCollections, nothing to connect to."""
+
+    def __init__(self):
+        super().__init__(uri="memory://", db_name="BestImmo")
+        self.db = {}
+
+    def connect(self):
+        pass
+
+    def get_collection(self, name):
+        if name not in self.db:
+            self.db[name] = MemoryCollection(name)
+        return self.db[name]
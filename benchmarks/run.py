@@ -0,0 +1,195 @@
+"""
+Offline benchmark of every source module.
+
+Feeds the recorded responses in benchmarks/fixtures through each module with
+a fake tls session and an in-memory database, and measures separately:
+
+    parse     decoding the response bodies (module.parse_json)
+    extract   process_page() on the decoded pages: field extraction and
+              normalize_ad, with the detail requests of SeLoger/LogicImmo
+              answered by the fake session, nothing written
+    write     the normalized ads through a BulkWriter, once as new documents
+              and then again, unchanged
+
+Usage, from the repository root:
+
+    python -m benchmarks.run [--repeat N] [--only SeLoger] [--output PATH] [--compare BASELINE]
+
+--validate-mappings checks the fixtures against every module's field
+mapping instead (see FieldMapper.check) and reports what it finds.
+"""
+
+import argparse, glob, importlib, json, os, platform, sys, time
+from datetime import datetime
+
+from modules import CrawlerModule
+from modules.utils.db import BulkWriter
+from modules.utils.http import HttpSession
+from modules.utils.logger import Logger
+from modules.utils.seen import SeenIndex
+
+from .fakes import FakeResponse, FakeSession, MemoryCollection, MemoryMongo
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+logger = Logger('Benchmark')
+
+
+def load_fixtures(only=None):
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if only and name not in only:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+def load_module(fixture: dict):
+    module_name, class_name = fixture["module"].split(".")
+    module = getattr(importlib.import_module(f"modules.{module_name}"), class_name)()
+    module.tls_session = HttpSession(FakeSession(fixture.get("details")), source=module.name)
+    return module
+
+
+def rate(count: int, seconds: float, unit: str = "ads"):
+    return {"count": count, "seconds": round(seconds, 6), f"{unit}_per_second": round(count / seconds, 1) if seconds else None}
+
+
+def bench_parse(module, bodies, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for body in bodies:
+            module.parse_json(FakeResponse(body))
+    elapsed = time.perf_counter() - started
+    result = rate(len(bodies) * repeat, elapsed, "pages")
+    result["mb_per_second"] = round(sum(map(len, bodies)) * repeat / elapsed / 1e6, 1) if elapsed else None
+    return result
+
+
+def bench_extract(module, pages, repeat: int):
+    """Normalized ads of one pass over the pages, and the timing of `repeat` passes."""
+    first, passes = None, []
+    elapsed = 0.0
+    for _ in range(repeat):
+        ads = []
+        module.save_ad = ads.append
+        module.seen = SeenIndex.from_pairs([])
+        started = time.perf_counter()
+        for page, response in enumerate(pages, 1):
+            module.process_page(response, page)
+        if hasattr(module, "batcher"):
+            module.batcher.flush()
+        elapsed += time.perf_counter() - started
+        passes.append(len(ads))
+        if first is None:
+            first = ads
+    return first, rate(sum(passes), elapsed)
+
+
+def bench_write(ads, repeat: int):
+    results = {}
+    collection = MemoryCollection("ads")
+    writer = BulkWriter(collection)
+    # the first pass inserts every ad, the next ones find them unchanged
+    for name, passes in (("write_new", 1), ("write_unchanged", repeat)):
+        elapsed = 0.0
+        for _ in range(passes):
+            started = time.perf_counter()
+            for ad in ads:
+                writer.upsert_if_changed({"source": ad["source"], "id": ad["id"]}, ad)
+            writer.flush()
+            elapsed += time.perf_counter() - started
+        results[name] = rate(len(ads) * passes, elapsed)
+    writer.close()
+    return results
+
+
+def compare(results: dict, baseline_path: str):
+    """Log the change of every rate against a previous results file."""
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)["results"]
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            before = baseline.get(name, {}).get(stage)
+            if not isinstance(result, dict) or not before:
+                continue
+            key = next(k for k in result if k.endswith("_per_second"))
+            if before.get(key) and result[key]:
+                change = (result[key] / before[key] - 1) * 100
+                log = logger.warning if change < -10 else logger.info
+                log(f"{name} {stage}: {before[key]} -> {result[key]} {key.replace('_', ' ')} ({change:+.1f}%)")
+
+
+def validate(only=None):
+    Logger.configure(level="WARNING")
+    CrawlerModule._shared_db = MemoryMongo()
+    CrawlerModule.validate_mappings = True
+    modules = []
+    for fixture in load_fixtures(only).values():
+        module = load_module(fixture)
+        bench_extract(module, fixture["pages"], 1)
+        modules.append(module)
+
+    Logger.configure(level="INFO")
+    for module in modules:
+        module.report_mapping()
+    Logger.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BestImmo offline benchmarks")
+    parser.add_argument("--repeat", type=int, default=20, metavar="N", help="passes over each fixture")
+    parser.add_argument("--only", action="append", metavar="MODULE", help="benchmark only this module (repeatable)")
+    parser.add_argument("--output", default="./state/benchmark.json", metavar="PATH", help="where to write the results")
+    parser.add_argument("--compare", metavar="PATH", help="previous results to compare against")
+    parser.add_argument("--validate-mappings", action="store_true", help="report unmapped or mistyped fields of the fixtures instead")
+    args = parser.parse_args(argv)
+
+    if args.validate_mappings:
+        return validate(args.only)
+
+    # the modules log every page, keep the output to the results
+    Logger.configure(level="WARNING")
+    CrawlerModule._shared_db = MemoryMongo()
+
+    results = {}
+    for name, fixture in load_fixtures(args.only).items():
+        module = load_module(fixture)
+        bodies = [json.dumps(page, ensure_ascii=False).encode("utf-8") for page in fixture["pages"]]
+
+        ads, extract = bench_extract(module, fixture["pages"], args.repeat)
+        results[name] = {
+            "ads_per_pass": len(ads),
+            "parse": bench_parse(module, bodies, args.repeat),
+            "extract": extract,
+            **bench_write(ads, args.repeat)
+        }
+
+    Logger.configure(level="INFO")
+    for name, stages in results.items():
+        logger.info(
+            f"{name}: {stages['ads_per_pass']} ads/pass | parse {stages['parse']['mb_per_second']} MB/s"
+            f" | extract {stages['extract']['ads_per_second']} ads/s"
+            f" | write {stages['write_new']['ads_per_second']} ads/s new, {stages['write_unchanged']['ads_per_second']} ads/s unchanged"
+        )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "generated_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "json_backend": CrawlerModule.json_codec.name,
+            "repeat": args.repeat,
+            "results": results
+        }, f, indent=2)
+    logger.success(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    Logger.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
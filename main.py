@@ -1,53 +1,130 @@
-from modules import LeFigaro, SeLoger, BienIci, LogicImmo, IADFrance, NotairesFrance, VinciImmobilier, ImmobilierFrance
+from modules import CrawlerModule, LeFigaro, SeLoger, BienIci, LogicImmo, IADFrance, NotairesFrance, VinciImmobilier, ImmobilierFrance
 from modules.utils import logger
-import threading, time
+from modules.utils.engine import CrawlEngine
+from modules.utils.processes import ProcessEngine
+from modules.utils.metrics import REGISTRY, MetricsServer
+from modules.utils.profiler import PROFILER
+from modules.utils import codec
+from datetime import datetime
+import argparse, asyncio
+
+MODULES = [
+    LeFigaro.LeFigaroModule,
+    SeLoger.SeLogerModule,
+    LogicImmo.LogicImmoModule,
+    BienIci.BienIciModule,
+    IADFrance.IADFranceModule,
+    NotairesFrance.NotairesFranceModule,
+    VinciImmobilier.VinciImmobilierModule,
+    ImmobilierFrance.ImmobilierFranceModule
+]
 
 class Main:
 
-    def __init__(self):
-        self.runningThreads = []
-        self.modules = [
-            LeFigaro.LeFigaroModule(),
-            SeLoger.SeLogerModule(),
-            LogicImmo.LogicImmoModule(),
-            BienIci.BienIciModule(),
-            IADFrance.IADFranceModule(),
-            NotairesFrance.NotairesFranceModule(),
-            VinciImmobilier.VinciImmobilierModule(),
-            ImmobilierFrance.ImmobilierFranceModule()
-        ]
+    def __init__(self, concurrency: dict = None, default_concurrency: int = 1, incremental: bool = False, stop_pages: int = 3, full_sweep_hours: float = 24, recalibrate: bool = False, processes: bool = False):
+        if processes:
+            # every module crawls in a worker process, self.modules stand in for them
+            self.engine = ProcessEngine(MODULES, concurrency=concurrency, default_concurrency=default_concurrency)
+            self.modules = self.engine.modules
+        else:
+            self.modules = [module() for module in MODULES]
+            self.engine = CrawlEngine(self.modules, concurrency=concurrency, default_concurrency=default_concurrency)
+        for m in self.modules:
+            m.incremental = incremental
+            m.incremental_stop_pages = stop_pages
+            m.full_sweep_interval = full_sweep_hours * 3600
+            m.recalibrate = recalibrate
         self.logger = logger.Logger("Main")
         self.logger.info(f'Loaded {len(self.modules)} module(s)')
 
 
     def Run(self):
-        successfullyRan = 0
-        
         self.logger.info('Running modules...')
-        # runs the modules each one by one
+        # runs every module as a task on the crawl engine
+        try:
+            asyncio.run(self.engine.run(on_status=self.ReportStatus))
+        except KeyboardInterrupt:
+            self.logger.warning('Crawl interrupted.')
         for m in self.modules:
-            try:
-                t = threading.Thread(target=m.start)
-                self.runningThreads.append(t)
-                t.start()
-                successfullyRan += 1
-                self.logger.success(f'Module "{m.name}" has been started, and is now crawling.')
-            except Exception as err:
-                self.logger.error(f'Failed to launch module named "{m.name}"! (Error: {err})')
+            m.report_mapping()
 
-        self.logger.info(f'{successfullyRan} module(s) are runnings.')
 
+    def ReportStatus(self):
+        totalFound = 0
+        for m in self.modules:
+            self.logger.warning(f' Module > {m.name} | {m.summary()}')
+            totalFound += int(m.current_scrapped_ads)
+        self.logger.warning(f' Main > Total ADs Scrapped: {totalFound} | Refreshing every {self.engine.status_interval}s...')
 
-        while True:
-            totalFound = 0
-            for m in self.modules:
-                self.logger.warning(f' Module > {m.name} | ADs Scrapped: {m.current_scrapped_ads}/{m.total_ads_found}')
-                totalFound += int(m.current_scrapped_ads)
-            self.logger.warning(f' Main > Total ADs Scrapped: {totalFound} | Waiting 5s before refreshing...')
-            time.sleep(5)
+
+def parse_concurrency(values):
+    concurrency = {}
+    for value in values or []:
+        name, _, count = value.partition("=")
+        concurrency[name] = int(count)
+    return concurrency
 
 
 if __name__ == "__main__":
-    m = Main()
+    parser = argparse.ArgumentParser(description="BestImmo crawler")
+    parser.add_argument("--concurrency", action="append", metavar="MODULE=N", help="requests in flight for a module, e.g. SeLoger=16 (repeatable)")
+    parser.add_argument("--processes", action="store_true", help="run every module in a worker process of its own, to use every core")
+    parser.add_argument("--work-queue", action="store_true", help="lease pages from the work queue shared by every worker with the same --crawl-id (MongoDB, else ./state/work_queue.sqlite3), to split a crawl across processes or machines")
+    parser.add_argument("--crawl-id", default=datetime.utcnow().strftime("%Y-%m-%d"), metavar="ID", help="crawl the --work-queue workers share (default: today's UTC date)")
+    parser.add_argument("--lease-seconds", type=float, default=120, metavar="S", help="how long a --work-queue worker holds a page before others may take it over")
+    parser.add_argument("--default-concurrency", type=int, default=1, metavar="N", help="requests in flight for modules without --concurrency")
+    parser.add_argument("--incremental", action="store_true", help="stop paging once sources only return known, unchanged ads")
+    parser.add_argument("--stop-pages", type=int, default=3, metavar="N", help="known pages in a row before an incremental crawl stops")
+    parser.add_argument("--full-sweep-hours", type=float, default=24, metavar="H", help="run a full sweep when the last one is older than this")
+    parser.add_argument("--recalibrate", action="store_true", help="probe every source's page size again instead of using ./state/page_sizes.json")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR"], type=str.upper, help="overrides BESTIMMO_LOG_LEVEL")
+    parser.add_argument("--log-json", action="store_true", help="log one JSON object per line")
+    parser.add_argument("--profile", nargs="?", const="./state/profile.json", metavar="PATH", help="time every stage of every source and write the breakdown to PATH (default ./state/profile.json)")
+    parser.add_argument("--cprofile", action="store_true", help="with --profile, also run cProfile in every crawler thread (PATH.pstats)")
+    parser.add_argument("--http-mode", choices=["live", "record", "replay"], default="live", help="record every response to --archive-dir, or replay them instead of going to the network")
+    parser.add_argument("--archive-dir", default="./state/http", metavar="DIR", help="where --http-mode record/replay keep one archive per source")
+    parser.add_argument("--replay-latency", type=lambda value: value if value == "recorded" else float(value), metavar="SECONDS", help="wait this long per replayed request, or 'recorded' to wait as long as when it was recorded")
+    parser.add_argument("--json-backend", choices=["auto"] + list(codec.BACKENDS), help="JSON decoder for the responses (default: BESTIMMO_JSON_BACKEND, else the fastest installed)")
+    parser.add_argument("--validate-mappings", action="store_true", help="check every ad against its source's field mapping and report unmapped or mistyped fields at the end")
+    parser.add_argument("--metrics-port", type=int, default=9108, metavar="PORT", help="serve Prometheus metrics on 127.0.0.1:PORT/metrics (0 to disable)")
+    args = parser.parse_args()
+
+    logger.Logger.configure(level=args.log_level, json_output=args.log_json or None)
+
+    if args.cprofile and args.processes:
+        parser.error("--cprofile only works without --processes")
+    if args.profile:
+        PROFILER.enable(cprofile=args.cprofile)
+
+    CrawlerModule.http_mode = args.http_mode
+    CrawlerModule.http_archive_dir = args.archive_dir
+    CrawlerModule.replay_latency = args.replay_latency
+    CrawlerModule.validate_mappings = args.validate_mappings
+    CrawlerModule.work_queue = args.work_queue
+    CrawlerModule.crawl_id = args.crawl_id
+    CrawlerModule.lease_seconds = args.lease_seconds
+    if args.json_backend:
+        try:
+            CrawlerModule.json_codec = codec.get_codec(args.json_backend)
+        except ImportError as e:
+            parser.error(str(e))
+
+    if args.metrics_port:
+        try:
+            MetricsServer(REGISTRY, args.metrics_port).start()
+        except OSError as e:
+            logger.Logger("Main").error(f"Could not serve metrics on port {args.metrics_port}: {e}")
+
+    m = Main(
+        concurrency=parse_concurrency(args.concurrency),
+        default_concurrency=args.default_concurrency,
+        incremental=args.incremental,
+        stop_pages=args.stop_pages,
+        full_sweep_hours=args.full_sweep_hours,
+        recalibrate=args.recalibrate,
+        processes=args.processes
+    )
     m.Run()
 
+    if args.profile:
+        PROFILER.write(args.profile, {module.name: module.current_scrapped_ads for module in m.modules})
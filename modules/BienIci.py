@@ -1,14 +1,51 @@
 from . import CrawlerModule
 from .utils.logger import Logger
-import time
+from .utils.mapping import FieldMapper, Path, Const
 from datetime import datetime
 
+PROPERTY_TYPES = {
+    'house': 'maison',
+    'flat': 'appartement',
+    'loft': 'loft',
+    'castle': 'château',
+    'townhouse': 'maison de ville'
+}
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
 class BienIciModule(CrawlerModule):
 
+    supports_newest_first = True
+
+    mapper = FieldMapper({
+        "id": "id",
+        "source": Const("bienici"),
+        "url": Path("id", convert=lambda ad_id: f"https://www.bienici.com/annonce/{ad_id}"),
+        "title": "title",
+        "description": "description",
+        "property_type": Path("propertyType", values=PROPERTY_TYPES),
+        "transaction_type": Path("adType", values={'buy': 'vente'}),
+        "price": "price",
+        "city": "city",
+        "postal_code": "postalCode",
+        "surface": "surfaceArea",
+        "rooms": "roomsQuantity",
+        "bedrooms": "bedroomsQuantity",
+        "photos": "photos[].url",
+        "agency_name": "accountDisplayName",
+        "created_at": Path("publicationDate", convert=parse_date),
+        "updated_at": Path("modificationDate", convert=parse_date)
+    })
+
     def __init__(self):
         super().__init__("BienIci", "This is a module for bienici.com", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://www.bienici.com/"
+        self.page_size = 24
+        self.sort_by = "relevance"
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -21,16 +58,16 @@ class BienIciModule(CrawlerModule):
             "referer": f"https://www.bienici.com/",
         })
 
-    def getAds(self, page: int=1, pageSize: int=24):
+    def getAds(self, page: int=1, pageSize: int=24, sortBy: str="relevance"):
         try:
             from_param = (page - 1) * pageSize
             
             resp = self.tls_session.get(
-                f'{self.base_url}realEstateAds.json?filters=%7B"size"%3A{pageSize}%2C"from"%3A{from_param}%2C"showAllModels"%3Afalse%2C"filterType"%3A"buy"%2C"propertyType"%3A%5B"house"%2C"flat"%2C"loft"%2C"castle"%2C"townhouse"%5D%2C"page"%3A{page}%2C"sortBy"%3A"relevance"%2C"sortOrder"%3A"desc"%2C"onTheMarket"%3A%5Btrue%5D%2C"mapMode"%3A"enabled"%7D&extensionType=extendedIfNoResult&enableGoogleStructuredDataAggregates=true&leadingCount=2'
+                f'{self.base_url}realEstateAds.json?filters=%7B"size"%3A{pageSize}%2C"from"%3A{from_param}%2C"showAllModels"%3Afalse%2C"filterType"%3A"buy"%2C"propertyType"%3A%5B"house"%2C"flat"%2C"loft"%2C"castle"%2C"townhouse"%5D%2C"page"%3A{page}%2C"sortBy"%3A"{sortBy}"%2C"sortOrder"%3A"desc"%2C"onTheMarket"%3A%5Btrue%5D%2C"mapMode"%3A"enabled"%7D&extensionType=extendedIfNoResult&enableGoogleStructuredDataAggregates=true&leadingCount=2'
             )
 
             if resp.status_code == 200:
-                data = resp.json()
+                data = self.parse_json(resp)
                 if not data.get('success', True):
                     self.logger.error(f"API Error: {data.get('errorMessage', 'Unknown error')}")
                     return False
@@ -48,115 +85,51 @@ class BienIciModule(CrawlerModule):
             return 0
         
         
-        ads = ads_data.get('realEstateAds', [])
-        saved_count = 0
-        
-        for ad in ads:
-            try:
-                photos = []
-                if ad.get('photos'):
-                    photos = [photo.get('url', '') for photo in ad.get('photos', []) if photo.get('url')]
-                
-                created_at = None
-                updated_at = None
-                
-                if ad.get('publicationDate'):
-                    try:
-                        created_at = datetime.fromisoformat(ad.get('publicationDate').replace('Z', '+00:00'))
-                    except:
-                        pass
-                        
-                if ad.get('modificationDate'):
-                    try:
-                        updated_at = datetime.fromisoformat(ad.get('modificationDate').replace('Z', '+00:00'))
-                    except:
-                        pass
-
-                property_type_mapping = {
-                    'house': 'maison',
-                    'flat': 'appartement',
-                    'loft': 'loft',
-                    'castle': 'château',
-                    'townhouse': 'maison de ville'
-                }
-                property_type = property_type_mapping.get(ad.get('propertyType', ''), ad.get('propertyType', ''))
-
-                transaction_type = 'vente' if ad.get('adType') == 'buy' else ad.get('adType', '')
-
-                normalized = self.normalize_ad(
-                    id=ad.get('id'),
-                    source="bienici",
-                    url=f"https://www.bienici.com/annonce/{ad.get('id')}" if ad.get('id') else None,
-                    title=ad.get('title'),
-                    description=ad.get('description'),
-                    property_type=property_type,
-                    transaction_type=transaction_type,
-                    price=ad.get('price'),
-                    city=ad.get('city'),
-                    postal_code=ad.get('postalCode'),
-                    surface=ad.get('surfaceArea'),
-                    rooms=ad.get('roomsQuantity'),
-                    bedrooms=ad.get('bedroomsQuantity'),
-                    photos=photos,
-                    agency_name=ad.get('accountDisplayName'),
-                    agency_phone=None,
-                    created_at=created_at,
-                    updated_at=updated_at,
-                )
-                
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                
-                saved_count += 1
-                
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('id', 'unknown')}: {str(e)}")
-                continue
-        
-        return saved_count
+        ads = self.normalize_ads(self.map_ads(ads_data.get('realEstateAds', [])))
+        self.save_ads(ads)
+        return len(ads)
     
+    def fetch_page(self, page, shard="default"):
+        self.logger.debug(f"Fetching listings from BienICI... (Page {page})")
+        return self.fetch_with_retry(lambda: self.getAds(page=page, pageSize=self.page_size, sortBy=self.sort_by), page)
+
+    def process_page(self, response, page, shard="default"):
+        total = response.get('total', 0)
+        if total > self.total_ads_found: self.total_ads_found = total
+
+        ads_count = len(response.get('realEstateAds', []))
+        self.logger.debug(f"Found {ads_count} ads on page {page}")
+
+        saved_count = self.normalize_and_save_ads(response)
+        self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        self.add_scrapped(saved_count)
+
+    def probe_page(self, size):
+        data = self.getAds(page=1, pageSize=size, sortBy=self.sort_by)
+        return [ad.get('id') for ad in data.get('realEstateAds', [])] if data else None
+
+    def listing_query(self):
+        return self.sort_by
+
     def start(self):
         if not self.enabled:
             raise Exception("This module is currently disabled.")
 
-        page = 1
-        page_size = 24
-        max_pages = 999999
-        
-        while True:
-            self.logger.info(f"Fetching listings from BienICI... (Page {page})")
+        self.calibrate_page_size()
 
-            response = self.getAds(page=page, pageSize=page_size)
+        self.sort_by = "publicationDate" if self.incremental_run() else "relevance"
+        first_response = self.fetch_page(1)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return
 
-            if response == False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before retrying...')
-                self.set_random_proxy()
-                time.sleep(5)
-                continue
 
-            total = response.get('total', 0)
-            max_pages = response.get('total', 0) / page_size
+        total = first_response.get('total', 0)
+        self.logger.info(f"Total ads to fetch: {total}")
+        self.process_page(first_response, 1)
 
-            if total > self.total_ads_found: self.total_ads_found = total
-            self.logger.info(f"Total ads to fetch: {total}")
-     
-            ads_count = len(response.get('realEstateAds', []))
-            self.logger.info(f"Found {ads_count} ads on page {page}")
-            
-            saved_count = self.normalize_and_save_ads(response)
-            self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
-            self.current_scrapped_ads += saved_count
-            
-            if ads_count < page_size or page >= max_pages:
-                if page >= max_pages:
-                    self.logger.info(f"Reached maximum pages limit ({max_pages})")
-                else:
-                    self.logger.info("Reached end of listings")
-                break
-            
-            page += 1
-        
+        total_pages = (total + self.page_size - 1) // self.page_size
+        self.crawl_pages(range(2, total_pages + 1), self.fetch_page, self.process_page)
+
+        self.flush_ads()
         self.logger.success(f"Finished! Total ads saved: {self.current_scrapped_ads}")
\ No newline at end of file
@@ -1,14 +1,56 @@
 from . import CrawlerModule
 from .utils.logger import Logger
-import time
+from .utils.mapping import FieldMapper, Const, Computed
 from datetime import datetime
 
+PROPERTY_TYPES = {
+    'house': 'maison',
+    'apartment': 'appartement',
+    'land': 'terrain',
+    'parking': 'parking',
+    'business': 'local commercial',
+    'building': 'immeuble'
+}
+
+
+def property_type(ad, row):
+    kind = ad.get('propertyType', '')
+    return PROPERTY_TYPES.get(kind, ad.get('propertyDisplayType', kind))
+
+
+def url(ad, row):
+    slug = (ad.get('slugs') or {}).get('fr')
+    return f"https://www.iadfrance.fr/annonce/{slug}/r{row['id']}" if slug else None
+
+
+def title(ad, row):
+    return f"{(row['property_type'] or '').capitalize()} {row['rooms'] or '?'} pièce(s) {row['surface'] or '?'} m²"
+
+
 class IADFranceModule(CrawlerModule):
 
+    mapper = FieldMapper({
+        "id": "propertyListingRef",
+        "source": Const("iadfrance"),
+        "description": "description",
+        "transaction_type": Const("vente"),
+        "price": "prices.main",
+        "city": "location.place",
+        "postal_code": "location.postcode",
+        "surface": "surfaces[type=living-area].value",
+        "rooms": "rooms[type=rooms].value",
+        "photos": "photos",
+        "agency_name": "agent.fullName",
+        "property_type": Computed(property_type, reads=("propertyType", "propertyDisplayType")),
+        "url": Computed(url, reads=("slugs.fr",)),
+        "title": Computed(title)
+    })
+
     def __init__(self):
         super().__init__("IADFrance", "This is a module for iadfrance.fr", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://www.iadfrance.fr"
+        self.page_size = 100
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -35,7 +77,7 @@ class IADFranceModule(CrawlerModule):
             resp = self.tls_session.get(url, params=params)
 
             if resp.status_code == 200:
-                data = resp.json()
+                data = self.parse_json(resp)
                 return data
             else:
                 self.logger.error(f"HTTP Error: {resp.status_code}")
@@ -50,134 +92,54 @@ class IADFranceModule(CrawlerModule):
             self.logger.warning("No ads data found in response")
             return 0
         
-        ads = ads_data.get('items', [])
-        saved_count = 0
-        
-        for ad in ads:
-            try:
-                photos = ad.get('photos', [])
-                
-                property_type_mapping = {
-                    'house': 'maison',
-                    'apartment': 'appartement',
-                    'land': 'terrain',
-                    'parking': 'parking',
-                    'business': 'local commercial',
-                    'building': 'immeuble'
-                }
-                
-                property_type = property_type_mapping.get(
-                    ad.get('propertyType', ''), 
-                    ad.get('propertyDisplayType', ad.get('propertyType', ''))
-                )
-
-                location = ad.get('location', {})
-                surfaces = ad.get('surfaces', [])
-                rooms = ad.get('rooms', [])
-                prices = ad.get('prices', {})
-                agent = ad.get('agent', {})
-                
-                living_area = None
-                plot_area = None
-                for surface in surfaces:
-                    if surface.get('type') == 'living-area':
-                        living_area = surface.get('value')
-                    elif surface.get('type') == 'plot-area':
-                        plot_area = surface.get('value')
-                
-                room_count = None
-                for room in rooms:
-                    if room.get('type') == 'rooms':
-                        room_count = room.get('value')
-                
-                property_ref = ad.get('propertyListingRef')
-                slug = ad.get('slugs', {}).get('fr', '')
-                
-                url = f"https://www.iadfrance.fr/annonce/{slug}/r{property_ref}" if slug else None
-                
-                normalized = self.normalize_ad(
-                    id=property_ref,
-                    source="iadfrance",
-                    url=url,
-                    title=f"{property_type.capitalize()} {room_count or '?'} pièce(s) {living_area or '?'} m²",
-                    description=ad.get('description', ''),
-                    property_type=property_type,
-                    transaction_type='vente',
-                    price=prices.get('main'),
-                    city=location.get('place'),
-                    postal_code=location.get('postcode'),
-                    surface=living_area,
-                    rooms=room_count,
-                    bedrooms=None,
-                    photos=photos,
-                    agency_name=agent.get('fullName'),
-                    agency_phone=None,
-                    created_at=None,
-                    updated_at=None,
-                )
-                
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                
-                saved_count += 1
-                
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('propertyListingRef', 'unknown')}: {str(e)}")
-                continue
-        return saved_count
+        ads = self.normalize_ads(self.map_ads(ads_data.get('items', [])))
+        self.save_ads(ads)
+        return len(ads)
     
+    def fetch_page(self, page, shard="default"):
+        self.logger.debug(f"Fetching listings from IAD France... (Page {page})")
+        return self.fetch_with_retry(lambda: self.getAds(page=page, pageSize=self.page_size), page)
+
+    def total_items(self, response):
+        return response.get('totalItems', 0)
+
+    def process_page(self, response, page, shard="default"):
+        total_items = self.total_items(response)
+        if total_items > self.total_ads_found:
+            self.total_ads_found = total_items
+
+        ads_count = len(response.get('items', []))
+        self.logger.debug(f"Found {ads_count} ads on page {page}")
+
+        saved_count = self.normalize_and_save_ads(response)
+
+        self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        self.add_scrapped(saved_count)
+
+    def probe_page(self, size):
+        data = self.getAds(page=1, pageSize=size)
+        return [ad.get('propertyListingRef') for ad in data.get('items', [])] if data else None
+
     def start(self):
         if not self.enabled:
             raise Exception("This module is currently disabled.")
 
-        page = 1
-        page_size = 100
-        total_saved = 0
-        
-        while True:
-            self.logger.info(f"Fetching listings from IAD France... (Page {page})")
+        self.calibrate_page_size()
 
-            response = self.getAds(page=page, pageSize=page_size)
-            
-            if response is False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before retrying...')
-                self.set_random_proxy()
-                time.sleep(5)
-                continue
-            
-            total_items = response.get('totalItems', 0)
-            if total_items > self.total_ads_found:
-                self.total_ads_found = total_items
-                
-            self.logger.info(f"Total ads available: {total_items}")
-            
-            items = response.get('items', [])
+        scrapped_before = self.current_scrapped_ads
 
-            # if not items:
-            #     self.logger.info("No more ads found, stopping...")
-            #     break
-            
-            ads_count = len(items)
-            self.logger.info(f"Found {ads_count} ads on page {page}")
-            
-            saved_count = self.normalize_and_save_ads(response)
-            total_saved += saved_count
-            
-            self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
-            self.current_scrapped_ads += saved_count
-            
-            if ads_count < page_size:
-                self.logger.info("Reached end of listings")
-                break
-            
-            if total_saved >= total_items and total_saved > 0  :
-                self.logger.info("All available ads have been processed")
-                break
-            
-            page += 1
-        
+        first_response = self.fetch_page(1)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return
+
+        total_items = self.total_items(first_response)
+        self.logger.info(f"Total ads available: {total_items}")
+        self.process_page(first_response, 1)
+
+        total_pages = (total_items + self.page_size - 1) // self.page_size
+        self.crawl_pages(range(2, total_pages + 1), self.fetch_page, self.process_page)
+        total_saved = self.current_scrapped_ads - scrapped_before
+
+        self.flush_ads()
         self.logger.success(f"Finished! Total ads saved: {total_saved}")
-        
\ No newline at end of file
@@ -1,14 +1,42 @@
 from . import CrawlerModule
 import urllib.parse
 from .utils.logger import Logger
-import time
+from .utils.mapping import FieldMapper, Path, Const
+
+PROPERTY_TYPES = {
+    "APARTMENT": "appartement",
+    "HOUSE": "maison"
+}
+
 
 class ImmobilierFranceModule(CrawlerModule):
 
+    rate_limit = {"rate": 1.0, "min_rate": 0.1, "max_rate": 5.0}
+
+    mapper = FieldMapper({
+        "id": "_id",
+        "source": Const("immobilier_france"),
+        "url": Path("_id", convert=lambda ad_id: f"https://www.immobilier-france.fr/search/{ad_id}"),
+        "title": "title",
+        "description": "generatedDescription",
+        "property_type": Path("typeOfProperty", values=PROPERTY_TYPES),
+        "transaction_type": Const("vente"),
+        "price": "price",
+        "city": "city",
+        "postal_code": "postal",
+        "surface": "surfaceArea",
+        "rooms": "countRooms",
+        "bedrooms": "countBedrooms",
+        "photos": "pictures",
+        "created_at": "lastCrawlAt",
+        "updated_at": "lastCrawlAt"
+    })
+
     def __init__(self):
         super().__init__("ImmobilierFrance", "Module for immobilier-france.fr", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://api.immobilier-france.fr"
+        self.page_size = 20
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -32,13 +60,13 @@ class ImmobilierFranceModule(CrawlerModule):
             }
             resp = self.tls_session.get(url, params=params)
             if resp.status_code == 200:
-                return resp.json().get("total", 0)
+                return self.parse_json(resp).get("total", 0)
             else:
                 self.logger.error(f"Failed to fetch total ads count. HTTP {resp.status_code}")
-                return 0
+                return None
         except Exception as e:
             self.logger.error(f"Error getting total ads count: {str(e)}")
-            return 0
+            return None
 
     def getAds(self, page: int = 1, pageSize: int = 20):
         try:
@@ -51,7 +79,7 @@ class ImmobilierFranceModule(CrawlerModule):
             }
             resp = self.tls_session.get(url, params=params)
             if resp.status_code == 200:
-                return resp.json()
+                return self.parse_json(resp)
             else:
                 self.logger.error(f"HTTP Error: {resp.status_code}")
                 return False
@@ -64,92 +92,48 @@ class ImmobilierFranceModule(CrawlerModule):
             self.logger.warning("No ads data found in response")
             return 0
 
-        saved_count = 0
-
-        for ad in ads_data:
-            try:
-                property_type_mapping = {
-                    "APARTMENT": "appartement",
-                    "HOUSE": "maison"
-                }
-                property_type = property_type_mapping.get(ad.get("typeOfProperty"), ad.get("typeOfProperty"))
-
-                normalized = self.normalize_ad(
-                    id=ad.get("_id"),
-                    source="immobilier_france",
-                    url=f"https://www.immobilier-france.fr/search/{ad.get('_id')}",
-                    title=ad.get("title"),
-                    description=ad.get("generatedDescription"),
-                    property_type=property_type,
-                    transaction_type="vente",
-                    price=ad.get("price"),
-                    city=ad.get("city"),
-                    postal_code=ad.get("postal"),
-                    surface=ad.get("surfaceArea"),
-                    rooms=ad.get("countRooms"),
-                    bedrooms=ad.get("countBedrooms"),
-                    photos=ad.get("pictures", []),
-                    agency_name=None,
-                    agency_phone=None,
-                    created_at=ad.get("lastCrawlAt"),
-                    updated_at=ad.get("lastCrawlAt")
-                )
-
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                saved_count += 1
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('_id', 'unknown')}: {str(e)}")
-
-        return saved_count
-
-    def start(self):
-        if not self.enabled:
-            raise Exception("This module is currently disabled.")
+        ads = self.normalize_ads(self.map_ads(ads_data))
+        self.save_ads(ads)
+        return len(ads)
 
-        page = 1
-        page_size = 20
-        total_saved = 0
-        total_ads = self.get_total_ads()
-        if total_ads > self.total_ads_found:
-            self.total_ads_found = total_ads
+    def fetch_page(self, page, shard="default"):
+        self.logger.debug(f"Fetching listings from Immobilier France... (Page {page})")
+        return self.fetch_with_retry(lambda: self.getAds(page=page, pageSize=self.page_size), page)
 
-        while True:
-            self.logger.info(f"Fetching listings from Immobilier France... (Page {page})")
-            response = self.getAds(page=page, pageSize=page_size)
+    def process_page(self, response, page, shard="default"):
+        ads_count = len(response)
+        self.logger.debug(f"Found {ads_count} ads on page {page}")
 
-            if response is False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before retrying...')
-                self.set_random_proxy()
-                time.sleep(5)
-                continue
+        saved_count = self.normalize_and_save_ads(response)
 
-            # if not response:
-            #     self.logger.info("No more ads found, stopping...")
-            #     break
+        self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        self.add_scrapped(saved_count)
 
-            ads_count = len(response)
-            self.logger.info(f"Found {ads_count} ads on page {page}")
+    def probe_page(self, size):
+        data = self.getAds(page=1, pageSize=size)
+        return [ad.get('_id') for ad in data] if data else None
 
-            saved_count = self.normalize_and_save_ads(response)
-            total_saved += saved_count
+    def start(self):
+        if not self.enabled:
+            raise Exception("This module is currently disabled.")
 
-            self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
-            self.current_scrapped_ads += saved_count
+        self.calibrate_page_size()
 
-            if ads_count < page_size:
-                self.logger.info("Reached end of listings")
-                break
+        # without the total the page count is unknown, and a partial crawl would pass for a full sweep
+        total_ads = self.fetch_with_retry(self.get_total_ads, "count")
+        if total_ads is None:
+            self.logger.error("Could not fetch the total ads count, stopping.")
+            return 0
+        if total_ads > self.total_ads_found:
+            self.total_ads_found = total_ads
 
-            if total_saved >= total_ads and total_saved > 0  :
-                self.logger.info("All available ads have been processed")
-                break
+        total_pages = max(1, (total_ads + self.page_size - 1) // self.page_size)
+        self.logger.info(f"Total ads available: {total_ads} ({total_pages} page(s))")
 
-            page += 1
-            time.sleep(1)
+        scrapped_before = self.current_scrapped_ads
+        self.crawl_pages(range(1, total_pages + 1), self.fetch_page, self.process_page)
+        total_saved = self.current_scrapped_ads - scrapped_before
 
+        self.flush_ads()
         self.logger.success(f"Finished! Total ads saved: {total_saved}")
         return total_saved
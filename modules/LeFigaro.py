@@ -3,16 +3,47 @@
 from . import CrawlerModule # Super class for Module
 import urllib.parse
 from .utils.logger import Logger
-import time
+from .utils.mapping import FieldMapper, Const, Computed
+from .utils.sharding import Shard
+
+
+def title(ad, row):
+    return f"{str(ad.get('transaction')).capitalize()} {ad.get('type')} {ad.get('roomCountLabel') or ''} {int(ad.get('area')) or '?'} m²"
 
 # Crawler
 
 class LeFigaroModule(CrawlerModule):
 
+    max_pages = 100 # the site doesn't page further
+
+    mapper = FieldMapper({
+        "id": "id",
+        "source": Const("lefigaro"),
+        "url": "recordLink",
+        "description": "description",
+        "property_type": "type",
+        "transaction_type": "transaction",
+        "price": "price",
+        "city": "location.city",
+        "postal_code": "location.postalCode",
+        "surface": "area",
+        "rooms": "roomCount.0",
+        "bedrooms": "bedRoomCount",
+        "photos": "images.photos[].url.medium",
+        "agency_name": "client.brandName",
+        "agency_phone": "client.phoneNumber",
+        "created_at": "creationDate",
+        "updated_at": "updatedAt",
+        "title": Computed(title, reads=("transaction", "type", "roomCountLabel", "area"))
+    })
+
     def __init__(self):
         super().__init__("LeFigaro", "This is a module for immobilier.lefigaro.fr", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://immobilier.lefigaro.fr"
+        self.page_size = 30
+        self.total_pages = self.max_pages
+        self.shards = {}
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -42,116 +73,91 @@ class LeFigaroModule(CrawlerModule):
 
 
 
-    def getAds(self, query: str, page: int=1, pageSize: int=31):
+    def getAds(self, query: str, page: int=1, pageSize: int=31, priceMin: int=None, priceMax: int=None):
         try:
             query = urllib.parse.quote(query)
+            prices = ""
+            if priceMin is not None:
+                prices += f"&priceMin={priceMin}"
+            if priceMax is not None:
+                prices += f"&priceMax={priceMax}"
             resp = self.tls_session.get(
-                f"{self.base_url}/web/classifieds?location={query}&transaction=vente&path=/annonces/immobilier-vente-bien-france.html&currentPage={page}&pageSize={pageSize}"
+                f"{self.base_url}/web/classifieds?location={query}&transaction=vente&path=/annonces/immobilier-vente-bien-france.html&currentPage={page}&pageSize={pageSize}{prices}"
             )
+            if resp.status_code != 200:
+                return False
 
-            return resp.json()
+            return self.parse_json(resp)
         except:
             return False
     
+    def getShardAds(self, shard, page: int=1, pageSize: int=31):
+        return self.getAds(shard.department or 'France', page=page, pageSize=pageSize, priceMin=shard.price_min, priceMax=shard.price_max)
+
+    def count_shard(self, shard):
+        data = self.getShardAds(shard, page=1, pageSize=1)
+        return data.get("total") if data else None
+
+    def probe_page(self, size):
+        data = self.getAds('France', page=1, pageSize=size)
+        return [ad.get('id') for ad in data.get('classifieds', [])] if data else None
+
     def start(self):
         if not self.enabled:
             raise Exception("This module is currently disabled.")
 
-        while True:
-            self.logger.info("Fetching listings from LeFigaro...")
+        self.calibrate_page_size()
 
-            page = 1
-            page_size = 30
+        self.logger.info("Fetching listings from LeFigaro...")
+
+        page = 1
+
+        first_response = self.fetch_with_retry(lambda: self.getAds('France', page=page, pageSize=self.page_size), page)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return
 
-            first_response = self.getAds('France', page=page, pageSize=page_size)
-            
-            if first_response == False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before restarting...')
-                self.set_random_proxy()
-                time.sleep(5)
-            else:
-                break
-        
         total = first_response.get("total", 0)
         self.total_ads_found = total
 
         classifieds = first_response.get("classifieds", [])
         
         self.logger.info(f"Total ads to fetch: {total}")
-        
-        self._process_ads(classifieds, page)
 
-        total_pages = 100 # max
+        self.shards = self.plan_shards(self.count_shard, total)
+        if self.shards:
+            self.crawl_shards({key: self.shard_pages(shard) for key, shard in self.shards.items()}, self.fetch_page, self.process_page)
+        else:
+            self._process_ads(classifieds, page)
 
-        for p in range(page+1, total_pages + 1):
-            self.logger.info(f"Fetching page {p} of {total_pages}...")
-            try:
-                response = self.getAds('France', page=p, pageSize=page_size)
-                if isinstance(response, dict):
-                    classifieds = response.get("classifieds", [])
-                    self._process_ads(classifieds, p)
-            except Exception as e:
-                self.logger.error(f"Error fetching page {p}: {e}")
-                continue
+            self.total_pages = min(self.max_pages, (total + self.page_size - 1) // self.page_size)
+            self.crawl_pages(range(page+1, self.total_pages + 1), self.fetch_page, self.process_page)
 
+        self.flush_ads()
         self.logger.success("All ads have been normalized and saved to the database.")
 
 
+    def fetch_page(self, page, shard="default"):
+        search = Shard.from_key(shard)
+        if search is not None:
+            self.logger.debug(f"Fetching {shard} page {page}...")
+            return self.fetch_with_retry(lambda: self.getShardAds(search, page=page, pageSize=self.page_size), page)
+
+        self.logger.debug(f"Fetching page {page} of {self.total_pages}...")
+        return self.fetch_with_retry(lambda: self.getAds('France', page=page, pageSize=self.page_size), page)
+
+    def process_page(self, response, page, shard="default"):
+        if isinstance(response, dict):
+            classifieds = response.get("classifieds", [])
+            self._process_ads(classifieds, page)
+
     def _process_ads(self, ads, page_num):
         """Process and save ads from a single page"""
         if not isinstance(ads, list):
             return
         
-        processed_count = 0
-        
-        for ad in ads:
-            if not isinstance(ad, dict):
-                continue
-                
-            try:
-                photos = []
-                images = ad.get('images', {})
-                if isinstance(images, dict):
-                    photos_data = images.get('photos', [])
-                    if isinstance(photos_data, list):
-                        photos = [photo.get('url', {}).get('medium') for photo in photos_data 
-                                    if isinstance(photo, dict) and photo.get('url', {}).get('medium')]
-
-                room_count = ad.get('roomCount', [])
-                rooms = room_count[0] if isinstance(room_count, list) and room_count else None
-
-                normalized = self.normalize_ad(
-                    id=ad.get('id'),
-                    source="lefigaro",
-                    url=ad.get('recordLink'),
-                    title=f"{str(ad.get('transaction')).capitalize()} {ad.get('type')} {ad.get('roomCountLabel') or ''} {int(ad.get('area')) or '?'} m²",
-                    description=ad.get('description'),
-                    property_type=ad.get('type'),
-                    transaction_type=ad.get('transaction'),
-                    price=ad.get('price'),
-                    city=ad.get('location', {}).get('city'),
-                    postal_code=ad.get('location', {}).get('postalCode'),
-                    surface=ad.get('area'),
-                    rooms=rooms,
-                    bedrooms=ad.get('bedRoomCount'),
-                    photos=photos,
-                    agency_name=ad.get('client', {}).get('brandName'),
-                    agency_phone=ad.get('client', {}).get('phoneNumber'),
-                    created_at=ad.get('creationDate'),
-                    updated_at=ad.get('updatedAt'),
-                )
-                
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                
-                processed_count += 1
-                
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('id', 'unknown')}: {e}")
-                continue
-        
-        self.logger.success(f"Page {page_num}: Processed and saved {processed_count} ads to database")
-        self.current_scrapped_ads += processed_count 
+        ads = self.normalize_ads(self.map_ads(ads))
+        self.save_ads(ads)
+
+        self.logger.success(f"Page {page_num}: Processed and saved {len(ads)} ads to database")
+        self.add_scrapped(len(ads))
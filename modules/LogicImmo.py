@@ -1,19 +1,49 @@
 # Imports
 
 from . import CrawlerModule
-import json, time
 from .utils.logger import Logger
-from datetime import datetime
+from .utils.batcher import IdBatcher
+from .utils.mapping import FieldMapper, Const
+from .utils.sharding import Shard
 
 
 # Crawler
 
 class LogicImmoModule(CrawlerModule):
 
+    supports_newest_first = True
+
+    mapper = FieldMapper({
+        "id": "id",
+        "source": Const("logic-immo"),
+        "url": "url",
+        "title": "mainDescription.headline",
+        "description": "mainDescription.description",
+        "property_type": "rawData.propertyType",
+        "transaction_type": "rawData.distributionType",
+        "price": ("tracking.price", "rawData.price"),
+        "city": "location.address.city",
+        "postal_code": "location.address.zipCode",
+        "surface": "rawData.surface.main",
+        "rooms": "rawData.nbroom",
+        "bedrooms": "rawData.nbbedroom",
+        "photos": "gallery.images[].url",
+        "agency_name": "provider.intermediaryCard.title",
+        "agency_phone": "provider.phoneNumbers.0",
+        "created_at": "metadata.creationDate",
+        "updated_at": "metadata.updateDate"
+    })
+
     def __init__(self):
         super().__init__("LogicImmo", "Module for logic-immo.com property listings", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://www.logic-immo.com"
+        self.place_id = "AD02FR1"
+        self.page_size = 25
+        self.total_pages = 1
+        self.batcher = IdBatcher(self._fetch_details, size=50, name=f"{self.name}-Batcher")
+        self.order = "Default"
+        self.shards = {}
         self.logger.success("Module loaded.")
 
         self.set_random_proxy()
@@ -40,7 +70,7 @@ class LogicImmoModule(CrawlerModule):
             "x-language": "fr"
         })
 
-    def getAdsIds(self, place_id: str = "AD02FR1", page: int = 1, pageSize: int = 25):
+    def getAdsIds(self, place_id: str = "AD02FR1", page: int = 1, pageSize: int = 25, order: str = "Default", priceMin: int = None, priceMax: int = None):
         try:
             url = f"{self.base_url}/serp-bff/search"
 
@@ -53,16 +83,20 @@ class LogicImmoModule(CrawlerModule):
                 "paging": {
                     "page": page,
                     "size": pageSize,
-                    "order": "Default"
+                    "order": order
                 }
             }
+            if priceMin is not None or priceMax is not None:
+                payload["criteria"]["price"] = {"min": priceMin, "max": priceMax}
 
             response = self.tls_session.post(
                 url,
                 json=payload
             )
+            if response.status_code != 200:
+                return False
 
-            return response.json()
+            return self.parse_json(response)
         except:
             return False
     
@@ -70,129 +104,115 @@ class LogicImmoModule(CrawlerModule):
         try:
             list_arg = ",".join(ids)
             response = self.tls_session.get(f'{self.base_url}/classifiedList/{list_arg}')
-            return response.json()
+            if response.status_code != 200:
+                return False
+            return self.parse_json(response)
         except:
             return False
         
-    def _switch_proxy(self):
-        self.logger.warning('Error while fetching data, switching proxy, waiting 5s before restarting...')
-        self.set_random_proxy()
-        time.sleep(5)
+    def getShardAdsIds(self, shard, page: int = 1, pageSize: int = 25):
+        return self.getAdsIds(place_id=self.place_id, page=page, pageSize=pageSize, order=self.order, priceMin=shard.price_min, priceMax=shard.price_max)
+
+    def count_shard(self, shard):
+        data = self.getShardAdsIds(shard, page=1, pageSize=1)
+        return data.get("totalCount") if data else None
+
+    def probe_page(self, size):
+        data = self.getAdsIds(place_id=self.place_id, page=1, pageSize=size, order=self.order)
+        return [ad.get('id') for ad in data.get('classifieds', [])] if data else None
+
+    def drain(self):
+        self.batcher.flush()
+
+    def listing_query(self):
+        return f"{self.place_id}/{self.order}"
 
     def start(self):
         if not self.enabled:
             raise Exception("This module is currently disabled.")
-        
-        while True:
-            self.logger.info("Fetching listings from LogicImmo...")
 
-            place_id = "AD02FR1"
-            page = 1
-            pageSize = 25
+        self.calibrate_page_size()
+
+        self.logger.info("Fetching listings from LogicImmo...")
 
-            first_response = self.getAdsIds(place_id=place_id, page=page, pageSize=pageSize)
+        page = 1
+        pageSize = self.page_size
+        self.order = "DateDesc" if self.incremental_run() else "Default"
+        self.load_seen_index("logic-immo")
 
-            if first_response == False:
-                self._switch_proxy()
-            else:
-                break
+        first_response = self.fetch_with_retry(lambda: self.getAdsIds(place_id=self.place_id, page=page, pageSize=pageSize, order=self.order), page)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return
 
         total = first_response.get("totalCount", 0)
         self.total_ads_found = total
 
-        classifieds = first_response.get("classifieds", [])
-        page_1_ids = [ad.get('id') for ad in classifieds if isinstance(ad, dict) and ad.get('id')]
-
         self.logger.info(f"Total ads to fetch: {total}")
 
-        self._process_ads(page_1_ids, page)
+        # only price bands, the search has no department filter we can use
+        self.shards = self.plan_shards(self.count_shard, total, by_department=False)
+        if self.shards:
+            self.crawl_shards({key: self.shard_pages(shard) for key, shard in self.shards.items()}, self.fetch_page, self.process_page, process_workers=self.concurrency)
+        else:
+            classifieds = first_response.get("classifieds", [])
+            self._process_ads(self.skip_seen("logic-immo", self._listed(classifieds)), page)
+
+            self.total_pages = (total + pageSize - 1) // pageSize
+            if self.max_pages:
+                self.total_pages = min(self.total_pages, self.max_pages)
+            self.crawl_pages(range(2, self.total_pages + 1), self.fetch_page, self.process_page, process_workers=self.concurrency)
+        self.batcher.flush()
+
+        self.flush_ads()
+        self.logger.success("All ads have been normalized and saved to the database.")
+
+    def fetch_page(self, page, shard="default"):
+        search = Shard.from_key(shard)
+        if search is not None:
+            self.logger.debug(f"Fetching {shard} page {page}...")
+            return self.fetch_with_retry(lambda: self.getShardAdsIds(search, page=page, pageSize=self.page_size), page)
 
-        total_pages = (total + pageSize - 1) // pageSize
+        self.logger.debug(f"Fetching page {page} of {self.total_pages}...")
+        return self.fetch_with_retry(lambda: self.getAdsIds(place_id=self.place_id, page=page, pageSize=self.page_size, order=self.order), page)
 
-        for p in range(2, total_pages + 1):
-            self.logger.info(f"Fetching page {p} of {total_pages}...")
-            response = self.getAdsIds(place_id=place_id, page=p, pageSize=pageSize)
+    def process_page(self, response, page, shard="default"):
+        if isinstance(response, dict):
+            classifieds = response.get("classifieds", [])
+            page_ids = self.skip_seen("logic-immo", self._listed(classifieds))
 
-            if isinstance(response, dict):
-                classifieds = response.get("classifieds", [])
-                page_ids = [ad.get('id') for ad in classifieds if isinstance(ad, dict) and ad.get('id')]
-            
-                self._process_ads(page_ids, p)
-            else:
-                self._switch_proxy()
+            self._process_ads(page_ids, page)
 
-        self.logger.success("All ads have been normalized and saved to the database.")
+    def _listed(self, classifieds):
+        """(id, updateDate) of the search results."""
+        return [
+            (ad.get('id'), (ad.get('metadata') or {}).get('updateDate'))
+            for ad in classifieds if isinstance(ad, dict) and ad.get('id')
+        ]
 
     def _process_ads(self, ad_ids, page_num):
         if not ad_ids:
             return
-        
-        self.logger.info(f"Processing {len(ad_ids)} ads from page {page_num}...")
-        
-        chunk_size = 50
-        processed_count = 0
-        
-        for i in range(0, len(ad_ids), chunk_size):
-            chunk = ad_ids[i:i+chunk_size]
-            self.logger.info(f"Page {page_num}: Fetching details for ads {i + 1} to {i + len(chunk)}...")
-            
-            try:
-                ads_data = self.getAdsById(chunk)
-                if isinstance(ads_data, list):
-                    ads_list = [ad for ad in ads_data if isinstance(ad, dict)]
-                elif isinstance(ads_data, dict) and ads_data.get("classifieds"):
-                    ads_list = [ad for ad in ads_data.get("classifieds", []) if isinstance(ad, dict)]
-                else:
-                    continue
-                
-                for ad in ads_list:
-                    try:
-                        photos = []
-                        gallery = ad.get('gallery', {})
-                        if isinstance(gallery, dict):
-                            images = gallery.get('images', [])
-                            if isinstance(images, list):
-                                photos = [img.get('url') for img in images if isinstance(img, dict) and img.get('url')]
-
-                        phone_numbers = ad.get('provider', {}).get('phoneNumbers', [])
-                        agency_phone = phone_numbers[0] if isinstance(phone_numbers, list) and phone_numbers else None
-
-                        normalized = self.normalize_ad(
-                            id=ad.get('id'),
-                            source="logic-immo",
-                            url=ad.get('url'),
-                            title=ad.get('mainDescription', {}).get('headline'),
-                            description=ad.get('mainDescription', {}).get('description'),
-                            property_type=ad.get('rawData', {}).get('propertyType'),
-                            transaction_type=ad.get('rawData', {}).get('distributionType'),
-                            price=ad.get('tracking', {}).get('price') or ad.get('rawData', {}).get('price'),
-                            city=ad.get('location', {}).get('address', {}).get('city'),
-                            postal_code=ad.get('location', {}).get('address', {}).get('zipCode'),
-                            surface=ad.get('rawData', {}).get('surface', {}).get('main') if ad.get('rawData', {}).get('surface') else None,
-                            rooms=ad.get('rawData', {}).get('nbroom'),
-                            bedrooms=ad.get('rawData', {}).get('nbbedroom'),
-                            photos=photos,
-                            agency_name=ad.get('provider', {}).get('intermediaryCard', {}).get('title'),
-                            agency_phone=agency_phone,
-                            created_at=ad.get('metadata', {}).get('creationDate'),
-                            updated_at=ad.get('metadata', {}).get('updateDate'),
-                        )
-                        
-                        self._shared_db.get_collection("ads").update_one(
-                            {"id": normalized["id"]},
-                            {"$set": normalized},
-                            upsert=True
-                        )
-                        
-                        processed_count += 1
-                        
-                    except Exception as e:
-                        self.logger.error(f"Error normalizing ad {ad.get('id', 'unknown')}: {e}")
-                        continue
-                        
-            except Exception as e:
-                self.logger.error(f"Error fetching chunk from page {page_num}: {e}")
-                continue
-        
-        self.logger.success(f"Page {page_num}: Processed and saved {processed_count} ads to database")
-        self.current_scrapped_ads += processed_count
\ No newline at end of file
+
+        self.logger.debug(f"Page {page_num}: Queuing {len(ad_ids)} ads for details...")
+        self.batcher.add(ad_ids, self.defer_page())
+
+    def _fetch_details(self, ad_ids):
+        self.logger.debug(f"Fetching details for {len(ad_ids)} ads...")
+
+        ads_data = self.getAdsById(ad_ids)
+        if isinstance(ads_data, list):
+            ads_list = [ad for ad in ads_data if isinstance(ad, dict)]
+        elif isinstance(ads_data, dict) and ads_data.get("classifieds"):
+            ads_list = [ad for ad in ads_data.get("classifieds", []) if isinstance(ad, dict)]
+        else:
+            return self.tls_session.last_status
+
+        ads = self.normalize_ads(self.map_ads(ads_list))
+        self.save_ads(ads)
+        for ad in ads:
+            self.seen.add(ad.id, ad.updated_at)
+
+        self.logger.success(f"Processed and saved {len(ads)} ads to database")
+        self.add_scrapped(len(ads))
+        return True
@@ -1,15 +1,49 @@
 from . import CrawlerModule
 import urllib.parse
 from .utils.logger import Logger
-import time
-from datetime import datetime
+from .utils.mapping import FieldMapper, Path, Const, Computed
+
+PROPERTY_TYPES = {
+    'TER': 'terrain',
+    'APP': 'appartement',
+    'MAI': 'maison',
+    'LOC': 'local commercial'
+}
+
+
+def title(ad, row):
+    return f"{(row['property_type'] or '').capitalize()} {row['rooms'] or '?'} pièce(s) {row['surface'] or '?'} m²"
+
 
 class NotairesFranceModule(CrawlerModule):
 
+    rate_limit = {"rate": 1.0, "min_rate": 0.1, "max_rate": 5.0}
+
+    mapper = FieldMapper({
+        "id": "annonceId",
+        "source": Const("notaires_france"),
+        "url": "urlDetailAnnonceFr",
+        "description": "descriptionFr",
+        "property_type": Path("typeBien", values=PROPERTY_TYPES),
+        "transaction_type": Path("typeTransaction", default="vente", convert=str.lower),
+        "price": "prixAffiche",
+        "city": "communeNom",
+        "postal_code": "codePostal",
+        "surface": "surface",
+        "rooms": "nbPieces",
+        "bedrooms": "nbChambres",
+        "photos": Path("urlPhotoPrincipale", convert=lambda photo: [photo] if photo else None),
+        "agency_phone": "telephone",
+        "created_at": "dateCreation",
+        "updated_at": "dateMaj",
+        "title": Computed(title)
+    })
+
     def __init__(self):
         super().__init__("NotairesFrance", "Module for immobilier.notaires.fr", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://www.immobilier.notaires.fr"
+        self.page_size = 100
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -37,7 +71,7 @@ class NotairesFranceModule(CrawlerModule):
             resp = self.tls_session.get(url, params=params)
 
             if resp.status_code == 200:
-                return resp.json()
+                return self.parse_json(resp)
             else:
                 self.logger.error(f"HTTP Error: {resp.status_code}")
                 return False
@@ -51,101 +85,55 @@ class NotairesFranceModule(CrawlerModule):
             self.logger.warning("No ads data found in response")
             return 0
 
-        saved_count = 0
-
-        for ad in ads:
-            try:
-                property_type_mapping = {
-                    'TER': 'terrain',
-                    'APP': 'appartement',
-                    'MAI': 'maison',
-                    'LOC': 'local commercial'
-                }
-                
-                property_type = property_type_mapping.get(ad.get('typeBien'), ad.get('typeBien'))
-                
-                normalized = self.normalize_ad(
-                    id=str(ad.get('annonceId')),
-                    source="notaires_france",
-                    url=ad.get('urlDetailAnnonceFr'),
-                    title=f"{property_type.capitalize()} {ad.get('nbPieces') or '?'} pièce(s) {ad.get('surface') or '?'} m²",
-                    description=ad.get('descriptionFr', ''),
-                    property_type=property_type,
-                    transaction_type=ad.get('typeTransaction', 'vente').lower(),
-                    price=ad.get('prixAffiche'),
-                    city=ad.get('communeNom'),
-                    postal_code=ad.get('codePostal'),
-                    surface=ad.get('surface'),
-                    rooms=ad.get('nbPieces'),
-                    bedrooms=ad.get('nbChambres'),
-                    photos=[ad.get('urlPhotoPrincipale')] if ad.get('urlPhotoPrincipale') else [],
-                    agency_name=None,
-                    agency_phone=ad.get('telephone'),
-                    created_at=ad.get('dateCreation'),
-                    updated_at=ad.get('dateMaj'),
-                )
-
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                saved_count += 1
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('annonceId', 'unknown')}: {str(e)}")
-
-        return saved_count
+        ads = self.normalize_ads(self.map_ads(ads))
+        self.save_ads(ads)
+        return len(ads)
 
-    def start(self):
-        if not self.enabled:
-            raise Exception("This module is currently disabled.")
-
-        page = 1
-        page_size = 100
-        total_saved = 0
+    def fetch_page(self, page, shard="default"):
+        self.logger.debug(f"Fetching listings from Notaires France... (Page {page})")
+        return self.fetch_with_retry(lambda: self.getAds(page=page, pageSize=self.page_size), page)
 
-        while True:
-            self.logger.info(f"Fetching listings from Notaires France... (Page {page})")
-            response = self.getAds(page=page, pageSize=page_size)
+    def total_items(self, response):
+        return response.get('nbTotalAnnonces', 0)
 
-            if response is False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before retrying...')
-                self.set_random_proxy()
-                time.sleep(5)
-                continue
+    def process_page(self, response, page, shard="default"):
+        total_items = self.total_items(response)
+        if total_items > self.total_ads_found:
+            self.total_ads_found = total_items
 
-            total_items = response.get('nbTotalAnnonces', 0)
-            if total_items > self.total_ads_found:
-                self.total_ads_found = total_items
+        ads_count = len(response.get('annonceResumeDto', []))
+        self.logger.debug(f"Found {ads_count} ads on page {page}")
 
-            self.logger.info(f"Total ads available: {total_items}")
-            items = response.get('annonceResumeDto', [])
+        saved_count = self.normalize_and_save_ads(response)
 
-            
-            # if not items:
-            #     self.logger.info("No more ads found, stopping...")
-            #     break
+        self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        self.add_scrapped(saved_count)
 
-            ads_count = len(items)
-            self.logger.info(f"Found {ads_count} ads on page {page}")
+    def probe_page(self, size):
+        data = self.getAds(page=1, pageSize=size)
+        return [ad.get('annonceId') for ad in data.get('annonceResumeDto', [])] if data else None
 
-            saved_count = self.normalize_and_save_ads(response)
-            total_saved += saved_count
+    def start(self):
+        if not self.enabled:
+            raise Exception("This module is currently disabled.")
 
-            self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
-            self.current_scrapped_ads += saved_count
+        self.calibrate_page_size()
 
+        scrapped_before = self.current_scrapped_ads
 
-            if ads_count < page_size:
-                self.logger.info("Reached end of listings")
-                break
+        first_response = self.fetch_page(1)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return 0
 
-            if total_saved >= total_items and total_saved > 0  :
-                self.logger.info("All available ads have been processed")
-                break
+        total_items = self.total_items(first_response)
+        self.logger.info(f"Total ads available: {total_items}")
+        self.process_page(first_response, 1)
 
-            page += 1
-            time.sleep(1)
+        total_pages = (total_items + self.page_size - 1) // self.page_size
+        self.crawl_pages(range(2, total_pages + 1), self.fetch_page, self.process_page)
+        total_saved = self.current_scrapped_ads - scrapped_before
 
+        self.flush_ads()
         self.logger.success(f"Finished! Total ads saved: {total_saved}")
         return total_saved
@@ -1,14 +1,44 @@
 from . import CrawlerModule
 from .utils.logger import Logger
-from datetime import datetime
-import time
+from .utils.mapping import FieldMapper, Path, Const, Computed
+
+
+def piece_count(typologie):
+    # "T3" -> 3
+    count = typologie.replace("T", "")
+    return int(count) if "T" in typologie and count.isdigit() else None
+
+
+def title(ad, row):
+    return f"{ad.get('field_nature')} {ad.get('field_typologie_lot') or ''} - {row['surface'] or '?'} m²"
+
 
 class VinciImmobilierModule(CrawlerModule):
 
+    mapper = FieldMapper({
+        "id": "field_id_crm",
+        "source": Const("vinci_immobilier"),
+        "url": Path("id_programme", convert=lambda program: f"https://www.vinci-immobilier.com/programmes/{program}"),
+        "description": "field_programme",
+        "property_type": Path("field_nature", convert=str.lower),
+        "transaction_type": Const("vente"),
+        "price": Path("field_prix_tva_reduite", default=0, convert=lambda price: float(price or 0)),
+        "city": "ville",
+        "postal_code": "code_postal",
+        "surface": Path("field_surface_habitable", default=0, convert=float),
+        "rooms": Path("field_typologie_lot", convert=piece_count),
+        "agency_name": Const("Vinci Immobilier"),
+        "agency_phone": Const("+33 01 55 38 80 00"),
+        "created_at": "field_date_modification",
+        "updated_at": "field_date_modification",
+        "title": Computed(title, reads=("field_nature", "field_typologie_lot"))
+    })
+
     def __init__(self):
         super().__init__("VinciImmobilier", "Module for vinci-immobilier.com", True, False)
         self.logger = Logger(self.name)
         self.base_url = "https://www.vinci-immobilier.com"
+        self.page_size = 10
         self.logger.success('Module loaded.')
 
         self.set_random_proxy()
@@ -27,9 +57,9 @@ class VinciImmobilierModule(CrawlerModule):
             resp = self.tls_session.get(url)
 
             if resp.status_code == 200:
-                return resp.json()
+                return self.parse_json(resp)
             else:
-                print(resp.content)
+                self.logger.debug(resp.content)
                 self.logger.error(f"HTTP Error: {resp.status_code}")
                 return False
         except Exception as e:
@@ -42,89 +72,55 @@ class VinciImmobilierModule(CrawlerModule):
             self.logger.warning("No ads data found in response")
             return 0
 
-        saved_count = 0
-
-        for ad in ads:
-            try:
-                typologie = ad.get("field_typologie_lot", "")
-                surface = float(ad.get("field_surface_habitable", 0))
-                piece_count = typologie.replace("T", "") if typologie and "T" in typologie else None
-
-                normalized = self.normalize_ad(
-                    id=str(ad.get("field_id_crm")),
-                    source="vinci_immobilier",
-                    url=f"https://www.vinci-immobilier.com/programmes/{ad.get('id_programme')}",
-                    title=f"{ad.get('field_nature')} {typologie or ''} - {surface or '?'} m²",
-                    description=ad.get("field_programme", ""),
-                    property_type=ad.get("field_nature", "").lower(),
-                    transaction_type="vente",
-                    price=float(ad.get("field_prix_tva_reduite") or 0),
-                    city=ad.get("ville"),
-                    postal_code=ad.get("code_postal"),
-                    surface=surface,
-                    rooms=int(piece_count) if piece_count and piece_count.isdigit() else None,
-                    bedrooms=None,
-                    photos=[],
-                    agency_name="Vinci Immobilier",
-                    agency_phone="+33 01 55 38 80 00",
-                    created_at=ad.get("field_date_modification"),
-                    updated_at=ad.get("field_date_modification"),
-                )
-
-                self._shared_db.get_collection("ads").update_one(
-                    {"id": normalized["id"]},
-                    {"$set": normalized},
-                    upsert=True
-                )
-                saved_count += 1
-            except Exception as e:
-                self.logger.error(f"Error normalizing ad {ad.get('field_id_crm', 'unknown')}: {str(e)}")
-
-        return saved_count
+        ads = self.normalize_ads(self.map_ads(ads))
+        self.save_ads(ads)
+        return len(ads)
 
-    def start(self):
-        if not self.enabled:
-            raise Exception("This module is currently disabled.")
+    def fetch_page(self, page, shard="default"):
+        self.logger.debug(f"Fetching Vinci Immobilier ads... (Page {page})")
+        return self.fetch_with_retry(lambda: self.getAds(page=page, pageSize=self.page_size), page)
 
-        page = 1
-        page_size = 10
-        total_saved = 0
+    def total_items(self, response):
+        return int(response.get("pager", {}).get("total_items", 0))
 
-        while True:
-            self.logger.info(f"Fetching Vinci Immobilier ads... (Page {page})")
-            response = self.getAds(page=page, pageSize=page_size)
+    def process_page(self, response, page, shard="default"):
+        total_items = self.total_items(response)
+        if total_items > self.total_ads_found:
+            self.total_ads_found = total_items
 
-            if response is False:
-                self.logger.warning('Error while fetching data, switching proxy, waiting 5s before retrying...')
-                self.set_random_proxy()
-                time.sleep(5)
-                continue
+        ads_count = len(response.get("results", []))
+        self.logger.debug(f"Found {ads_count} ads on page {page}")
 
-            total_items = int(response.get("pager", {}).get("total_items", 0))
-            if total_items > self.total_ads_found:
-                self.total_ads_found = total_items
+        saved_count = self.normalize_and_save_ads(response)
 
-            items = response.get("results", [])
+        self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        self.add_scrapped(saved_count)
 
-            # if not items:
-            #     self.logger.info("No more ads found, stopping...")
-            #     break
+    def probe_page(self, size):
+        data = self.getAds(page=1, pageSize=size)
+        return [ad.get('field_id_crm') for ad in data.get('results', [])] if data else None
 
-            saved_count = self.normalize_and_save_ads(response)
-            total_saved += saved_count
-            self.current_scrapped_ads += saved_count
+    def start(self):
+        if not self.enabled:
+            raise Exception("This module is currently disabled.")
+
+        self.calibrate_page_size()
 
-            self.logger.success(f"Page {page}: Processed and saved {saved_count} ads to database")
+        scrapped_before = self.current_scrapped_ads
 
-            if len(items) < page_size:
-                self.logger.info("Reached end of listings")
-                break
+        first_response = self.fetch_page(1)
+        if first_response is None:
+            self.logger.error("Could not fetch the first page, stopping.")
+            return 0
 
-            if total_saved >= total_items and total_saved > 0  :
-                self.logger.info("All available ads have been processed")
-                break
+        total_items = self.total_items(first_response)
+        self.logger.info(f"Total ads available: {total_items}")
+        self.process_page(first_response, 1)
 
-            page += 1
+        total_pages = (total_items + self.page_size - 1) // self.page_size
+        self.crawl_pages(range(2, total_pages + 1), self.fetch_page, self.process_page)
+        total_saved = self.current_scrapped_ads - scrapped_before
 
+        self.flush_ads()
         self.logger.success(f"Finished! Total ads saved: {total_saved}")
         return total_saved
@@ -1,19 +1,94 @@
-import tls_client, random
-from typing import Optional, List, Dict, Any, Union
+import tls_client, threading, time
+from urllib.parse import urlparse
+from typing import Optional, List, Dict, Any, Union, Iterable
 from datetime import datetime
 
 from .utils.db import MongoDB
+from .utils.pipeline import Pipeline
+from .utils.http import HttpSession
+from .utils.archive import HttpArchives
+from .utils.codec import get_codec
+from .utils.record import Ad
+from .utils.mapping import FieldMapper
+from .utils.ratelimit import RateLimiters
+from .utils.retry import RetryPolicy
+from .utils.checkpoint import CheckpointStore
+from .utils.seen import SeenIndex
+from .utils.calibration import PageSizeProfile, calibrate
+from .utils.sharding import ShardPlanner
+from .utils.workqueue import open_work_queue
 from .utils.logger import Logger
+from .utils.metrics import REGISTRY
+from .utils.profiler import PROFILER
+from .utils.http import REQUESTS, REQUEST_SECONDS
 from .utils import proxy
 
+PARSE_SECONDS = REGISTRY.histogram("bestimmo_parse_seconds", "Time spent decoding response bodies", ("source",))
+STAGE_SECONDS = REGISTRY.histogram("bestimmo_page_seconds", "Time spent on a page per pipeline stage", ("source", "stage"))
+
 class CrawlerModule:
 
     _logger = Logger('Crawler')
     _shared_db = None
+    _shared_writer = None
+    _writer_lock = threading.Lock()
+    _proxy_pool = proxy.ProxyPool()
+    _rate_limiters = RateLimiters()
+    _checkpoints = None
+    _work_queue = None
+    _page_sizes = PageSizeProfile()
+    _archives = HttpArchives()
+
+    # per-source pacing, see AdaptiveRateLimiter for the keys
+    rate_limit = {"rate": 2.0, "min_rate": 0.1, "max_rate": 20.0}
+    # per-source retries, see RetryPolicy for the keys
+    retry = {"max_attempts": 3, "page_attempts": 3, "base_delay": 1.0, "max_delay": 30.0, "budget": 1000, "refill": 1.0}
+
+    # incremental mode: stop after `incremental_stop_pages` pages in a row of
+    # known, unchanged ads, with a full sweep every `full_sweep_interval` seconds.
+    # Only sources that can list newest first support it.
+    incremental = False
+    incremental_stop_pages = 3
+    full_sweep_interval = 24 * 3600
+    supports_newest_first = False
+
+    # page size calibration, see calibrate_page_size
+    max_page_size = 200
+    max_page_latency = 5.0
+    recalibrate = False
+
+    # deepest page a search can reach, searches past it get sharded (see plan_shards)
+    max_pages = None
+
+    # distributed crawl: pages are leased from a work queue shared by every
+    # worker given the same `crawl_id` (see WorkQueue) instead of crawled
+    # from the local checkpoints
+    work_queue = False
+    crawl_id = None
+    lease_seconds = 120
+
+    # HTTP transport: "live", "record" (every response saved to
+    # <http_archive_dir>/<name>.jsonl.gz) or "replay" (served from that file).
+    # Set before the modules are created, see HttpSession for replay_latency.
+    http_mode = "live"
+    http_archive_dir = "./state/http"
+    replay_latency = None
+
+    # decodes the response bodies, see codec.get_codec
+    json_codec = get_codec()
+
+    # maps the source's raw ads to normalize_ad arguments, see map_ads
+    mapper: Optional[FieldMapper] = None
+    # check every mapped ad for unmapped and mistyped fields, see report_mapping
+    validate_mappings = False
 
     def __init__(self, name: str, description: str, enabled: bool, proxyless: bool):
-        self.tls_session = tls_client.Session()
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self.retry_policy = RetryPolicy(**self.retry)
+        self.dead_letters = []
         self.name = name
+        self.tls_session = self._new_session()
         self.desc = description
         self.enabled = enabled
         self.proxyless = proxyless
@@ -21,6 +96,15 @@ class CrawlerModule:
         self.current_scrapped_ads = 0
         self.total_ads_found = 0
         self.current_proxy = None
+        self.concurrency = 1
+        self.pipeline = None
+        self.interrupted = False
+        self._worker_sessions = []
+        self._incremental_run = False
+        self._known_pages = {}
+        self._stopped_shards = set()
+        self._shard_count = 0
+        self.seen = None
 
         if CrawlerModule._shared_db is None:
             CrawlerModule._shared_db = MongoDB()
@@ -29,13 +113,544 @@ class CrawlerModule:
             except Exception as e:
                 CrawlerModule._logger.error(f"DB connection error: {e}")
 
+    @property
+    def tls_session(self):
+        # page workers each get their own session, everything else uses the module's one
+        return getattr(self._local, "session", None) or self._session
+
+    @tls_session.setter
+    def tls_session(self, session):
+        self._session = session
+
+    def _new_session(self):
+        archive = CrawlerModule._archives.get(f"{self.http_archive_dir}/{self.name}.jsonl.gz") if self.http_mode != "live" else None
+        return HttpSession(
+            tls_client.Session(), CrawlerModule._proxy_pool, CrawlerModule._rate_limiters, self.rate_limit, self.retry_policy,
+            source=self.name, archive=archive, mode=self.http_mode, replay_latency=self.replay_latency
+        )
+
+    def clone_session(self):
+        """New tls_client session with the same fingerprint and headers as the module's session."""
+        session = self._new_session()
+        session.client_identifier = self._session.client_identifier
+        session.random_tls_extension_order = self._session.random_tls_extension_order
+        session.headers.update(self._session.headers)
+        return session
+
+    def parse_json(self, response):
+        """Decode a JSON response straight from its bytes with json_codec, timing it in the source's metrics."""
+        started = time.perf_counter()
+        try:
+            with PROFILER.stage(self.name, "json"):
+                return self.json_codec.decode(response.content)
+        finally:
+            PARSE_SECONDS.observe(time.perf_counter() - started, source=self.name)
+
+    def add_scrapped(self, count: int):
+        with self._counter_lock:
+            self.current_scrapped_ads += count
+
+    def fetch_with_retry(self, fetch, page):
+        """
+        Call `fetch()` until it returns a usable response (anything but False or
+        None), switching proxy with a jittered backoff in between. Returns None
+        once the page's attempts or the run budget are spent; crawl_pages then
+        retries it at the end of the crawl.
+        """
+        policy = self.retry_policy
+        for attempt in range(policy.page_attempts):
+            response = fetch()
+            if response is not False and response is not None:
+                return response
+            if attempt + 1 >= policy.page_attempts or not policy.take():
+                break
+            delay = policy.backoff(attempt)
+            self.logger.warning(f'Error while fetching page {page}, switching proxy, retrying in {delay:.1f}s...')
+            self.set_random_proxy()
+            time.sleep(delay)
+        return None
+
+    def _get_checkpoints(self) -> CheckpointStore:
+        if CrawlerModule._checkpoints is None:
+            with CrawlerModule._writer_lock:
+                if CrawlerModule._checkpoints is None:
+                    CrawlerModule._checkpoints = CheckpointStore(CrawlerModule._shared_db)
+        return CrawlerModule._checkpoints
+
+    def _get_work_queue(self):
+        if CrawlerModule._work_queue is None:
+            with CrawlerModule._writer_lock:
+                if CrawlerModule._work_queue is None:
+                    CrawlerModule._work_queue = open_work_queue(CrawlerModule._shared_db, lease_seconds=self.lease_seconds)
+        return CrawlerModule._work_queue
+
+    def defer_page(self):
+        """
+        For process_page, when the page's ads are saved later on (e.g. by an
+        IdBatcher): the page is then only checkpointed once the returned
+        `done(ok)` is called. None outside of crawl_shards.
+        """
+        done = getattr(self._local, "page_sent", None)
+        if done is not None:
+            self._local.deferred = True
+        return done
+
+    def drain(self):
+        """Save what the deferred pages still hold, crawl_shards calls it once its pipeline is done."""
+
+    def listing_query(self) -> Optional[str]:
+        """
+        What the crawled pages list, for the checkpoints: sources that switch
+        sort orders (see incremental_run) return the current one.
+        """
+        return None
+
+    def progress(self) -> Dict[str, int]:
+        return {"total_ads": self.total_ads_found, "scrapped": self.current_scrapped_ads}
+
+    def _start_worker(self):
+        self._local.session = self.clone_session()
+        with self._counter_lock:
+            self._worker_sessions.append(self._local.session)
+        self.set_random_proxy()
+
+    def calibrate_page_size(self) -> int:
+        """
+        Switch to the largest page size the source handles well, as cached in
+        the page size profile. Sources without a profile entry (or with
+        `recalibrate` set) are probed first through their probe_page(size).
+        """
+        if not hasattr(self, "probe_page"):
+            return self.page_size
+
+        size = None if self.recalibrate else self._page_sizes.get(self.name)
+        if size is None:
+            self.logger.info(f"Calibrating page size ({self.page_size} to {self.max_page_size})...")
+            size, latency = calibrate(self.probe_page, self.page_size, self.max_page_size, self.max_page_latency, self.logger)
+            self._page_sizes.set(self.name, size, latency)
+            self.logger.info(f"Page size calibrated to {size} ({latency * 1000:.0f}ms per page).")
+
+        self.page_size = size
+        return size
+
+    def incremental_run(self) -> bool:
+        """
+        Whether this crawl can stop at already-known listings: incremental mode
+        is on, the source lists newest first and the last full sweep is recent.
+        """
+        self._incremental_run = False
+        if not (self.incremental and self.supports_newest_first):
+            return False
+
+        last_sweep = self._get_checkpoints().last_full_sweep(self.name)
+        if last_sweep is None:
+            self.logger.info("No full sweep on record, running one.")
+            return False
+        age = (datetime.utcnow() - datetime.fromisoformat(last_sweep)).total_seconds()
+        if age >= self.full_sweep_interval:
+            self.logger.info(f"Last full sweep is {age / 3600:.1f}h old, running one.")
+            return False
+
+        self.logger.info(f"Incremental crawl, stopping after {self.incremental_stop_pages} known page(s) in a row.")
+        self._incremental_run = True
+        return True
+
+    def _all_known(self, ads: List[Ad]) -> bool:
+        """True if every ad is already stored with the same content hash."""
+        if not ads:
+            return True
+        if self._shared_db is None:
+            return False
+        with PROFILER.stage(self.name, "db"):
+            stored = self._shared_db.get_collection("ads").find(
+                {"source": ads[0]["source"], "id": {"$in": [ad["id"] for ad in ads]}},
+                {"_id": 0, "id": 1, "content_hash": 1}
+            )
+            hashes = {doc["id"]: doc.get("content_hash") for doc in stored}
+        return all(hashes.get(ad["id"]) == ad["content_hash"] for ad in ads)
+
+    def _track_known_page(self, shard: str, page: int, ads: List[Dict[str, Any]], skipped: int = 0, fresh: int = 0):
+        known = bool(ads or skipped) and not fresh and self._all_known(ads)
+        with self._counter_lock:
+            count = self._known_pages.get(shard, 0) + 1 if known else 0
+            self._known_pages[shard] = count
+            stop = count >= self.incremental_stop_pages and shard not in self._stopped_shards
+            if stop:
+                self._stopped_shards.add(shard)
+            stop_all = len(self._stopped_shards) >= self._shard_count
+        if stop:
+            label = f"{shard} page" if self._shard_count > 1 else "Page"
+            self.logger.info(f"{label} {page}: {count} known page(s) in a row, stopping.")
+        if stop_all and not self.pipeline.stopped:
+            self.pipeline.stop()
+
+    def plan_shards(self, count, total: int, by_department: bool = True):
+        """
+        Split a search with `total` results into shards that each fit within
+        max_pages pages, see ShardPlanner. Returns {shard key: Shard}, empty
+        if the search fits as is.
+        """
+        if not self.max_pages or total <= self.max_pages * self.page_size:
+            return {}
+        self.logger.info(f"{total} results won't fit in {self.max_pages} pages, sharding the search...")
+        planner = ShardPlanner(count, self.max_pages * self.page_size, by_department=by_department, name=f"{self.name}-Sharding")
+        return {shard.key(): shard for shard in planner.plan(total)}
+
+    def shard_pages(self, shard) -> range:
+        """Pages of a shard, up to max_pages (all of them if its size is unknown)."""
+        pages = self.max_pages
+        if shard.total is not None:
+            pages = min(pages, (shard.total + self.page_size - 1) // self.page_size)
+        return range(1, pages + 1)
+
+    def crawl_pages(self, pages, fetch_page, process_page, workers: Optional[int] = None, process_workers: int = 1, queue_size: int = 0, shard: str = "default"):
+        """
+        Fetch and process pages as a pipeline of stages linked by bounded queues.
+
+        `fetch_page(page, shard)` runs on `workers` fetch threads (the module's
+        concurrency by default) and `process_page(response, page, shard)` on
+        `process_workers` threads, while the shared bulk writer persists ads
+        on its own thread. Every worker has its own tls_client session and
+        proxy, so network, parsing and database writes overlap.
+
+        Progress is checkpointed after every page under (module, shard); if
+        the previous crawl of that shard was interrupted, only the pages it
+        hadn't finished are crawled.
+
+        On an incremental run (see incremental_run) the ads saved by each page
+        are checked against the stored ones before being written, and the
+        crawl stops once enough pages in a row brought nothing new.
+        """
+        self.crawl_shards({shard: pages}, fetch_page, process_page, workers=workers, process_workers=process_workers, queue_size=queue_size)
+
+    def crawl_shards(self, shards: Dict[str, Any], fetch_page, process_page, workers: Optional[int] = None, process_workers: int = 1, queue_size: int = 0):
+        """
+        crawl_pages over several shards of a search at once: `shards` maps a
+        shard key to its pages, and the workers pick up (shard, page) items
+        from all of them, calling `fetch_page(page, shard)` and
+        `process_page(response, page, shard)`. Every shard has its own
+        checkpoint, and on an incremental run stops on its own.
+
+        With `work_queue` set, the pages come from the work queue instead of
+        the checkpoints, see _leased_pages: the shards are then the ones of the
+        crawl's plan, which another worker may have split differently, so
+        `fetch_page` must search the shard its key names (see Shard.from_key,
+        "default" being the whole search) rather than look it up.
+        """
+        workers = workers or self.concurrency
+        queue_size = queue_size or 2 * (workers + process_workers)
+        self._worker_sessions = []
+        self._known_pages = {}
+        self._stopped_shards = set()
+        self._shard_count = len(shards)
+        self.dead_letters = []
+        incremental = self._incremental_run
+
+        store = self._get_checkpoints()
+        queue = self._get_work_queue() if self.work_queue else None
+        checkpoints = {}
+        leases = {}
+        skipped = set()
+        if queue is None:
+            pending = []
+            restored = 0
+            for shard, pages in shards.items():
+                pages = list(pages)
+                checkpoint = checkpoints[shard] = store.open(self.name, shard, page_size=getattr(self, "page_size", None), query=self.listing_query())
+                if pages:
+                    checkpoint.skip_to(min(pages))
+                if checkpoint.resumed:
+                    restored = max(restored, checkpoint.totals.get("scrapped", 0) - self.current_scrapped_ads)
+                pending += [(shard, page) for page in checkpoint.pending(pages)]
+            if restored > 0:
+                self.add_scrapped(restored)
+        else:
+            plan = queue.plan(self.crawl_id, self.name, [(shard, page) for shard, pages in shards.items() for page in pages], page_size=getattr(self, "page_size", None))
+            if plan["page_size"] != getattr(self, "page_size", None):
+                self.logger.info(f"Crawl {self.crawl_id} was planned with pages of {plan['page_size']} ads, using them.")
+                self.page_size = plan["page_size"]
+            pending = self._leased_pages(queue, shards, leases)
+
+        def lease(item):
+            with self._counter_lock:
+                return leases.pop(item, None)
+
+        def page_done(shard, page):
+            if queue is None:
+                checkpoints[shard].page_done(page, **self.progress())
+                return
+            key = lease((shard, page))
+            if key is not None:
+                queue.complete(key)
+
+        def page_failed(shard, page):
+            if queue is None:
+                checkpoints[shard].page_failed(page, **self.progress())
+                return
+            key = lease((shard, page))
+            if key is not None and queue.fail(self.name, key) == "failed":
+                with self._counter_lock:
+                    self.dead_letters.append((shard, page))
+
+        def page_sent(shard, page, ok):
+            # a deferred page (see defer_page) whose ads were sent, or not: then it's crawled again
+            if ok:
+                page_done(shard, page)
+                return
+            page_failed(shard, page)
+            if queue is None:
+                with self._counter_lock:
+                    self.dead_letters.append((shard, page))
+
+        def fetch(item):
+            shard, page = item
+            if shard in self._stopped_shards:
+                key = lease(item) if queue is not None else None
+                if key is not None:
+                    queue.complete(key, "skipped")
+                return None
+            started = time.perf_counter()
+            with PROFILER.stage(self.name, "fetch"):
+                response = fetch_page(page, shard)
+            STAGE_SECONDS.observe(time.perf_counter() - started, source=self.name, stage="fetch")
+            if response is None:
+                if queue is None:
+                    self.logger.error(f'Giving up on page {page} for now, it will be retried at the end of the crawl.')
+                    with self._counter_lock:
+                        self.dead_letters.append(item)
+                else:
+                    self.logger.error(f'Giving up on page {page} for now, it goes back to the work queue.')
+            return shard, page, response
+
+        def process(item):
+            shard, page, response = item
+            if response is None:
+                page_failed(shard, page)
+                return
+            if incremental:
+                self._local.page_ads = []
+                self._local.page_skipped = 0
+                self._local.page_fresh = 0
+            self._local.page_sent = lambda ok: page_sent(shard, page, ok)
+            self._local.deferred = False
+            started = time.perf_counter()
+            try:
+                with PROFILER.stage(self.name, "process"):
+                    process_page(response, page, shard)
+            except Exception:
+                page_failed(shard, page)
+                raise
+            finally:
+                self._local.page_sent = None
+                if incremental:
+                    page_ads, self._local.page_ads = self._local.page_ads, None
+                    self._track_known_page(shard, page, page_ads, self._local.page_skipped, self._local.page_fresh)
+                    for ad in page_ads:
+                        self._write_ad(ad)
+                    if queue is not None and shard in self._stopped_shards and shard not in skipped:
+                        # the other workers stop paging it too
+                        skipped.add(shard)
+                        queue.skip(self.crawl_id, self.name, shard)
+                STAGE_SECONDS.observe(time.perf_counter() - started, source=self.name, stage="process")
+            if not self._local.deferred:
+                page_done(shard, page)
+
+        self.pipeline = Pipeline(self.name)
+        if self.interrupted:
+            # stopped before its pages were queued
+            self.pipeline.stop()
+        self.pipeline.add_stage("fetch", fetch, workers=workers, maxsize=queue_size, on_start=self._start_worker)
+        self.pipeline.add_stage("process", process, workers=process_workers, maxsize=queue_size, on_start=self._start_worker)
+
+        self.logger.info(
+            (f"Crawling {len(pending)} page(s)" if queue is None else f"Crawling the queued pages of crawl {self.crawl_id}")
+            + (f" across {len(shards)} shard(s)" if len(shards) > 1 else "")
+            + f" with {workers} fetch worker(s) and {process_workers} process worker(s)..."
+        )
+        if queue is None:
+            stats = self.pipeline.run(pending)
+            self.drain()
+        else:
+            finished = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(queue, leases, finished), name=f"{self.name}-Heartbeat", daemon=True).start()
+            try:
+                stats = self.pipeline.run(pending)
+                self.drain()
+            finally:
+                finished.set()
+                # pages the pipeline dropped when it was stopped
+                for (shard, page), key in list(leases.items()):
+                    if shard in self._stopped_shards:
+                        queue.complete(key, "skipped")
+                    else:
+                        queue.release(key)
+        self.logger.info("Pipeline done: " + ", ".join(
+            f"{name} {s['processed']} ok / {s['errors']} failed (max queue {s['max_depth']})" for name, s in stats.items()
+        ))
+
+        if queue is not None:
+            counts = queue.counts(self.crawl_id, self.name)
+            self.logger.info(f"Crawl {self.crawl_id}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())) + " page(s) in the work queue.")
+            if self.dead_letters:
+                self.logger.error(f"{len(self.dead_letters)} page(s) could not be fetched: {sorted(self.dead_letters)}")
+        elif self.dead_letters and not self.pipeline.stopped:
+            with self._counter_lock:
+                retry_items, self.dead_letters = self.dead_letters, []
+            self.logger.warning(f"Re-queuing {len(retry_items)} failed page(s)...")
+            self.pipeline.run(sorted(retry_items))
+            self.drain()
+            if self.dead_letters:
+                self.logger.error(f"{len(self.dead_letters)} page(s) could not be fetched: {sorted(self.dead_letters)}")
+
+        # an interrupted crawl keeps its checkpoints open, the next run resumes it
+        if not self.interrupted:
+            for checkpoint in checkpoints.values():
+                checkpoint.finish(**self.progress())
+            if not incremental and not self.dead_letters:
+                store.save_full_sweep(self.name)
+
+        for session in self._worker_sessions:
+            if hasattr(session, "close"):
+                session.close()
+
+    def _leased_pages(self, queue, shards: Dict[str, Any], leases: Dict[tuple, str]):
+        """
+        (shard, page) items of this source's tasks, leased from the work queue
+        as the fetch workers get to them, until no worker has any left;
+        `leases` maps the items in flight to their task.
+        """
+        while not self.pipeline.stopped:
+            task = queue.lease(self.crawl_id, self.name)
+            if task is None:
+                if not queue.active(self.crawl_id, self.name):
+                    return
+                # the pages left are leased by other workers, wait for them or for their leases to run out
+                time.sleep(1)
+                continue
+            item = (task["shard"], task["page"])
+            with self._counter_lock:
+                leases[item] = task["id"]
+            yield item
+
+    def _heartbeat(self, queue, leases: Dict[tuple, str], finished: threading.Event):
+        """Keep the leases of the pages in flight until `finished` is set."""
+        while not finished.wait(queue.lease_seconds / 3):
+            with self._counter_lock:
+                keys = list(leases.values())
+            try:
+                lost = queue.heartbeat(keys)
+            except Exception as e:
+                self.logger.error(f"Work queue heartbeat failed: {e}")
+                continue
+            if lost:
+                self.logger.warning(f"Lost the lease on {len(lost)} page(s), another worker may crawl them again.")
+
+    def stop(self):
+        """Interrupt the crawl: the running pipeline stops taking pages, those in flight are finished."""
+        self.interrupted = True
+        if self.pipeline is not None and not self.pipeline.stopped:
+            self.logger.warning("Stopping...")
+            self.pipeline.stop()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Current queue depth of every stage of the running pipeline, plus the writer's."""
+        depths = {name: s["depth"] for name, s in self.pipeline.stats().items()} if self.pipeline else {}
+        if CrawlerModule._shared_writer is not None:
+            depths["write"] = CrawlerModule._shared_writer.pending()
+        return depths
+
+    def summary(self) -> str:
+        """One-line status of the crawl: progress, requests, latencies and queues."""
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+        requests = REQUESTS.value(source=self.name)
+        failed = requests - REQUESTS.value(source=self.name, status=200)
+        depths = ", ".join(f"{stage} {depth}" for stage, depth in self.queue_depths().items()) or "-"
+        return (
+            f"ADs Scrapped: {self.current_scrapped_ads}/{self.total_ads_found}"
+            f" | Requests: {requests:.0f} ({failed:.0f} failed), p50 {ms(REQUEST_SECONDS.quantile(0.5, source=self.name))}, p95 {ms(REQUEST_SECONDS.quantile(0.95, source=self.name))}"
+            f" | Parse p95: {ms(PARSE_SECONDS.quantile(0.95, source=self.name))}"
+            f" | Queues: {depths}"
+        )
+
     def set_random_proxy(self):
-        self.current_proxy = random.choice(proxy.load_proxies())
-        self.tls_session.proxies.update({
-            "http": f"http://{self.current_proxy}",
-            "https": f"http://{self.current_proxy}"
-        })
-        self._logger.info(f'Proxy has been set to : {self.current_proxy}')
+        """Switch the current session to the best-scored proxy for this module's host."""
+        session = self.tls_session
+        host = urlparse(self.base_url).netloc
+        if session.proxy and session.last_ok:
+            # the request went through but its response was unusable
+            self._proxy_pool.report(session.proxy, host, False)
+        session.set_proxy(self._proxy_pool.pick(host, exclude=session.proxy))
+        self.current_proxy = session.proxy
+        self._logger.debug(f'Proxy has been set to : {self.current_proxy}')
+
+    def load_seen_index(self, source: str):
+        """Index the stored ads of `source`, see skip_seen."""
+        self.seen = SeenIndex.open(self._shared_db, source, f"./state/seen/{source}.idx")
+        return self.seen
+
+    def skip_seen(self, source: str, listed) -> List[str]:
+        """
+        Filter listed (id, update marker) pairs down to the IDs whose details
+        need fetching. Ads stored with the same marker are only marked as seen.
+        """
+        if self.seen is None:
+            return [ad_id for ad_id, _ in listed]
+
+        fresh, known = [], []
+        for ad_id, marker in listed:
+            (fresh if self.seen.changed(ad_id, marker) else known).append(ad_id)
+
+        # details may be fetched along with another page's, count them here
+        if getattr(self._local, "page_ads", None) is not None:
+            self._local.page_fresh += len(fresh)
+
+        if known:
+            writer = self._get_writer()
+            for ad_id in known:
+                writer.touch({"source": source, "id": ad_id}, source=self.name)
+            self.add_scrapped(len(known))
+            if getattr(self._local, "page_ads", None) is not None:
+                self._local.page_skipped += len(known)
+        return fresh
+
+    def _get_writer(self):
+        if CrawlerModule._shared_writer is None:
+            with CrawlerModule._writer_lock:
+                if CrawlerModule._shared_writer is None:
+                    CrawlerModule._shared_writer = CrawlerModule._shared_db.bulk_writer("ads")
+        return CrawlerModule._shared_writer
+
+    def save_ad(self, normalized: Ad):
+        """
+        Queue an upsert of a normalized ad on the shared bulk writer. Ads whose
+        content hash matches the stored one only get their last_seen_at bumped.
+        During an incremental crawl the page's ads are held until it's done.
+        """
+        page_ads = getattr(self._local, "page_ads", None)
+        if page_ads is not None:
+            page_ads.append(normalized)
+            return
+        self._write_ad(normalized)
+
+    def save_ads(self, ads: Iterable[Ad]):
+        for ad in ads:
+            self.save_ad(ad)
+
+    def _write_ad(self, ad: Ad):
+        self._get_writer().upsert_if_changed({"source": ad["source"], "id": ad["id"]}, ad, source=self.name)
+
+    def flush_ads(self):
+        """Write every queued ad to the database now."""
+        if CrawlerModule._shared_writer is not None:
+            CrawlerModule._shared_writer.flush()
+
+    @classmethod
+    def close_writer(cls):
+        """Write what's left and stop the shared bulk writer, which otherwise happens at exit."""
+        if CrawlerModule._shared_writer is not None:
+            CrawlerModule._shared_writer.close()
 
     def normalize_ad(
         self,
@@ -78,7 +693,7 @@ class CrawlerModule:
         
         # Extra fields
         **extra_fields
-    ) -> Dict[str, Any]:
+    ) -> Ad:
         """
         Normalize property ad data into a simple, consistent structure.
         
@@ -107,55 +722,65 @@ class CrawlerModule:
             **extra_fields: Any additional fields
         
         Returns:
-            Dict: Normalized ad data
+            Ad: Normalized ad, turned into its document by the writer
         """
         
-        def clean_value(value):
-            if value is None:
-                return None
-            if isinstance(value, str):
-                return value.strip() if value.strip() else None
-            return value
-        
-        def clean_numeric(value):
-            if value is None:
-                return None
+        fields = dict(
+            extra_fields, id=id, source=source, url=url, title=title, description=description,
+            property_type=property_type, transaction_type=transaction_type, price=price, currency=currency,
+            city=city, postal_code=postal_code, latitude=latitude, longitude=longitude, surface=surface,
+            rooms=rooms, bedrooms=bedrooms, photos=photos, agency_name=agency_name, agency_phone=agency_phone,
+            created_at=created_at, updated_at=updated_at
+        )
+        with PROFILER.stage(self.name, "normalize"):
+            return Ad(fields, datetime.utcnow().isoformat())
+
+    def map_ads(self, raw_ads: Iterable[Dict[str, Any]], mapper: Optional[FieldMapper] = None) -> List[Dict[str, Any]]:
+        """
+        Rows for normalize_ads from a page of raw ads, through the source's
+        FieldMapper. Ads that can't be mapped are logged and left out; with
+        validate_mappings on, every ad is also checked against the mapping.
+        """
+        mapper = mapper or self.mapper
+        rows = []
+        for ad in raw_ads:
+            if not isinstance(ad, dict):
+                continue
             try:
-                return float(value) if isinstance(value, str) else value
-            except (ValueError, TypeError):
-                return None
-        
-        normalized = {
-            "id": str(id),
-            "source": source,
-            "url": clean_value(url),
-            "title": clean_value(title),
-            "description": clean_value(description),
-            "property_type": clean_value(property_type),
-            "transaction_type": clean_value(transaction_type),
-            "price": clean_numeric(price),
-            "currency": currency,
-            "city": clean_value(city),
-            "postal_code": clean_value(postal_code),
-            "latitude": clean_numeric(latitude),
-            "longitude": clean_numeric(longitude),
-            "surface": clean_numeric(surface),
-            "rooms": clean_numeric(rooms),
-            "bedrooms": clean_numeric(bedrooms),
-            "photos": photos or [],
-            "agency_name": clean_value(agency_name),
-            "agency_phone": clean_value(agency_phone),
-            "created_at": created_at,
-            "updated_at": updated_at,
-            "retrieved_at": datetime.utcnow().isoformat()
-        }
-        
-        normalized = {k: v for k, v in normalized.items() if v is not None}
-        
-        if extra_fields:
-            normalized.update(extra_fields)
-        
-        return normalized
+                rows.append(mapper(ad))
+            except Exception as e:
+                self.logger.error(f"Error normalizing ad {mapper.ad_id(ad)}: {e}")
+            if self.validate_mappings:
+                mapper.check(ad)
+        return rows
+
+    def report_mapping(self):
+        """Log what validate_mappings found in the ads mapped so far."""
+        if self.mapper is None or not self.mapper.checked:
+            return
+        issues = self.mapper.report()
+        if not issues:
+            self.logger.success(f"Field mapping: {self.mapper.checked} ad(s) checked, no issue found.")
+            return
+        self.logger.warning(f"Field mapping: {self.mapper.checked} ad(s) checked, most common issues:")
+        for kind, detail, count in issues:
+            self.logger.warning(f"  {kind}: {detail} ({count} ad(s))")
+
+    def normalize_ads(self, rows: Iterable[Dict[str, Any]]) -> List[Ad]:
+        """
+        normalize_ad over a page of ads at once: `rows` holds the keyword
+        arguments of each ad, and they all share one retrieved_at. Ads that
+        can't be normalized are logged and left out.
+        """
+        retrieved_at = datetime.utcnow().isoformat()
+        ads = []
+        with PROFILER.stage(self.name, "normalize"):
+            for fields in rows:
+                try:
+                    ads.append(Ad(fields, retrieved_at))
+                except Exception as e:
+                    self.logger.error(f"Error normalizing ad {fields.get('id', 'unknown')}: {e}")
+        return ads
 
 
 
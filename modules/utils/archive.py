@@ -0,0 +1,132 @@
+import atexit, base64, gzip, hashlib, json, os, threading
+
+from .codec import get_codec
+
+MODES = ("live", "record", "replay")
+
+
+def request_key(method: str, url: str, params: dict = None, json_body=None, data=None) -> str:
+    """Fingerprint of a request: method, URL, query params and body."""
+    payload = json.dumps(
+        [method.upper(), url, sorted((str(k), str(v)) for k, v in (params or {}).items()), json_body, data],
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ArchivedResponse:
+    """Recorded response, with the attributes the modules read from a tls_client one."""
+
+    __slots__ = ("status_code", "headers", "content", "url", "elapsed")
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, url: str = "", elapsed: float = 0.0):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+
+class HttpArchive:
+    """
+    Responses of a source, one JSON line per request in a gzip file.
+
+    record() starts the file over the first time it's called, then appends.
+    replay() loads the whole file in memory on first use; a request recorded
+    several times is answered with its responses in the order they were
+    recorded, the last one repeating.
+    """
+
+    def __init__(self, path: str, codec=None):
+        self.path = path
+        self.codec = codec or get_codec()
+        self._file = None
+        self._entries = None
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, url: str, kwargs: dict, response, elapsed: float):
+        body = response.content or b""
+        try:
+            stored = {"text": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            stored = {"body": base64.b64encode(body).decode("ascii")}
+        line = self.codec.encode({
+            "key": request_key(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data")),
+            "method": method.upper(),
+            "url": url,
+            "status": response.status_code,
+            "headers": dict(response.headers or {}),
+            "elapsed": round(elapsed, 4),
+            **stored
+        })
+
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = gzip.open(self.path, "wb", compresslevel=6)
+                atexit.register(self.close)
+            self._file.write(line + b"\n")
+
+    def replay(self, method: str, url: str, kwargs: dict):
+        """The recorded response of a request, or None if it wasn't recorded."""
+        key = request_key(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            responses = self._entries.get(key)
+            if not responses:
+                return None
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = min(index + 1, len(responses) - 1)
+            return responses[index]
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with gzip.open(self.path, "rb") as f:
+            try:
+                for line in f:
+                    entry = self.codec.decode(line)
+                    body = entry["text"].encode("utf-8") if "text" in entry else base64.b64decode(entry.get("body", ""))
+                    entries.setdefault(entry["key"], []).append(
+                        ArchivedResponse(entry["status"], entry.get("headers", {}), body, entry["url"], entry.get("elapsed", 0.0))
+                    )
+            except (EOFError, ValueError):
+                # the recording was cut short, keep what was written
+                pass
+        return entries
+
+    def __len__(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return sum(map(len, self._entries.values()))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class HttpArchives:
+    """Shared registry of one HttpArchive per file."""
+
+    def __init__(self):
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> HttpArchive:
+        with self._lock:
+            if path not in self._archives:
+                self._archives[path] = HttpArchive(path)
+            return self._archives[path]
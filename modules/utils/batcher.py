@@ -0,0 +1,174 @@
+import threading
+
+from .logger import Logger
+from .metrics import REGISTRY, SIZE_BUCKETS
+
+BATCH_SIZE = REGISTRY.histogram("bestimmo_id_batch_size", "IDs per batch sent by an IdBatcher", ("batcher",), buckets=SIZE_BUCKETS)
+
+# statuses of a request too large for the endpoint: bad request, payload / URI too long
+SIZE_STATUSES = (400, 413, 414)
+
+
+class _Ticket:
+    """IDs of one add() call that haven't been sent yet."""
+
+    __slots__ = ("left", "ok", "done")
+
+    def __init__(self, left: int, done):
+        self.left = left
+        self.ok = True
+        self.done = done
+
+
+class IdBatcher:
+    """
+    Thread-safe accumulator that turns IDs coming from many pages into
+    full-size batches for a bulk details endpoint.
+
+    add() queues IDs and sends every full batch through `send(ids)`, which
+    returns True once the batch is handled, or else the status it was refused
+    with (None when no response came back). Only a size status (see
+    SIZE_STATUSES) gets a batch split in two; if both halves go through, the
+    size was the problem. The batch size then searches between the largest
+    accepted batch and the smallest refused one, moving up after `grow_after`
+    full batches in a row are accepted.
+
+    Batches refused for anything else (bans, rate limits, dead proxies...)
+    keep the batch size and go to `dead_letters`. flush() sends what's left,
+    then retries the dead letters once.
+
+    `done(ok)`, given to add(), is called once all of its IDs are handled,
+    with False if some of them were still refused after the retry (IDs the
+    endpoint refuses one by one are dropped for good).
+    """
+
+    def __init__(self, send, size: int = 50, min_size: int = 1, max_size: int = 200, grow_after: int = 3, name: str = 'IdBatcher'):
+        self.send = send
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.grow_after = grow_after
+        self.floor = 0
+        self.ceiling = None
+        self.name = name
+        self.logger = Logger(name)
+
+        # (id, ticket) pairs
+        self._pending = []
+        self.dead_letters = []
+        self._lock = threading.Lock()
+        self._streak = 0
+        self.stats = {"batches": 0, "ids": 0, "split": 0, "retried": 0, "dropped": 0}
+
+    def add(self, ids, done=None):
+        if not ids:
+            if done is not None:
+                done(True)
+            return
+        ticket = _Ticket(len(ids), done)
+        with self._lock:
+            self._pending.extend((id, ticket) for id in ids)
+            batches = []
+            while len(self._pending) >= self.size:
+                batches.append(self._pending[:self.size])
+                del self._pending[:self.size]
+        for batch in batches:
+            self._send(batch)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            size = self.size
+        for i in range(0, len(pending), size):
+            self._send(pending[i:i + size])
+
+        with self._lock:
+            retry, self.dead_letters = self.dead_letters, []
+            size = self.size
+            self.stats["retried"] += len(retry)
+        if retry:
+            self.logger.warning(f"Retrying {len(retry)} refused ID(s)...")
+        for i in range(0, len(retry), size):
+            self._send(retry[i:i + size], retry=False)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _send(self, batch, retry: bool = True) -> bool:
+        status = self.send([id for id, _ in batch])
+        if status is True:
+            BATCH_SIZE.observe(len(batch), batcher=self.name)
+            with self._lock:
+                self.stats["batches"] += 1
+                self.stats["ids"] += len(batch)
+            self._grow(len(batch))
+            self._settle(batch, True)
+            return True
+
+        if status not in SIZE_STATUSES:
+            if retry:
+                with self._lock:
+                    self.dead_letters.extend(batch)
+                self.logger.warning(f"A batch of {len(batch)} was refused ({status or 'no response'}), it will be retried.")
+            else:
+                self._drop(batch, f"still refused ({status or 'no response'})", False)
+            return False
+
+        if len(batch) <= self.min_size:
+            # the endpoint refuses these IDs themselves, sending them again won't help
+            self._drop(batch, "the endpoint refuses", True)
+            return False
+
+        with self._lock:
+            self.stats["split"] += 1
+        half = (len(batch) + 1) // 2
+        first = self._send(batch[:half], retry)
+        second = self._send(batch[half:], retry)
+        if first and second:
+            self._shrink(len(batch))
+        return first and second
+
+    def _drop(self, batch, reason: str, ok: bool):
+        with self._lock:
+            self.stats["dropped"] += len(batch)
+        self.logger.error(f"Dropping {len(batch)} ID(s) {reason}: {[id for id, _ in batch[:5]]}")
+        self._settle(batch, ok)
+
+    def _settle(self, batch, ok: bool):
+        finished = []
+        with self._lock:
+            for _, ticket in batch:
+                ticket.left -= 1
+                ticket.ok = ticket.ok and ok
+                if ticket.left == 0 and ticket.done is not None:
+                    finished.append(ticket)
+        for ticket in finished:
+            ticket.done(ticket.ok)
+
+    def _grow(self, sent: int):
+        with self._lock:
+            self.floor = max(self.floor, sent)
+            if sent < self.size:
+                return
+            self._streak += 1
+            if self._streak < self.grow_after:
+                return
+            self._streak = 0
+            if self.ceiling is None:
+                size = min(self.size * 2, self.max_size)
+            else:
+                size = min((self.floor + self.ceiling) // 2, self.max_size)
+            if size <= self.size:
+                return
+            self.size = size
+        self.logger.info(f"Batch size raised to {size}.")
+
+    def _shrink(self, refused: int):
+        with self._lock:
+            self._streak = 0
+            self.ceiling = refused if self.ceiling is None else min(self.ceiling, refused)
+            size = max(self.min_size, min(self.size, self.floor or refused // 2))
+            if size == self.size:
+                return
+            self.size = size
+        self.logger.warning(f"A batch of {refused} was refused, batch size lowered to {size}.")
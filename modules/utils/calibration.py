@@ -0,0 +1,86 @@
+import json, os, threading, time
+from datetime import datetime
+
+from .logger import Logger
+
+
+def calibrate(probe, start_size: int, max_size: int, max_latency: float = 5.0, logger: Logger = None):
+    """
+    Find the largest usable page size of a source.
+
+    `probe(size)` fetches the first page with that size and returns its ad
+    IDs, or None if the request failed. Sizes double from `start_size` up to
+    `max_size`; a size is kept while the page comes back full, starts with
+    the same IDs as the previous size (so offsets line up) and answers
+    within `max_latency` seconds. Returns (size, latency).
+    """
+    logger = logger or Logger('Calibration')
+
+    started = time.perf_counter()
+    baseline = probe(start_size)
+    best, best_latency = start_size, time.perf_counter() - started
+    if not baseline or len(baseline) < start_size:
+        logger.warning(f"First page isn't full at size {start_size}, keeping it.")
+        return best, best_latency
+
+    size = start_size
+    while size < max_size:
+        size = min(size * 2, max_size)
+        started = time.perf_counter()
+        ids = probe(size)
+        latency = time.perf_counter() - started
+
+        if ids is None:
+            reason = "request failed"
+        elif len(ids) < size:
+            reason = f"only {len(ids)} ads returned"
+        elif ids[:len(baseline)] != baseline:
+            reason = "results don't match the smaller page"
+        elif latency > max_latency:
+            reason = f"took {latency:.1f}s"
+        else:
+            best, best_latency, baseline = size, latency, ids
+            continue
+
+        logger.info(f"Page size {size} rejected: {reason}.")
+        break
+
+    return best, best_latency
+
+
+class PageSizeProfile:
+    """Calibrated page size of each source, cached in a local JSON file."""
+
+    def __init__(self, path: str = './state/page_sizes.json', max_age: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def get(self, source: str):
+        """Cached page size of `source`, or None if missing or older than max_age."""
+        entry = self._read().get(source)
+        if not entry:
+            return None
+        age = (datetime.utcnow() - datetime.fromisoformat(entry["calibrated_at"])).total_seconds()
+        return entry["page_size"] if age < self.max_age else None
+
+    def set(self, source: str, page_size: int, latency: float):
+        with self._lock:
+            profile = self._read()
+            profile[source] = {
+                "page_size": page_size,
+                "latency": round(latency, 3),
+                "calibrated_at": datetime.utcnow().isoformat()
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(profile, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
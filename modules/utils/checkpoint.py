@@ -0,0 +1,183 @@
+import json, os, threading, uuid
+from datetime import datetime
+
+from .logger import Logger
+
+
+class Checkpoint:
+    """
+    Progress of one crawl of a (source, shard).
+
+    `last_page` is a watermark: every page up to it is either done or in
+    `failed`. Pages completed out of order (parallel workers) are kept in
+    `done` until the watermark catches up with them, so the saved state
+    stays small however long the crawl is.
+    """
+
+    def __init__(self, store, source: str, shard: str, state: dict = None, page_size: int = None, query: str = None):
+        state = state or {}
+        self.store = store
+        self.source = source
+        self.shard = shard
+        self.query = state.get("query", query)
+        self.page_size = state.get("page_size", page_size)
+        self.run_id = state.get("run_id") or uuid.uuid4().hex
+        self.last_page = state.get("last_page", 0)
+        self.done = set(state.get("done", []))
+        self.failed = set(state.get("failed", []))
+        self.totals = state.get("totals", {})
+        self.status = state.get("status", "running")
+        self.resumed = bool(state)
+        self._lock = threading.Lock()
+
+    def is_done(self, page: int) -> bool:
+        return (page <= self.last_page and page not in self.failed) or page in self.done
+
+    def pending(self, pages):
+        """Pages left to crawl: previously failed ones first, then the ones not done yet."""
+        return sorted(self.failed) + [p for p in pages if p not in self.failed and not self.is_done(p)]
+
+    def skip_to(self, page: int):
+        """Treat every page before `page` as done (e.g. page 1, handled before the crawl loop)."""
+        with self._lock:
+            self.last_page = max(self.last_page, page - 1)
+            self._advance()
+
+    def page_done(self, page: int, **totals):
+        with self._lock:
+            self.failed.discard(page)
+            if page > self.last_page:
+                self.done.add(page)
+            self.totals.update(totals)
+            self._advance()
+            self.store.save(self)
+
+    def page_failed(self, page: int, **totals):
+        with self._lock:
+            self.failed.add(page)
+            self.done.discard(page)
+            self.totals.update(totals)
+            self._advance()
+            self.store.save(self)
+
+    def finish(self, **totals):
+        with self._lock:
+            self.status = "done"
+            self.totals.update(totals)
+            self.store.save(self)
+
+    def _advance(self):
+        while self.last_page + 1 in self.done or self.last_page + 1 in self.failed:
+            self.last_page += 1
+            self.done.discard(self.last_page)
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "shard": self.shard,
+            "query": self.query,
+            "page_size": self.page_size,
+            "run_id": self.run_id,
+            "status": self.status,
+            "last_page": self.last_page,
+            "done": sorted(self.done),
+            "failed": sorted(self.failed),
+            "totals": self.totals,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+
+
+class CheckpointStore:
+    """
+    Saves crawl checkpoints in the `checkpoints` collection, or when MongoDB
+    isn't available in a local JSON file per source (checkpoints-<source>.json
+    next to `path`), so worker processes crawling other sources never write
+    the same file.
+    """
+
+    def __init__(self, db=None, path: str = './state/checkpoints.json'):
+        self.db = db if db is not None and db.db is not None else None
+        self.path = path
+        self.logger = Logger('Checkpoint')
+        self._lock = threading.Lock()
+
+    def open(self, source: str, shard: str = "default", page_size: int = None, query: str = None) -> Checkpoint:
+        """
+        Resume the unfinished crawl of (source, shard, query), or start a new
+        one. `query` names what the pages list (e.g. the sort order), so a
+        crawl in another order neither resumes nor closes this one. Page
+        numbers only hold for one page size, so a crawl made with another
+        `page_size` starts over.
+        """
+        state = self._load(source, shard, query)
+        if state and state.get("status") == "running" and state.get("page_size") != page_size:
+            self.logger.warning(f"Page size of {source}/{shard} changed from {state.get('page_size')} to {page_size}, starting over.")
+            state = None
+        if state and state.get("status") == "running":
+            checkpoint = Checkpoint(self, source, shard, state)
+            self.logger.info(f"Resuming {source}/{shard} run {checkpoint.run_id} after page {checkpoint.last_page} ({len(checkpoint.failed)} failed page(s) to retry)")
+        else:
+            checkpoint = Checkpoint(self, source, shard, page_size=page_size, query=query)
+        self.save(checkpoint)
+        return checkpoint
+
+    def last_full_sweep(self, source: str):
+        """When the last full sweep of `source` finished (ISO string), or None."""
+        if self.db is not None:
+            state = self.db.get_collection("sweeps").find_one({"source": source})
+        else:
+            state = self._read_file(source).get(f"{source}/_sweep")
+        return state.get("finished_at") if state else None
+
+    def save_full_sweep(self, source: str):
+        state = {"source": source, "finished_at": datetime.utcnow().isoformat()}
+        if self.db is not None:
+            self.db.get_collection("sweeps").replace_one({"source": source}, state, upsert=True)
+            return
+        self._write_state(source, f"{source}/_sweep", state)
+
+    def _key(self, source: str, shard: str, query: str = None) -> str:
+        # checkpoints saved before queries were tracked keep their key
+        return f"{source}/{shard}" if query is None else f"{source}/{shard}?{query}"
+
+    def _load(self, source: str, shard: str, query: str = None):
+        if self.db is not None:
+            return self.db.get_collection("checkpoints").find_one({"source": source, "shard": shard, "query": query}, {"_id": 0})
+        return self._read_file(source).get(self._key(source, shard, query))
+
+    def save(self, checkpoint: Checkpoint):
+        state = checkpoint.to_dict()
+        if self.db is not None:
+            self.db.get_collection("checkpoints").replace_one(
+                {"source": checkpoint.source, "shard": checkpoint.shard, "query": checkpoint.query}, state, upsert=True
+            )
+            return
+        self._write_state(checkpoint.source, self._key(checkpoint.source, checkpoint.shard, checkpoint.query), state)
+
+    def _path(self, source: str) -> str:
+        root, ext = os.path.splitext(self.path)
+        return f"{root}-{source}{ext}"
+
+    def _write_state(self, source: str, key: str, state: dict):
+        path = self._path(source)
+        with self._lock:
+            states = self._read_file(source)
+            states[key] = state
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(states, f)
+            os.replace(tmp_path, path)
+
+    def _read_file(self, source: str):
+        try:
+            with open(self._path(source), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        # states saved in the shared file before it was split per source
+        try:
+            with open(self.path, "r") as f:
+                return {key: state for key, state in json.load(f).items() if key.startswith(f"{source}/")}
+        except (OSError, ValueError):
+            return {}
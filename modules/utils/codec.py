@@ -0,0 +1,76 @@
+import json, os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JsonCodec:
+    """
+    JSON decoder/encoder working on bytes. Input a fast backend refuses (e.g.
+    integers past 64 bits for orjson) is decoded again with the stdlib, so
+    every backend accepts what json.loads accepts.
+    """
+
+    def __init__(self, name: str, loads, dumps):
+        self.name = name
+        self._loads = loads
+        self._dumps = dumps
+
+    def decode(self, data):
+        try:
+            return self._loads(data)
+        except Exception:
+            if self._loads is json.loads:
+                raise
+            return json.loads(data)
+
+    def encode(self, obj) -> bytes:
+        return self._dumps(obj)
+
+    def __repr__(self):
+        return f"JsonCodec({self.name})"
+
+
+def _stdlib():
+    return JsonCodec("stdlib", json.loads, lambda obj: json.dumps(obj, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8"))
+
+
+def _orjson():
+    return JsonCodec("orjson", orjson.loads, lambda obj: orjson.dumps(obj, default=str))
+
+
+def _msgspec():
+    decoder, encoder = msgspec.json.Decoder(), msgspec.json.Encoder(enc_hook=str)
+    return JsonCodec("msgspec", decoder.decode, encoder.encode)
+
+
+# fastest first
+BACKENDS = {"orjson": (orjson, _orjson), "msgspec": (msgspec, _msgspec), "stdlib": (json, _stdlib)}
+
+
+def available():
+    """Names of the installed backends, fastest first."""
+    return [name for name, (package, _) in BACKENDS.items() if package is not None]
+
+
+def get_codec(name: str = None) -> JsonCodec:
+    """
+    Codec of backend `name` ("orjson", "msgspec", "stdlib"), or of the fastest
+    installed one for None/"auto". Defaults to BESTIMMO_JSON_BACKEND.
+    """
+    name = (name or os.getenv("BESTIMMO_JSON_BACKEND") or "auto").lower()
+    if name == "auto":
+        name = available()[0]
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend '{name}', expected one of {', '.join(BACKENDS)}")
+    package, factory = BACKENDS[name]
+    if package is None:
+        raise ImportError(f"JSON backend '{name}' is not installed")
+    return factory()
@@ -1,10 +1,33 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-import os
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import ConnectionFailure, BulkWriteError, PyMongoError
+import os, threading, queue, time, atexit
+from datetime import datetime
 
 from .logger import Logger 
+from .metrics import REGISTRY, SIZE_BUCKETS
+from .profiler import PROFILER
+from .record import Ad
+
+WRITE_SECONDS = REGISTRY.histogram("bestimmo_db_write_seconds", "Duration of bulk writes", ("collection",))
+WRITE_BATCH = REGISTRY.histogram("bestimmo_db_write_batch_size", "Operations per bulk write", ("collection",), buckets=SIZE_BUCKETS)
+WRITE_OPS = REGISTRY.counter("bestimmo_db_write_ops_total", "Bulk write operations by outcome", ("collection", "result"))
 
 class MongoDB:
+
+    # collection -> list of (keys, options)
+    INDEXES = {
+        "ads": [
+            ([("source", ASCENDING), ("id", ASCENDING)], {"unique": True, "name": "source_id"}),
+            ([("postal_code", ASCENDING)], {"name": "postal_code"}),
+            ([("price", ASCENDING)], {"name": "price"}),
+            ([("surface", ASCENDING)], {"name": "surface"}),
+            ([("retrieved_at", ASCENDING)], {"name": "retrieved_at"}),
+        ],
+        "work_queue": [
+            ([("crawl", ASCENDING), ("source", ASCENDING), ("status", ASCENDING), ("page", ASCENDING)], {"name": "crawl_source_status_page"}),
+        ]
+    }
+
     def __init__(self, uri=None, db_name="BestImmo"):
         self.uri = uri or os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
         self.db_name = db_name
@@ -22,29 +45,274 @@ class MongoDB:
             self.logger.error(f"[MongoDB] Failed to connect: {e}")
             raise
 
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        for collection_name, indexes in self.INDEXES.items():
+            collection = self.get_collection(collection_name)
+            for keys, options in indexes:
+                try:
+                    collection.create_index(keys, **options)
+                except PyMongoError as e:
+                    self.logger.error(f"[MongoDB] Could not create index '{options.get('name')}' on '{collection_name}': {e}")
+        self.logger.info("[MongoDB] Indexes are up to date.")
+
     def get_collection(self, name):
         if self.db is None:
             self.logger.error("MongoDB not connected. Call connect() first.")
             raise RuntimeError("MongoDB not connected. Call connect() first.")
         return self.db[name]
 
+    def bulk_writer(self, collection_name, batch_size: int = 500, flush_interval: float = 2.0):
+        return BulkWriter(self.get_collection(collection_name), batch_size=batch_size, flush_interval=flush_interval)
+
     def insert_one(self, collection_name, data: dict):
-        self.logger.info(f"Inserting one document into collection '{collection_name}'")
+        self.logger.debug(f"Inserting one document into collection '{collection_name}'")
         return self.get_collection(collection_name).insert_one(data)
 
     def find(self, collection_name, query: dict = {}):
-        self.logger.info(f"Finding documents in collection '{collection_name}' with query: {query}")
+        self.logger.debug(f"Finding documents in collection '{collection_name}' with query: {query}")
         return self.get_collection(collection_name).find(query)
 
     def update_one(self, collection_name, query: dict, update: dict):
-        self.logger.info(f"Updating one document in collection '{collection_name}' matching {query} with {update}")
+        self.logger.debug(f"Updating one document in collection '{collection_name}' matching {query} with {update}")
         return self.get_collection(collection_name).update_one(query, {"$set": update})
 
     def delete_one(self, collection_name, query: dict):
-        self.logger.info(f"Deleting one document from collection '{collection_name}' matching {query}")
+        self.logger.debug(f"Deleting one document from collection '{collection_name}' matching {query}")
         return self.get_collection(collection_name).delete_one(query)
 
     def close(self):
         if self.client:
             self.client.close()
             self.logger.info("[MongoDB] Connection closed.")
+
+
+class HashedUpsert:
+    """Upsert that only rewrites the document when its content hash changed."""
+
+    __slots__ = ("query", "document", "hash_field", "seen_field")
+
+    def __init__(self, query: dict, document: dict, hash_field: str, seen_field: str):
+        self.query = query
+        self.document = document
+        self.hash_field = hash_field
+        self.seen_field = seen_field
+
+    def key(self):
+        return tuple(sorted(self.query.items()))
+
+
+class BulkWriter:
+    """
+    Thread-safe write buffer for a collection.
+
+    Operations go through a bounded queue to a writer thread, which sends
+    them as unordered bulk_write batches once `batch_size` operations are
+    waiting or every `flush_interval` seconds, one bulk_write per `source`
+    the operations were queued for, so the profiler times each source's writes. When the queue is full, add()
+    blocks until the writer catches up. Pending operations are flushed when
+    the process exits.
+    """
+
+    _STOP = object()
+
+    def __init__(self, collection, batch_size: int = 500, flush_interval: float = 2.0, queue_size: int = 0):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = Logger('Writer')
+
+        self._queue = queue.Queue(maxsize=queue_size or batch_size * 4)
+        # held while queueing, so nothing gets queued behind _STOP
+        self._lock = threading.Lock()
+        self._closed = False
+        self.max_depth = 0
+
+        self.last_flush = None
+        self.stats = {
+            "flushes": 0,
+            "ops": 0,
+            "upserted": 0,
+            "modified": 0,
+            "matched": 0,
+            "unchanged": 0,
+            "errors": 0,
+            "write_time": 0.0
+        }
+
+        self._thread = threading.Thread(target=PROFILER.profiled(self._write_loop), name=f"BulkWriter-{collection.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def upsert(self, query: dict, update: dict, source: str = None):
+        self.add(UpdateOne(query, update, upsert=True), source)
+
+    def touch(self, query: dict, seen_field: str = "last_seen_at", source: str = None):
+        """Mark an existing document as seen without rewriting it."""
+        self.add(UpdateOne(query, {"$set": {seen_field: datetime.utcnow().isoformat()}}), source)
+
+    def upsert_if_changed(self, query: dict, document, hash_field: str = "content_hash", seen_field: str = "last_seen_at", source: str = None):
+        """
+        Upsert `document` (a dict or an Ad), unless the stored copy has the
+        same `hash_field`, in which case only `seen_field` is updated.
+        """
+        self.add(HashedUpsert(query, document, hash_field, seen_field), source)
+
+    def add(self, op, source: str = None):
+        with self._lock:
+            if not self._closed:
+                self._queue.put((source, op))
+                depth = self._queue.qsize()
+                if depth > self.max_depth:
+                    self.max_depth = depth
+                return
+        # closed: written here, once the writer thread is done
+        self._thread.join()
+        self._write([(source, op)])
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every operation queued so far has been written."""
+        done = threading.Event()
+        with self._lock:
+            if self._closed:
+                return self.last_flush
+            self._queue.put(done)
+        done.wait()
+        return self.last_flush
+
+    def _write_loop(self):
+        ops = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._write(ops)
+                return
+            if isinstance(item, threading.Event):
+                self._write(ops)
+                ops = []
+                item.set()
+                continue
+            if item is not None:
+                ops.append(item)
+
+            if len(ops) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(ops)
+                ops = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _stored_hashes(self, upserts):
+        """Current hash of every document targeted by `upserts`, in one query."""
+        fields = {"_id": 0, upserts[0].hash_field: 1}
+        for op in upserts:
+            fields.update({key: 1 for key in op.query})
+
+        stored = {}
+        for doc in self.collection.find({"$or": [op.query for op in upserts]}, fields):
+            key = tuple(sorted((k, doc.get(k)) for k in fields if k not in ("_id", upserts[0].hash_field)))
+            stored[key] = doc.get(upserts[0].hash_field)
+        return stored
+
+    def _resolve(self, ops):
+        """Turn HashedUpserts into full upserts or last-seen bumps, returns (requests, unchanged)."""
+        upserts = [op for op in ops if isinstance(op, HashedUpsert)]
+        if not upserts:
+            return ops, 0
+
+        try:
+            stored = self._stored_hashes(upserts)
+        except Exception as e:
+            self.logger.error(f"Could not read stored hashes, writing every document: {e}")
+            stored = {}
+
+        requests = []
+        unchanged = 0
+        for op in ops:
+            if not isinstance(op, HashedUpsert):
+                requests.append(op)
+                continue
+            # Ad records only become documents here
+            document = op.document.to_dict() if isinstance(op.document, Ad) else op.document
+            seen = document.get("retrieved_at") or datetime.utcnow().isoformat()
+            if stored.get(op.key()) == document.get(op.hash_field):
+                requests.append(UpdateOne(op.query, {"$set": {op.seen_field: seen}}))
+                unchanged += 1
+            else:
+                requests.append(UpdateOne(op.query, {"$set": {**document, op.seen_field: seen}}, upsert=True))
+        return requests, unchanged
+
+    def _write(self, items):
+        """Write (source, op) items, one bulk_write per source."""
+        if not items:
+            return None
+
+        by_source = {}
+        for source, op in items:
+            by_source.setdefault(source, []).append(op)
+        flush = {"ops": 0, "upserted": 0, "modified": 0, "matched": 0, "unchanged": 0, "errors": 0, "write_time": 0.0}
+        for source, ops in by_source.items():
+            for key, value in self._bulk_write(source, ops).items():
+                flush[key] += value
+
+        self.last_flush = flush
+        self.stats["flushes"] += 1
+        for key, value in flush.items():
+            self.stats[key] += value
+
+        self.logger.debug(
+            f"Flushed {flush['ops']} op(s) in {flush['write_time'] * 1000:.1f}ms "
+            f"(upserted: {flush['upserted']}, modified: {flush['modified']}, unchanged: {flush['unchanged']}, "
+            f"errors: {flush['errors']}, queued: {self._queue.qsize()})"
+        )
+        return flush
+
+    def _bulk_write(self, source: str, ops) -> dict:
+        started = time.perf_counter()
+        errors = 0
+        unchanged = 0
+        try:
+            with PROFILER.stage(source or f"mongo.{self.collection.name}", "write"):
+                ops, unchanged = self._resolve(ops)
+                result = self.collection.bulk_write(ops, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            errors = len(result.get("writeErrors", []))
+            self.logger.error(f"Bulk write finished with {errors} error(s): {result.get('writeErrors', [])[:1]}")
+        except Exception as e:
+            result = {}
+            errors = len(ops)
+            self.logger.error(f"Bulk write of {len(ops)} op(s) failed: {e}")
+        elapsed = time.perf_counter() - started
+
+        flush = {
+            "ops": len(ops),
+            "upserted": result.get("nUpserted", 0),
+            "modified": result.get("nModified", 0),
+            "matched": result.get("nMatched", 0),
+            "unchanged": unchanged,
+            "errors": errors,
+            "write_time": elapsed
+        }
+        collection = self.collection.name
+        WRITE_SECONDS.observe(elapsed, collection=collection)
+        WRITE_BATCH.observe(len(ops), collection=collection)
+        for outcome in ("upserted", "modified", "unchanged", "errors"):
+            if flush[outcome]:
+                WRITE_OPS.inc(flush[outcome], collection=collection, result=outcome)
+        return flush
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._STOP)
+        self._thread.join()
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import Logger
+from .metrics import REGISTRY
+from .profiler import PROFILER
+
+
+class CrawlEngine:
+    """
+    Runs every crawler module as an asyncio task on a single event loop.
+
+    Module start() methods are blocking, so the engine is a bridge: each one
+    runs on a thread of a shared pool while the loop reports their status.
+    Each module gets its per-source `concurrency`, the number of page
+    workers its pipeline fetches with.
+    """
+
+    def __init__(self, modules: list, concurrency: dict = None, default_concurrency: int = 1, status_interval: float = 5):
+        self.modules = modules
+        self.concurrency = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.status_interval = status_interval
+        self.logger = Logger('Engine')
+
+        REGISTRY.gauge("bestimmo_queue_depth", "Items waiting per pipeline stage", ("source", "stage"), collect=lambda: {
+            (m.name, stage): depth for m in self.modules for stage, depth in m.queue_depths().items()
+        })
+        REGISTRY.gauge("bestimmo_ads", "Ads scrapped so far and found at the source", ("source", "kind"), collect=lambda: {
+            key: value for m in self.modules for key, value in (((m.name, "scrapped"), m.current_scrapped_ads), ((m.name, "found"), m.total_ads_found))
+        })
+
+    def concurrency_for(self, module):
+        return self.concurrency.get(module.name, self.default_concurrency)
+
+    async def run(self, on_status=None):
+        loop = asyncio.get_running_loop()
+
+        modules = [m for m in self.modules if m.enabled]
+        for m in modules:
+            m.concurrency = self.concurrency_for(m)
+
+        # one thread per start(), the page workers are the modules' own pipeline threads
+        executor = ThreadPoolExecutor(max_workers=max(1, len(modules)), thread_name_prefix="crawler")
+        loop.set_default_executor(executor)
+
+        tasks = []
+        for m in modules:
+            tasks.append(loop.run_in_executor(executor, PROFILER.profiled(m.start, m.name)))
+            self.logger.success(f'Module "{m.name}" has been started with a concurrency of {m.concurrency}, and is now crawling.')
+
+        self.logger.info(f'{len(tasks)} module(s) are runnings.')
+
+        reporter = asyncio.ensure_future(self._report(on_status)) if on_status else None
+        try:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            self.logger.warning("Stopping the modules...")
+            for m in modules:
+                m.stop()
+            try:
+                # they finish the pages in flight and keep their checkpoints open
+                executor.shutdown(wait=True)
+            except KeyboardInterrupt:
+                # Ctrl+C again: don't wait for them
+                pass
+            raise
+        finally:
+            if reporter:
+                reporter.cancel()
+            executor.shutdown(wait=False)
+
+        for m, result in zip(modules, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f'Module "{m.name}" stopped with an error! (Error: {result})')
+            else:
+                self.logger.success(f'Module "{m.name}" has finished.')
+
+        if on_status:
+            on_status()
+
+    async def _report(self, on_status):
+        while True:
+            on_status()
+            await asyncio.sleep(self.status_interval)
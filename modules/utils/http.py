@@ -0,0 +1,137 @@
+import time
+from urllib.parse import urlparse
+
+from .metrics import REGISTRY, proxy_label
+from .profiler import PROFILER
+
+BAN_STATUSES = (403, 407, 429)
+
+REQUESTS = REGISTRY.counter("bestimmo_requests_total", "HTTP requests by source, proxy and status (error when no response came back)", ("source", "proxy", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("bestimmo_request_seconds", "HTTP request latency", ("source", "proxy"))
+RESPONSE_BYTES = REGISTRY.counter("bestimmo_response_bytes_total", "Size of the response bodies", ("source",))
+
+
+class HttpSession:
+    """
+    Wrapper around a tls_client session.
+
+    Attributes (headers, proxies, client_identifier...) are read from and
+    written to the wrapped session, so modules configure it as before. Every
+    request goes through request(), which waits for the target host's rate
+    limiter, then reports the outcome to the limiter, the proxy pool and the
+    metrics of its `source`. Failed requests are retried on another proxy
+    according to the retry policy.
+
+    With an `archive`, mode="record" stores every response in it and
+    mode="replay" answers from it without touching the network, waiting
+    `replay_latency` seconds per request ("recorded" to wait as long as the
+    recorded request took).
+    """
+
+    _own = ("session", "proxy", "proxy_pool", "rate_limiters", "rate_limit", "retry_policy", "last_ok", "last_status", "source", "archive", "mode", "replay_latency")
+
+    def __init__(self, session, proxy_pool=None, rate_limiters=None, rate_limit: dict = None, retry_policy=None, source: str = None,
+                 archive=None, mode: str = "live", replay_latency=None):
+        object.__setattr__(self, "session", session)
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "archive", archive)
+        object.__setattr__(self, "mode", mode if archive is not None else "live")
+        object.__setattr__(self, "replay_latency", replay_latency)
+        object.__setattr__(self, "proxy", None)
+        object.__setattr__(self, "proxy_pool", proxy_pool)
+        object.__setattr__(self, "rate_limiters", rate_limiters)
+        object.__setattr__(self, "rate_limit", rate_limit or {})
+        object.__setattr__(self, "retry_policy", retry_policy)
+        object.__setattr__(self, "last_ok", True)
+        object.__setattr__(self, "last_status", None)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.session, name, value)
+
+    def set_proxy(self, proxy: str):
+        self.proxy = proxy
+        self.last_ok = True
+        if proxy:
+            self.session.proxies.update({
+                "http": f"http://{proxy}",
+                "https": f"http://{proxy}"
+            })
+        else:
+            self.session.proxies.clear()
+
+    def request(self, method: str, url: str, **kwargs):
+        if self.mode == "replay":
+            return self._replay(method, url, kwargs)
+
+        host = urlparse(url).netloc
+        limiter = self.rate_limiters.get(host, **self.rate_limit) if self.rate_limiters is not None else None
+        policy = self.retry_policy
+
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.acquire()
+
+            started = time.perf_counter()
+            try:
+                with PROFILER.stage(self.source or host, "http"):
+                    response = getattr(self.session, method.lower())(url, **kwargs)
+                status, error = response.status_code, None
+            except Exception as e:
+                response, status, error = None, None, e
+            self._report(host, limiter, status, time.perf_counter() - started)
+            if response is not None:
+                RESPONSE_BYTES.inc(len(response.content or b""), source=self.source or host)
+
+            attempt += 1
+            if policy is None or not policy.should_retry(status) or attempt >= policy.max_attempts or not policy.take():
+                if error is not None:
+                    raise error
+                if self.mode == "record":
+                    self.archive.record(method, url, kwargs, response, time.perf_counter() - started)
+                return response
+
+            if self.proxy_pool is not None:
+                self.set_proxy(self.proxy_pool.pick(host, exclude=self.proxy))
+            time.sleep(policy.backoff(attempt - 1))
+
+    def _replay(self, method: str, url: str, kwargs: dict):
+        source = self.source or urlparse(url).netloc
+        with PROFILER.stage(source, "http"):
+            response = self.archive.replay(method, url, kwargs)
+            if response is None:
+                self.last_status = None
+                REQUESTS.inc(source=source, proxy="replay", status="missing")
+                raise LookupError(f"{method} {url} was not recorded in {self.archive.path}")
+            delay = response.elapsed if self.replay_latency == "recorded" else self.replay_latency
+            if delay:
+                time.sleep(delay)
+
+        self.last_status = response.status_code
+        REQUESTS.inc(source=source, proxy="replay", status=response.status_code)
+        REQUEST_SECONDS.observe(delay or 0.0, source=source, proxy="replay")
+        RESPONSE_BYTES.inc(len(response.content), source=source)
+        return response
+
+    def _report(self, host: str, limiter, status, elapsed: float):
+        source, proxy = self.source or host, proxy_label(self.proxy)
+        REQUESTS.inc(source=source, proxy=proxy, status=status or "error")
+        REQUEST_SECONDS.observe(elapsed, source=source, proxy=proxy)
+        if limiter:
+            limiter.record(status)
+        self.last_status = status
+        self.last_ok = status is not None and status < 500 and status not in BAN_STATUSES
+        if self.proxy_pool is not None:
+            self.proxy_pool.report(self.proxy, host, self.last_ok, latency=elapsed, banned=status in BAN_STATUSES)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
@@ -1,24 +1,154 @@
-import colorama
+import colorama, atexit, json, os, queue, sys, threading, time
 from datetime import datetime
 
 colorama.init()
 
+DEBUG, INFO, SUCCESS, WARNING, ERROR = 10, 20, 25, 30, 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "SUCCESS": SUCCESS, "WARNING": WARNING, "ERROR": ERROR}
+NAMES = {value: name for name, value in LEVELS.items()}
+COLORS = {
+    DEBUG: colorama.Fore.WHITE,
+    INFO: colorama.Fore.CYAN,
+    SUCCESS: colorama.Fore.GREEN,
+    WARNING: colorama.Fore.YELLOW,
+    ERROR: colorama.Fore.RED
+}
+
+
+class _Writer:
+    """
+    Background thread printing log records in the order they were logged.
+
+    Callers only put a record on a queue; the thread formats whatever is
+    waiting and prints it with a single write. The same message from the
+    same logger is printed at most once per `Logger.repeat_window` seconds,
+    the next one printed says how many were skipped.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._repeats = {}
+
+    def put(self, record):
+        if self._thread is None:
+            self._start()
+        self.queue.put(record)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="Logger", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [line for line in map(self._format, filter(None, records)) if line is not None]
+            if lines:
+                try:
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+            if None in records:
+                return
+
+    def _format(self, record):
+        created, level, module, message, json_output = record
+
+        repeated = 0
+        if Logger.repeat_window > 0:
+            key = (module, level, message)
+            last, skipped = self._repeats.get(key, (0, 0))
+            if created - last < Logger.repeat_window:
+                self._repeats[key] = (last, skipped + 1)
+                return None
+            self._repeats[key] = (created, 0)
+            repeated = skipped
+            if len(self._repeats) > 10000:
+                self._repeats = {k: v for k, v in self._repeats.items() if created - v[0] < Logger.repeat_window}
+        if repeated:
+            message = f"{message} (repeated {repeated} more time(s))"
+
+        timestamp = datetime.fromtimestamp(created)
+        if json_output:
+            return json.dumps({
+                "time": timestamp.isoformat(),
+                "level": NAMES[level].lower(),
+                "module": module,
+                "message": message
+            }, ensure_ascii=False, default=str)
+        return f"    {COLORS[level]}[{NAMES[level]}] - {module} - {timestamp:%Y-%m-%d %H:%M:%S} - {message}{colorama.Style.RESET_ALL}"
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+
+
 class Logger:
+    """
+    Leveled logger. Messages below `Logger.level` are dropped right away, the
+    rest are printed by a shared background thread (see _Writer).
+
+    Configured with BESTIMMO_LOG_LEVEL (DEBUG, INFO, SUCCESS, WARNING, ERROR),
+    BESTIMMO_LOG_JSON=1 for one JSON object per line and
+    BESTIMMO_LOG_REPEAT_WINDOW (seconds, 0 to print every repeat), or
+    Logger.configure().
+    """
+
+    level = LEVELS.get(os.getenv("BESTIMMO_LOG_LEVEL", "INFO").upper(), INFO)
+    json_output = os.getenv("BESTIMMO_LOG_JSON", "").lower() in ("1", "true", "yes")
+    repeat_window = float(os.getenv("BESTIMMO_LOG_REPEAT_WINDOW", "10"))
+
+    _writer = _Writer()
 
     def __init__(self, name: str):
         self.module = name.upper()
 
-    def _timestamp(self):
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    @classmethod
+    def configure(cls, level: str = None, json_output: bool = None, repeat_window: float = None):
+        if level is not None:
+            cls.level = LEVELS[level.upper()]
+        if json_output is not None:
+            cls.json_output = json_output
+        if repeat_window is not None:
+            cls.repeat_window = repeat_window
+
+    @classmethod
+    def flush(cls):
+        """Print everything logged so far and stop the writer thread."""
+        cls._writer.close()
+
+    def is_enabled(self, level: int) -> bool:
+        return level >= Logger.level
+
+    def log(self, level: int, message):
+        if level >= Logger.level:
+            Logger._writer.put((time.time(), level, self.module, message, Logger.json_output))
+
+    def debug(self, message):
+        self.log(DEBUG, message)
 
     def info(self, message):
-        print(f"    {colorama.Fore.CYAN}[INFO] - {self.module} - {self._timestamp()} - {message}{colorama.Style.RESET_ALL}")
+        self.log(INFO, message)
 
     def warning(self, message):
-        print(f"    {colorama.Fore.YELLOW}[WARNING] - {self.module} - {self._timestamp()} - {message}{colorama.Style.RESET_ALL}")
+        self.log(WARNING, message)
 
     def error(self, message):
-        print(f"    {colorama.Fore.RED}[ERROR] - {self.module} - {self._timestamp()} - {message}{colorama.Style.RESET_ALL}")
+        self.log(ERROR, message)
 
     def success(self, message):
-        print(f"    {colorama.Fore.GREEN}[SUCCESS] - {self.module} - {self._timestamp()} - {message}{colorama.Style.RESET_ALL}")
+        self.log(SUCCESS, message)
@@ -0,0 +1,296 @@
+import threading
+from collections import Counter
+
+from .record import NUMERIC_FIELDS, TEXT_FIELDS
+
+# what normalize_ad expects in each field, for validation
+EXPECTED_TYPES = {
+    **{name: (str,) for name in TEXT_FIELDS},
+    **{name: (int, float) for name in NUMERIC_FIELDS},
+    "id": (str, int),
+    "photos": (list,)
+}
+
+
+def _parse(path: str):
+    """
+    "a.b.0.c" -> steps: ("key", "a"), ("key", "b"), ("index", 0), ("key", "c").
+    "a[].b" maps the rest of the path over the list a, "a[k=v].b" takes the
+    first element of a whose k is v.
+    """
+    steps = []
+    for part in path.split("."):
+        key, _, selector = part.partition("[")
+        if key.isdigit() and not selector:
+            steps.append(("index", int(key)))
+            continue
+        if key:
+            steps.append(("key", key))
+        if selector:
+            selector = selector.rstrip("]")
+            if selector:
+                field, _, value = selector.partition("=")
+                steps.append(("where", (field, value)))
+            else:
+                steps.append(("each", None))
+    return steps
+
+
+def _keys(keys, rest):
+    """Follows dict keys, then hands the value to `rest`."""
+    if len(keys) == 1:
+        key = keys[0]
+
+        def get(value):
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+            return value if rest is None or value is None else rest(value)
+        return get
+
+    def get(value):
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value if rest is None or value is None else rest(value)
+    return get
+
+
+def _step(kind, arg, rest):
+    if kind == "index":
+        def get(value):
+            if not isinstance(value, list) or len(value) <= arg:
+                return None
+            value = value[arg]
+            return value if rest is None or value is None else rest(value)
+        return get
+
+    if kind == "where":
+        field, wanted = arg
+
+        def get(value):
+            if not isinstance(value, list):
+                return None
+            value = next((item for item in value if isinstance(item, dict) and str(item.get(field)) == wanted), None)
+            return value if rest is None or value is None else rest(value)
+        return get
+
+    def get(value):
+        if not isinstance(value, list):
+            return None
+        return [item for item in (value if rest is None else map(rest, value)) if item]
+    return get
+
+
+def _getter(path: str):
+    """
+    Function reading `path` from a raw ad, None as soon as a step is missing.
+    Built once from the steps, last first, into a chain of closures.
+    """
+    get, keys = None, []
+    for kind, arg in reversed(_parse(path)):
+        if kind == "key":
+            keys.insert(0, arg)
+            continue
+        if keys:
+            get, keys = _keys(keys, get), []
+        get = _step(kind, arg, get)
+    if keys:
+        if len(keys) == 1 and get is None:
+            # the common case, a top-level field
+            key = keys[0]
+            return lambda ad: ad.get(key)
+        get = _keys(keys, get)
+    return get
+
+
+def _leaf_paths(value, prefix=""):
+    """Every leaf of a raw ad as a path, lists written as []."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _leaf_paths(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list) and value and isinstance(value[0], (dict, list)):
+        for item in value:
+            yield from _leaf_paths(item, f"{prefix}[]")
+    else:
+        yield prefix
+
+
+def _reads(path: str):
+    """The raw fields `path` reads, in the form of _leaf_paths."""
+    reads, prefix = [], ""
+    for kind, arg in _parse(path):
+        if kind == "key":
+            prefix = f"{prefix}.{arg}" if prefix else arg
+            continue
+        prefix += "[]"
+        if kind == "where":
+            reads.append(f"{prefix}.{arg[0]}")
+    # a list of plain values is a leaf of its own
+    reads.append(prefix[:-2] if prefix.endswith("[]") else prefix)
+    return reads
+
+
+class Path:
+    """
+    A field read from the raw ad.
+
+    `path` is a dotted path (see _parse) or a tuple of them, the first
+    truthy one wins. A missing value becomes `default`; `values` then maps
+    it (values it doesn't know are kept as they are) and `convert` is applied
+    to anything but None. A converter that raises gives None.
+    """
+
+    __slots__ = ("paths", "default", "values", "convert", "_getters", "extract")
+
+    def __init__(self, path, default=None, values: dict = None, convert=None):
+        self.paths = path if isinstance(path, tuple) else (path,)
+        self.default = default
+        self.values = values
+        self.convert = convert
+        self._getters = [_getter(p) for p in self.paths]
+        self.extract = self._compile()
+
+    def raw(self, ad):
+        for get in self._getters:
+            value = get(ad)
+            if value:
+                return value
+        return value
+
+    def _compile(self):
+        """The extractor of this field, doing only the steps it was given."""
+        read = self._getters[0] if len(self._getters) == 1 else self.raw
+        default, values, convert = self.default, self.values, self.convert
+        if default is None and values is None and convert is None:
+            return read
+
+        def extract(ad):
+            value = read(ad)
+            if value is None:
+                value = default
+            if values is not None and value in values:
+                value = values[value]
+            if convert is not None and value is not None:
+                try:
+                    value = convert(value)
+                except Exception:
+                    return None
+            return value
+        return extract
+
+    def __call__(self, ad):
+        return self.extract(ad)
+
+
+class Const:
+    """The same value for every ad, shared by their rows: keep it immutable."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Computed:
+    """
+    A field built by `func(ad, row)`, run after the Path and Const fields so
+    `row` holds their values. `reads` lists the raw paths it looks at, for
+    validation.
+    """
+
+    __slots__ = ("func", "reads")
+
+    def __init__(self, func, reads: tuple = ()):
+        self.func = func
+        self.reads = reads
+
+
+class FieldMapper:
+    """
+    Declarative mapping of a source's raw ads to normalize_ad arguments,
+    compiled once: `spec` maps every normalized field to a path string, a
+    Path, a Const or a Computed, and calling the mapper on a raw ad returns
+    the row for normalize_ads.
+
+    check(ad) is the validation mode: it records the raw fields no spec
+    reads, the values a Path's `values` doesn't know, failed converters and
+    fields whose type isn't what normalize_ad expects. report() sums them up.
+    """
+
+    def __init__(self, spec: dict):
+        self.spec = {name: Path(entry) if isinstance(entry, (str, tuple)) else entry for name, entry in spec.items()}
+        self.consts = {name: entry.value for name, entry in self.spec.items() if isinstance(entry, Const)}
+        self.paths = [(name, entry) for name, entry in self.spec.items() if isinstance(entry, Path)]
+        self.computed = [(name, entry.func) for name, entry in self.spec.items() if isinstance(entry, Computed)]
+        self.id_path = self.spec.get("id")
+        self._extract = self._compile()
+
+        reads = [p for _, entry in self.paths for p in entry.paths]
+        reads += [p for entry in self.spec.values() if isinstance(entry, Computed) for p in entry.reads]
+        self.reads = tuple(read for p in reads for read in _reads(p))
+
+        self.checked = 0
+        self.issues = Counter()
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        """One function building the whole row from the fields' extractors, the Computed fields last."""
+        consts = self.consts
+        paths = [(name, path.extract) for name, path in self.paths]
+        computed = self.computed
+
+        def extract(ad):
+            row = {name: get(ad) for name, get in paths}
+            row.update(consts)
+            for name, func in computed:
+                row[name] = func(ad, row)
+            return row
+        return extract
+
+    def __call__(self, ad: dict) -> dict:
+        return self._extract(ad)
+
+    def ad_id(self, ad: dict):
+        value = self.id_path(ad) if isinstance(self.id_path, Path) else None
+        return "unknown" if value is None else value
+
+    def _mapped(self, leaf: str) -> bool:
+        return any(leaf == read or leaf.startswith(read + ".") or leaf.startswith(read + "[]") for read in self.reads)
+
+    def check(self, ad: dict):
+        issues = Counter()
+        for leaf in set(_leaf_paths(ad)):
+            if not self._mapped(leaf):
+                issues[("unmapped", leaf)] += 1
+
+        for name, path in self.paths:
+            value = path.raw(ad)
+            if value is None:
+                value = path.default
+            if value is None:
+                continue
+            if path.values is not None and value not in path.values and not isinstance(value, (dict, list)):
+                issues[("unknown value", f"{name}={value!r}")] += 1
+            if path.convert is not None and path(ad) is None:
+                issues[("convert failed", f"{name}={value!r:.40}")] += 1
+
+        try:
+            row = self(ad)
+        except Exception as e:
+            issues[("error", f"{type(e).__name__}: {e}")] += 1
+            row = {}
+        for name, value in row.items():
+            expected = EXPECTED_TYPES.get(name)
+            if expected and value is not None and not isinstance(value, expected):
+                issues[("type", f"{name} is {type(value).__name__}")] += 1
+
+        with self._lock:
+            self.checked += 1
+            self.issues.update(issues)
+
+    def report(self, limit: int = 20):
+        """(kind, detail, ads affected) of the most common issues."""
+        with self._lock:
+            return [(kind, detail, count) for (kind, detail), count in self.issues.most_common(limit)]
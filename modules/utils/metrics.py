@@ -0,0 +1,257 @@
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .logger import Logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def proxy_label(proxy) -> str:
+    """host:port of a proxy, without its credentials."""
+    return str(proxy).rsplit("@", 1)[-1] if proxy else "none"
+
+
+class Metric:
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _matching(self, labels: dict):
+        """Stored (key, value) pairs whose labels match the given subset."""
+        wanted = {self.labels.index(name): str(value) for name, value in labels.items()}
+        with self._lock:
+            items = list(self._values.items())
+        return [(key, value) for key, value in items if all(key[i] == v for i, v in wanted.items())]
+
+    def samples(self):
+        """(name suffix, label names, label values, value) to render."""
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self.labels, key, value) for key, value in items]
+
+    def dump(self) -> dict:
+        """Stored values by label values, see Registry.snapshot."""
+        with self._lock:
+            return dict(self._values)
+
+    def _add(self, a, b):
+        return a + b
+
+    def merge(self, dumps):
+        """Replace the stored values with the sum of `dumps`."""
+        values = {}
+        for dump in dumps:
+            for key, value in dump.items():
+                values[key] = self._add(values[key], value) if key in values else value
+        with self._lock:
+            self._values = values
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Total over every label set matching `labels`."""
+        return sum(value for _, value in self._matching(labels))
+
+
+class Gauge(Metric):
+    """A value that goes up and down, either set() or read from `collect()` ({label values: value}) when rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        return [("", self.labels, tuple(map(str, key)), value) for key, value in self.collect().items()]
+
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {key: [list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()}
+
+    def _add(self, a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def count(self, **labels) -> int:
+        return sum(entry[2] for _, entry in self._matching(labels))
+
+    def quantile(self, q: float, **labels):
+        """Upper bound of the bucket holding the q-quantile, over every matching label set (None if empty)."""
+        counts = [0] * (len(self.buckets) + 1)
+        for _, entry in self._matching(labels):
+            counts = [a + b for a, b in zip(counts, entry[0])]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items()]
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", self.labels + ("le",), key + (le,), cumulative))
+            samples.append(("_sum", self.labels, key, total))
+            samples.append(("_count", self.labels, key, count))
+        return samples
+
+
+class Registry:
+    """
+    Named metrics shared by the whole process, rendered in the Prometheus
+    text format. counter(), gauge() and histogram() return the existing
+    metric when the name is already registered.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: tuple = (), collect=None) -> Gauge:
+        gauge = self._register(Gauge, name, help, labels)
+        if collect is not None:
+            gauge.collect = collect
+        return gauge
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def snapshot(self) -> dict:
+        """Values of every stored metric (collected gauges aside), to send to another process."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.dump() for metric in metrics if getattr(metric, "collect", None) is None}
+
+    def merge(self, snapshots):
+        """Set every stored metric to the sum of `snapshots`, e.g. those of the worker processes."""
+        snapshots = list(snapshots)
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if getattr(metric, "collect", None) is None:
+                metric.merge(snapshot.get(metric.name, {}) for snapshot in snapshots)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, names, values, value in metric.samples():
+                labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {value}" if labels else f"{metric.name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """Serves a registry on http://host:port/metrics from a background thread."""
+
+    def __init__(self, registry: Registry, port: int, host: str = "127.0.0.1"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.logger = Logger('Metrics')
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        self.logger.info(f"Serving metrics on http://{self.host}:{self._server.server_port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+REGISTRY = Registry()
@@ -0,0 +1,132 @@
+import queue, threading
+
+from .logger import Logger
+from .profiler import PROFILER
+
+_DONE = object()
+
+
+class Stage:
+
+    def __init__(self, name: str, func, workers: int = 1, maxsize: int = 0, on_start=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.on_start = on_start
+
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def count(self, processed: int = 0, errors: int = 0):
+        with self._lock:
+            self.processed += processed
+            self.errors += errors
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "errors": self.errors
+        }
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues.
+
+    Each stage runs `workers` threads that take items from the stage's queue
+    and hand the return value of `func(item)` to the next stage (None drops the
+    item). A full queue blocks the stage feeding it, so a slow stage applies
+    backpressure upstream instead of letting work pile up in memory.
+    stop() makes every stage drop the items it still has.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = []
+        self.logger = Logger(f'{name}-Pipeline')
+        self._stopped = threading.Event()
+
+    def add_stage(self, name: str, func, workers: int = 1, maxsize: int = 0, on_start=None):
+        self.stages.append(Stage(name, func, workers=workers, maxsize=maxsize, on_start=on_start))
+        return self
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def run(self, items):
+        threads = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            stage._running = stage.workers
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=PROFILER.profiled(self._work),
+                    args=(stage, next_stage),
+                    name=f"{self.name}-{stage.name}-{n}",
+                    daemon=True
+                )
+                threads.append(t)
+                t.start()
+
+        first = self.stages[0]
+        for item in items:
+            if self.stopped:
+                break
+            first.put(item)
+        for _ in range(first.workers):
+            first.queue.put(_DONE)
+
+        for t in threads:
+            t.join()
+
+        return self.stats()
+
+    def _work(self, stage: Stage, next_stage: Stage):
+        if stage.on_start:
+            try:
+                stage.on_start()
+            except Exception as e:
+                self.logger.error(f"Stage '{stage.name}' worker setup failed: {e}")
+
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+            if self.stopped:
+                continue
+            try:
+                result = stage.func(item)
+                stage.count(processed=1)
+            except Exception as e:
+                stage.count(errors=1)
+                self.logger.error(f"Stage '{stage.name}' failed on {item!r:.80}: {e}")
+                continue
+            if next_stage is not None and result is not None:
+                next_stage.put(result)
+
+        with stage._lock:
+            stage._running -= 1
+            last = stage._running == 0
+        # the last worker out tells the next stage there is nothing left
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_DONE)
@@ -0,0 +1,264 @@
+import asyncio, importlib, multiprocessing, queue, signal, threading, time
+
+from .codec import get_codec
+from .http import REQUESTS
+from .logger import Logger, NAMES
+from .metrics import REGISTRY
+from .profiler import PROFILER
+
+# module attributes set by Main, passed on to the workers
+MODULE_SETTINGS = ("incremental", "incremental_stop_pages", "full_sweep_interval", "recalibrate", "concurrency")
+# CrawlerModule class attributes set from the command line
+CRAWLER_SETTINGS = ("http_mode", "http_archive_dir", "replay_latency", "validate_mappings", "work_queue", "crawl_id", "lease_seconds")
+
+
+class RemoteModule:
+    """
+    Stand-in for a module crawling in a worker process. Settings assigned to
+    it are handed to the worker when it starts (the others keep the module
+    class's default), and its progress is the last status the worker sent.
+    """
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.name = cls.__name__[:-len("Module")] if cls.__name__.endswith("Module") else cls.__name__
+        self.enabled = True
+        self.current_scrapped_ads = 0
+        self.total_ads_found = 0
+        self.errors = 0
+        self.status = {}
+        self.process = None
+
+    def __getattr__(self, name):
+        if name == "cls":
+            raise AttributeError(name)
+        return getattr(self.cls, name)
+
+    def settings(self) -> dict:
+        return {name: getattr(self, name) for name in MODULE_SETTINGS}
+
+    def update(self, status: dict):
+        self.status = status
+        self.name = status["name"]
+        self.current_scrapped_ads = status["scrapped"]
+        self.total_ads_found = status["found"]
+        self.errors = status["errors"]
+
+    def summary(self) -> str:
+        return self.status.get("summary") or "Starting..."
+
+    def queue_depths(self):
+        return self.status.get("queues") or {}
+
+    def report_mapping(self):
+        # the worker logs it before exiting
+        pass
+
+
+def _status(module) -> dict:
+    failed = REQUESTS.value(source=module.name) - REQUESTS.value(source=module.name, status=200)
+    return {
+        "name": module.name,
+        "scrapped": module.current_scrapped_ads,
+        "found": module.total_ads_found,
+        "errors": int(failed) + len(module.dead_letters),
+        "summary": module.summary(),
+        "queues": module.queue_depths(),
+        "metrics": REGISTRY.snapshot()
+    }
+
+
+def _work(index: int, path: str, settings: dict, config: dict, events, stop, interval: float):
+    """Body of a worker process: crawl one module, sending its status to the parent."""
+    # Ctrl+C reaches every process of the group, the parent stops the workers through `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from .. import CrawlerModule
+    for name, value in config["crawler"].items():
+        setattr(CrawlerModule, name, value)
+    CrawlerModule.json_codec = get_codec(config["json_backend"])
+    Logger.configure(**config["log"])
+    if config["profile"]:
+        PROFILER.enable()
+
+    module_name, class_name = path.rsplit(".", 1)
+    module = getattr(importlib.import_module(module_name), class_name)()
+    for name, value in settings.items():
+        setattr(module, name, value)
+
+    done = threading.Event()
+
+    def report():
+        while not done.wait(interval):
+            events.put(("status", index, _status(module), None))
+
+    def watch():
+        # polled rather than waited on: set() blocks on waiters that have exited.
+        # A module can run several pipelines in a row, stop each of them
+        while not done.wait(0.5):
+            if stop.is_set():
+                module.stop()
+
+    threading.Thread(target=report, name="Status", daemon=True).start()
+    threading.Thread(target=watch, name="Stop", daemon=True).start()
+
+    error = None
+    try:
+        PROFILER.profiled(module.start, module.name)()
+    except Exception as e:
+        error = str(e)
+    finally:
+        done.set()
+        module.flush_ads()
+        CrawlerModule.close_writer()
+        module.report_mapping()
+
+    status = _status(module)
+    status["profile"] = PROFILER.export() if PROFILER.enabled else None
+    events.put(("done", index, status, error))
+    Logger.flush()
+
+
+class ProcessEngine:
+    """
+    Runs every crawler module in a worker process of its own, so decoding and
+    normalizing the ads of a source doesn't compete with the other sources
+    for the GIL. Inside its process a module crawls as under CrawlEngine,
+    with its page workers on threads.
+
+    `modules` are RemoteModule stand-ins, which the workers' status updates
+    keep current: progress and summary every `status_interval` seconds,
+    along with their metrics, summed into this process's registry so the
+    metrics server shows the whole crawl. Their stage timings are merged
+    into the profiler when they're done.
+
+    Workers are spawned, not forked, so none inherits a tls_client session,
+    a MongoDB client or a running thread. Stopping the run (Ctrl+C) stops
+    their pipelines and lets them flush their writes; those still running
+    after `shutdown_timeout` seconds are terminated.
+    """
+
+    def __init__(self, classes: list, concurrency: dict = None, default_concurrency: int = 1, status_interval: float = 5, shutdown_timeout: float = 30):
+        self.modules = [RemoteModule(cls) for cls in classes]
+        self.concurrency = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.status_interval = status_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.logger = Logger('Engine')
+        self._context = multiprocessing.get_context("spawn")
+        self._metrics = {}
+
+        REGISTRY.gauge("bestimmo_queue_depth", "Items waiting per pipeline stage", ("source", "stage"), collect=lambda: {
+            (m.name, stage): depth for m in self.modules for stage, depth in m.queue_depths().items()
+        })
+        REGISTRY.gauge("bestimmo_ads", "Ads scrapped so far and found at the source", ("source", "kind"), collect=lambda: {
+            key: value for m in self.modules for key, value in (((m.name, "scrapped"), m.current_scrapped_ads), ((m.name, "found"), m.total_ads_found))
+        })
+
+    def concurrency_for(self, module):
+        return self.concurrency.get(module.name, self.default_concurrency)
+
+    def _config(self) -> dict:
+        """What the workers need of this process's configuration."""
+        from .. import CrawlerModule
+        return {
+            "crawler": {name: getattr(CrawlerModule, name) for name in CRAWLER_SETTINGS},
+            "json_backend": CrawlerModule.json_codec.name,
+            "log": {"level": NAMES[Logger.level], "json_output": Logger.json_output, "repeat_window": Logger.repeat_window},
+            "profile": PROFILER.enabled
+        }
+
+    def _handle(self, modules, event, results):
+        kind, index, status, error = event
+        module = modules[index]
+        module.update(status)
+        self._metrics[index] = status["metrics"]
+        REGISTRY.merge(self._metrics.values())
+        if kind == "done":
+            results[index] = error
+            if status.get("profile"):
+                PROFILER.merge(status["profile"])
+
+    def _drain(self, events, timeout: float):
+        """Events waiting on the queue, waiting up to `timeout` seconds for the first one."""
+        try:
+            received = [events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                received.append(events.get_nowait())
+            except queue.Empty:
+                return received
+
+    async def run(self, on_status=None):
+        loop = asyncio.get_running_loop()
+        modules = [m for m in self.modules if m.enabled]
+        events = self._context.Queue()
+        stop = self._context.Event()
+        config = self._config()
+
+        for index, m in enumerate(modules):
+            m.concurrency = self.concurrency_for(m)
+            m.process = self._context.Process(
+                target=_work, name=f"crawler-{m.name}",
+                args=(index, f"{m.cls.__module__}.{m.cls.__name__}", m.settings(), config, events, stop, self.status_interval)
+            )
+            m.process.start()
+            self.logger.success(f'Module "{m.name}" has been started in process {m.process.pid} with a concurrency of {m.concurrency}, and is now crawling.')
+
+        self.logger.info(f'{len(modules)} module(s) are running, one process each.')
+
+        results = {}
+        next_status = 0.0
+        try:
+            while len(results) < len(modules):
+                if on_status and time.monotonic() >= next_status:
+                    on_status()
+                    next_status = time.monotonic() + self.status_interval
+                received = await loop.run_in_executor(None, self._drain, events, 0.5)
+                for event in received:
+                    self._handle(modules, event, results)
+                if not received and any(index not in results and not m.process.is_alive() for index, m in enumerate(modules)):
+                    # its last events may still be on their way
+                    for event in self._drain(events, 0.5):
+                        self._handle(modules, event, results)
+                    for index, m in enumerate(modules):
+                        if index not in results and not m.process.is_alive():
+                            results[index] = f"worker process exited with code {m.process.exitcode}"
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            self.logger.warning("Stopping the workers...")
+            raise
+        finally:
+            stop.set()
+            self._shutdown(modules, events, results)
+
+        for index, m in enumerate(modules):
+            if results.get(index) is not None:
+                self.logger.error(f'Module "{m.name}" stopped with an error! (Error: {results[index]})')
+            else:
+                self.logger.success(f'Module "{m.name}" has finished ({m.errors} error(s)).')
+
+        if on_status:
+            on_status()
+
+    def _shutdown(self, modules, events, results):
+        """Wait for the workers to exit, still reading their events so none blocks on a full queue."""
+        deadline = time.monotonic() + self.shutdown_timeout
+        try:
+            while any(m.process.is_alive() for m in modules) and time.monotonic() < deadline:
+                for event in self._drain(events, 0.2):
+                    self._handle(modules, event, results)
+            for event in self._drain(events, 0):
+                self._handle(modules, event, results)
+        except KeyboardInterrupt:
+            # Ctrl+C again: don't wait for them
+            deadline = 0
+
+        for index, m in enumerate(modules):
+            if m.process.is_alive():
+                self.logger.warning(f'Module "{m.name}" did not stop' + (f' in {self.shutdown_timeout:.0f}s' if deadline else '') + ', terminating it.')
+                m.process.terminate()
+                results.setdefault(index, "terminated")
+            m.process.join()
+        events.close()
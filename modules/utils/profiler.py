@@ -0,0 +1,190 @@
+import cProfile, json, os, pstats, threading, time
+from datetime import datetime
+
+from .logger import Logger
+
+
+class _Timer:
+
+    __slots__ = ("profiler", "key", "started", "children")
+
+    def __init__(self, profiler, key):
+        self.profiler = profiler
+        self.key = key
+
+    def __enter__(self):
+        self.children = 0.0
+        stack = self.profiler._stack()
+        stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.profiler.record(self.key[0], self.key[1], elapsed - self.children)
+        return False
+
+
+class _NullTimer:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullTimer()
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Profiler:
+    """
+    Stage timers for --profile runs.
+
+    `with PROFILER.stage(source, "http"):` records the time spent in a stage
+    of a source, minus the time of the stages nested in it (the "process"
+    stage of a page doesn't count the http, json and normalize stages it
+    runs). Disabled, stage() returns a shared no-op context.
+
+    With cprofile=True, every thread wrapped by profiled() also runs under
+    its own cProfile.Profile, merged into a .pstats file by write().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.logger = Logger('Profiler')
+        self._samples = {}
+        self._runs = {}
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, cprofile: bool = False):
+        self.enabled = True
+        self.cprofile = cprofile
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def stage(self, source: str, stage: str):
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, (source, stage))
+
+    def record(self, source: str, stage: str, seconds: float):
+        samples = self._samples.get((source, stage))
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault((source, stage), [])
+        samples.append(seconds)
+
+    def profiled(self, func, source: str = None):
+        """
+        `func` wrapped to run under cProfile when enabled. With a `source`, its
+        wall time is also kept as the run time of that source (for ads/sec).
+        """
+        if not self.enabled:
+            return func
+
+        def run(*args, **kwargs):
+            started = time.perf_counter()
+            profile = cProfile.Profile() if self.cprofile else None
+            try:
+                if profile is not None:
+                    return profile.runcall(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                if source is not None:
+                    self._runs[source] = time.perf_counter() - started
+                if profile is not None:
+                    with self._lock:
+                        self._profiles.append(profile)
+        return run
+
+    def export(self) -> dict:
+        """Stage timings and run times recorded so far, see merge."""
+        with self._lock:
+            return {"samples": {key: list(values) for key, values in self._samples.items()}, "runs": dict(self._runs)}
+
+    def merge(self, exported: dict):
+        """Add the timings export() returned in another process (e.g. a worker's)."""
+        with self._lock:
+            for key, values in exported["samples"].items():
+                self._samples.setdefault(key, []).extend(values)
+            self._runs.update(exported["runs"])
+
+    def report(self, scrapped: dict = None) -> dict:
+        """
+        Per-source breakdown: count, total, p50 and p95 (in seconds) of each
+        stage, and ads/sec over the source's run given its `scrapped` count.
+        """
+        scrapped = scrapped or {}
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+
+        sources = {}
+        for (source, stage), values in sorted(samples.items()):
+            values.sort()
+            entry = sources.setdefault(source, {"stages": {}})
+            entry["stages"][stage] = {
+                "count": len(values),
+                "total": round(sum(values), 6),
+                "p50": round(_percentile(values, 0.5), 6),
+                "p95": round(_percentile(values, 0.95), 6)
+            }
+
+        for source, seconds in self._runs.items():
+            entry = sources.setdefault(source, {"stages": {}})
+            entry["run_seconds"] = round(seconds, 3)
+            if source in scrapped:
+                entry["ads"] = scrapped[source]
+                entry["ads_per_second"] = round(scrapped[source] / seconds, 2) if seconds else None
+
+        for entry in sources.values():
+            stages = entry["stages"]
+            if stages:
+                entry["bottleneck"] = max(stages, key=lambda name: stages[name]["total"])
+        return sources
+
+    def write(self, path: str, scrapped: dict = None) -> dict:
+        """Write the report as JSON to `path` (and the merged cProfile stats next to it) and log a summary."""
+        sources = self.report(scrapped)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"generated_at": datetime.utcnow().isoformat(), "sources": sources}, f, indent=2)
+
+        for source, entry in sources.items():
+            stages = ", ".join(
+                f"{name} {s['total']:.2f}s (p50 {s['p50'] * 1000:.1f}ms, p95 {s['p95'] * 1000:.1f}ms)"
+                for name, s in sorted(entry["stages"].items(), key=lambda item: -item[1]["total"])
+            )
+            rate = f", {entry['ads_per_second']} ads/s" if entry.get("ads_per_second") is not None else ""
+            self.logger.info(f"{source}: {stages or 'no stage timed'}{rate}")
+
+        with self._lock:
+            profiles = list(self._profiles)
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(f"{os.path.splitext(path)[0]}.pstats")
+
+        self.logger.success(f"Profile written to {path}")
+        return sources
+
+
+PROFILER = Profiler()
@@ -1,3 +1,4 @@
+import os, random, threading, time
 
 
 def load_proxies():
@@ -5,4 +6,112 @@ def load_proxies():
         proxies = prxfile.read().splitlines()
     prxfile.close()
     return proxies
-    
\ No newline at end of file
+
+
+class ProxyStats:
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.cooldown_until = 0.0
+        self.banned = False
+
+    def score(self):
+        # smoothed success rate, penalised by average latency (seconds)
+        success_rate = (self.successes + 1) / (self.successes + self.failures + 2)
+        return success_rate / (1 + (self.latency or 1.0))
+
+
+class ProxyPool:
+    """
+    Shared pool of proxies with per-host health tracking.
+
+    The proxy file is read once and re-read only when its mtime changes.
+    Every request outcome is reported back; failing proxies go on an
+    exponential cooldown for that host (longer when the host banned them)
+    and the others are picked at random, weighted by their score.
+    """
+
+    def __init__(self, path: str = './inputs/proxies.txt', base_cooldown: float = 5, max_cooldown: float = 900, ban_cooldown: float = 300):
+        self.path = path
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.ban_cooldown = ban_cooldown
+
+        self.proxies = []
+        self._mtime = None
+        self._stats = {}  # (proxy, host) -> ProxyStats
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        with open(self.path, 'r') as prxfile:
+            lines = [line.strip() for line in prxfile.read().splitlines()]
+        # skip blank lines and the instructions at the top of the file
+        self.proxies = [line for line in lines if line and ' ' not in line and not line.startswith(('#', '-'))]
+
+    def _get_stats(self, proxy: str, host: str) -> ProxyStats:
+        key = (proxy, host)
+        if key not in self._stats:
+            self._stats[key] = ProxyStats()
+        return self._stats[key]
+
+    def pick(self, host: str, exclude: str = None):
+        """Pick a proxy for `host`, or None when the pool is empty."""
+        with self._lock:
+            self._reload_if_changed()
+            candidates = [p for p in self.proxies if p != exclude] or self.proxies
+            if not candidates:
+                return None
+
+            now = time.monotonic()
+            available = [p for p in candidates if self._get_stats(p, host).cooldown_until <= now]
+            if not available:
+                # everything is cooling down, use the one that comes back first
+                return min(candidates, key=lambda p: self._get_stats(p, host).cooldown_until)
+
+            weights = [self._get_stats(p, host).score() for p in available]
+            return random.choices(available, weights=weights)[0]
+
+    def report(self, proxy: str, host: str, ok: bool, latency: float = None, banned: bool = False):
+        if not proxy:
+            return
+        with self._lock:
+            stats = self._get_stats(proxy, host)
+            if latency is not None:
+                stats.latency = latency if stats.latency is None else 0.8 * stats.latency + 0.2 * latency
+
+            if ok:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.banned = False
+                return
+
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.banned = banned
+            cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (stats.consecutive_failures - 1))
+            if banned:
+                cooldown = max(cooldown, self.ban_cooldown)
+            stats.cooldown_until = time.monotonic() + cooldown
+
+    def stats(self, host: str = None):
+        with self._lock:
+            return {
+                f"{proxy}@{h}": {
+                    "successes": s.successes,
+                    "failures": s.failures,
+                    "latency": s.latency,
+                    "banned": s.banned,
+                    "cooling_down": s.cooldown_until > time.monotonic()
+                }
+                for (proxy, h), s in self._stats.items() if host is None or h == host
+            }
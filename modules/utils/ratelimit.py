@@ -0,0 +1,72 @@
+import threading, time
+
+THROTTLE_STATUSES = (403, 429, 503)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate follows AIMD.
+
+    Each healthy response raises the rate by `increase / rate`, which adds
+    about `increase` requests/s for every second of healthy traffic. A
+    throttling response (403, 429, 503) or a timeout multiplies it by
+    `decrease`, at most once per `decrease_interval` seconds so a burst of
+    in-flight failures only counts once.
+    """
+
+    def __init__(self, rate: float = 2.0, min_rate: float = 0.1, max_rate: float = 20.0,
+                 increase: float = 0.1, decrease: float = 0.5, decrease_interval: float = 2.0, burst: float = 1.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.burst = burst
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, status):
+        """Adjust the rate from a response status, None meaning the request timed out or failed."""
+        with self._lock:
+            if status is None or status in THROTTLE_STATUSES:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+
+class RateLimiters:
+    """Shared registry of one AdaptiveRateLimiter per host."""
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str, **config) -> AdaptiveRateLimiter:
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveRateLimiter(**config)
+            return self._limiters[host]
+
+    def rates(self):
+        with self._lock:
+            return {host: limiter.rate for host, limiter in self._limiters.items()}
@@ -0,0 +1,106 @@
+import hashlib, json
+
+# every field of a normalized ad, in the order normalize_ad takes them
+FIELDS = (
+    "id", "source", "url", "title", "description", "property_type", "transaction_type",
+    "price", "currency", "city", "postal_code", "latitude", "longitude",
+    "surface", "rooms", "bedrooms", "photos", "agency_name", "agency_phone",
+    "created_at", "updated_at", "retrieved_at"
+)
+
+TEXT_FIELDS = ("url", "title", "description", "property_type", "transaction_type", "city", "postal_code", "agency_name", "agency_phone")
+NUMERIC_FIELDS = ("price", "latitude", "longitude", "surface", "rooms", "bedrooms")
+
+# left out of the content hash, they change on every crawl
+VOLATILE_FIELDS = ("retrieved_at", "last_seen_at", "content_hash")
+
+
+def clean_value(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def clean_numeric(value):
+    if value is None:
+        return None
+    try:
+        return float(value) if isinstance(value, str) else value
+    except (ValueError, TypeError):
+        return None
+
+
+def content_hash(document: dict, volatile=VOLATILE_FIELDS) -> str:
+    """Stable fingerprint of a document's content, ignoring the volatile fields."""
+    content = {k: v for k, v in document.items() if k not in volatile}
+    payload = json.dumps(content, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Ad:
+    """
+    A normalized ad. Fields are attributes (None when missing), anything a
+    module adds on top is kept in `extra`. to_dict() builds the document
+    written to MongoDB, leaving the None fields out, and fills content_hash
+    the first time it's needed. Reading it like a dict (ad["id"],
+    ad.get("updated_at")) goes through the same document fields.
+    """
+
+    __slots__ = FIELDS + ("extra", "content_hash")
+
+    def __init__(self, fields: dict, retrieved_at: str):
+        """`fields` as passed to normalize_ad; unknown keys end up in `extra`."""
+        fields = dict(fields)
+        self.id = str(fields.pop("id"))
+        self.source = fields.pop("source")
+        for name in TEXT_FIELDS:
+            setattr(self, name, clean_value(fields.pop(name, None)))
+        for name in NUMERIC_FIELDS:
+            setattr(self, name, clean_numeric(fields.pop(name, None)))
+        self.currency = fields.pop("currency", "EUR")
+        self.photos = fields.pop("photos", None) or []
+        self.created_at = fields.pop("created_at", None)
+        self.updated_at = fields.pop("updated_at", None)
+        self.retrieved_at = retrieved_at
+        self.extra = fields or None
+        self.content_hash = None
+
+    def _fields(self) -> dict:
+        document = {}
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                document[name] = value
+        if self.extra:
+            document.update(self.extra)
+        return document
+
+    def to_dict(self, volatile=VOLATILE_FIELDS) -> dict:
+        document = self._fields()
+        if self.content_hash is None:
+            self.content_hash = content_hash(document, volatile)
+        document["content_hash"] = self.content_hash
+        return document
+
+    def get(self, key: str, default=None):
+        if key in Ad.__slots__ and key != "extra":
+            if key == "content_hash" and self.content_hash is None:
+                self.to_dict()
+            value = getattr(self, key)
+            return default if value is None else value
+        return (self.extra or {}).get(key, default)
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def __repr__(self):
+        return f"Ad({self.source}/{self.id})"
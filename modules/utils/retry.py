@@ -0,0 +1,46 @@
+import random, threading, time
+
+RETRY_STATUSES = (403, 408, 429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """
+    Retry rules shared by a module's requests and pages.
+
+    A request is retried on a timeout/connection error or a retryable status,
+    up to `max_attempts` times; a page whose response still can't be used is
+    fetched again up to `page_attempts` times. Delays use exponential backoff
+    with full jitter, and every retry spends one unit of the `budget`, a
+    token bucket refilled with `refill` retries per second: a dead proxy
+    pool can't turn into an endless retry loop, and a long crawl keeps
+    retrying its occasional failures.
+    """
+
+    def __init__(self, max_attempts: int = 3, page_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0, budget: int = 1000, refill: float = 1.0):
+        self.max_attempts = max_attempts
+        self.page_attempts = page_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.refill = refill
+
+        self.remaining = budget
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def should_retry(self, status) -> bool:
+        return status is None or status in RETRY_STATUSES
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def take(self) -> bool:
+        """Spend one retry from the budget, False while it's used up."""
+        with self._lock:
+            now = time.monotonic()
+            self.remaining = min(self.budget, self.remaining + (now - self._refilled_at) * self.refill)
+            self._refilled_at = now
+            if self.remaining < 1:
+                return False
+            self.remaining -= 1
+            return True
@@ -0,0 +1,128 @@
+from array import array
+from bisect import bisect_left
+import hashlib, mmap, os, struct, threading
+
+from .logger import Logger
+
+logger = Logger('SeenIndex')
+
+
+def _hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class SeenIndex:
+    """
+    Compact index of the ads already stored for a source, with the update
+    marker (e.g. updateDate) each one was stored with.
+
+    IDs and markers are kept as 64-bit hashes in two sorted arrays, 16 bytes
+    per ad, and looked up with bisect. The arrays are saved to disk and
+    memory-mapped back, so a large index costs page cache rather than Python
+    objects. IDs stored during the crawl go to a small dict on top.
+    """
+
+    MAGIC = b"SEENIDX1"
+    HEADER = struct.Struct("<8sQ")
+    NO_MARKER = 0
+
+    def __init__(self, keys=None, markers=None):
+        self.keys = keys if keys is not None else array("Q")
+        self.markers = markers if markers is not None else array("Q")
+        self._overlay = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+
+    @classmethod
+    def marker_hash(cls, marker) -> int:
+        if marker is None:
+            return cls.NO_MARKER
+        return _hash(marker) or 1
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Index of (id, update marker) pairs."""
+        entries = sorted((_hash(ad_id), cls.marker_hash(marker)) for ad_id, marker in pairs)
+        return cls(array("Q", (key for key, _ in entries)), array("Q", (marker for _, marker in entries)))
+
+    @classmethod
+    def build(cls, collection, source: str, marker_field: str = "updated_at"):
+        """Index of every ad of `source` in the ads collection."""
+        docs = collection.find({"source": source}, {"_id": 0, "id": 1, marker_field: 1})
+        return cls.from_pairs((doc["id"], doc.get(marker_field)) for doc in docs if "id" in doc)
+
+    @classmethod
+    def open(cls, db, source: str, path: str):
+        """
+        Build the index of `source` from the database and map it from `path`.
+        Falls back to the last saved index if the database can't be read.
+        """
+        try:
+            index = cls.build(db.get_collection("ads"), source)
+        except Exception as e:
+            if os.path.exists(path):
+                logger.warning(f"Could not build the {source} index, using the saved one: {e}")
+                return cls.load(path)
+            logger.warning(f"Could not build the {source} index, starting empty: {e}")
+            return cls()
+
+        index.save(path)
+        logger.info(f"Indexed {len(index.keys)} {source} ad(s).")
+        return cls.load(path)
+
+    def save(self, path: str):
+        with self._lock:
+            entries = dict(zip(self.keys, self.markers))
+            entries.update(self._overlay)
+        keys = array("Q", sorted(entries))
+        markers = array("Q", (entries[key] for key in keys))
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(keys)))
+            f.write(keys.tobytes())
+            f.write(markers.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Memory-map an index written by save()."""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= cls.HEADER.size:
+                return cls()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = cls.HEADER.unpack_from(mapped)
+        if magic != cls.MAGIC:
+            mapped.close()
+            raise ValueError(f"{path} is not a seen index")
+
+        view = memoryview(mapped)
+        start = cls.HEADER.size
+        index = cls(view[start:start + 8 * count].cast("Q"), view[start + 8 * count:start + 16 * count].cast("Q"))
+        index._mmap = mapped
+        return index
+
+    def _marker_of(self, key: int):
+        marker = self._overlay.get(key)
+        if marker is not None:
+            return marker
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.markers[i]
+        return None
+
+    def changed(self, ad_id, marker) -> bool:
+        """True if the ad is new, or stored with another (or no) update marker."""
+        if marker is None:
+            return True
+        stored = self._marker_of(_hash(ad_id))
+        return stored is None or stored != self.marker_hash(marker)
+
+    def add(self, ad_id, marker):
+        with self._lock:
+            self._overlay[_hash(ad_id)] = self.marker_hash(marker)
+
+    def __contains__(self, ad_id) -> bool:
+        return self._marker_of(_hash(ad_id)) is not None
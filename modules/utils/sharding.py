@@ -0,0 +1,143 @@
+from typing import Optional
+
+from .logger import Logger
+
+# metropolitan departments (Corsica is 2A/2B) and overseas ones
+DEPARTMENTS = [f"{n:02d}" for n in range(1, 96) if n != 20] + ["2A", "2B", "971", "972", "973", "974", "976"]
+
+# first price split, in euros; the last band is open-ended
+PRICE_BOUNDS = [0, 100000, 150000, 200000, 250000, 300000, 400000, 500000, 750000, 1000000, None]
+
+# the open-ended band is halved as if it stopped there
+MAX_PRICE = 100000000
+
+
+class Shard:
+    """A slice of a search: an optional department and an optional price band (both ends included)."""
+
+    __slots__ = ("department", "price_min", "price_max", "total")
+
+    def __init__(self, department: str = None, price_min: int = None, price_max: int = None, total: int = None):
+        self.department = department
+        self.price_min = price_min
+        self.price_max = price_max
+        self.total = total
+
+    @property
+    def priced(self) -> bool:
+        return self.price_min is not None or self.price_max is not None
+
+    def key(self) -> str:
+        key = self.department or "all"
+        if self.priced:
+            key += f"/{self.price_min or 0}-{'' if self.price_max is None else self.price_max}"
+        return key
+
+    @classmethod
+    def from_key(cls, key: str) -> Optional["Shard"]:
+        """The shard `key` names, its total unknown; None for "default", the whole search."""
+        if key == "default":
+            return None
+        department, _, band = key.partition("/")
+        shard = cls(None if department == "all" else department)
+        if band:
+            low, _, high = band.partition("-")
+            shard.price_min, shard.price_max = int(low), int(high) if high else None
+        return shard
+
+    def __repr__(self):
+        return f"Shard({self.key()}, total={self.total})"
+
+
+class ShardPlanner:
+    """
+    Splits a nationwide search into shards that each fit under the source's
+    pagination ceiling (the most results it will page through).
+
+    A search over the ceiling is split by department, then into price bands,
+    then each band is halved until it fits. `count(shard)` returns the
+    number of results of a shard (None if it couldn't be read). Sources that
+    can't filter by department pass by_department=False.
+
+    A split whose counts add up to more than its shard's is overlapping: the
+    source ignores that filter, so the shard isn't split. A shard that can't
+    be split any further, or past `max_depth` splits, or once `max_requests`
+    counts are spent, is kept as is and the ads past the ceiling are lost.
+    """
+
+    def __init__(self, count, ceiling: int, by_department: bool = True, by_price: bool = True, min_band: int = 1000,
+                 max_depth: int = 20, max_requests: int = 2500, name: str = 'Sharding'):
+        self.count = count
+        self.ceiling = ceiling
+        self.by_department = by_department
+        self.by_price = by_price
+        self.min_band = min_band
+        self.max_depth = max_depth
+        self.max_requests = max_requests
+        self.logger = Logger(name)
+        self.requests = 0
+
+    def plan(self, total: int = None):
+        """Shards covering the whole search, given its total if already known."""
+        root = Shard(total=total)
+        if root.total is None:
+            root.total = self._count(root)
+
+        shards = []
+        stack = [(root, 0)]
+        while stack:
+            shard, depth = stack.pop()
+            if shard.total is None:
+                self.logger.warning(f"Could not count {shard.key()}, crawling it up to the ceiling.")
+                shards.append(shard)
+                continue
+            if shard.total <= self.ceiling:
+                if shard.total:
+                    shards.append(shard)
+                continue
+
+            children = self.split(shard) if depth < self.max_depth else []
+            if not children:
+                self.logger.warning(f"{shard.key()} has {shard.total} results but can't be split further, only {self.ceiling} will be crawled.")
+                shards.append(shard)
+                continue
+            if self.requests + len(children) > self.max_requests:
+                self.logger.warning(f"Count budget of {self.max_requests} request(s) spent, crawling {shard.key()} up to the ceiling.")
+                shards.append(shard)
+                continue
+            for child in children:
+                child.total = self._count(child)
+            counted = sum(child.total for child in children if child.total is not None)
+            # a little over is listings added meanwhile, a filter the source ignores gives the whole count again
+            if counted > shard.total * 1.1:
+                self.logger.warning(f"The split of {shard.key()} counts {counted} results out of {shard.total}, the source ignores the filter: crawling it up to the ceiling.")
+                shards.append(shard)
+                continue
+            stack.extend((child, depth + 1) for child in reversed(children))
+
+        self.logger.info(f"Planned {len(shards)} shard(s) with {self.requests} count request(s).")
+        return shards
+
+    def split(self, shard: Shard):
+        if self.by_department and shard.department is None:
+            return [Shard(department) for department in DEPARTMENTS]
+        if not self.by_price:
+            return []
+        if not shard.priced:
+            bands = zip(PRICE_BOUNDS, PRICE_BOUNDS[1:])
+            return [Shard(shard.department, low, None if high is None else high - 1) for low, high in bands]
+
+        low, high = shard.price_min or 0, shard.price_max
+        top = MAX_PRICE if high is None else high
+        if top - low + 1 < 2 * self.min_band:
+            return []
+        middle = (low + top + 1) // 2 // self.min_band * self.min_band
+        return [Shard(shard.department, low, middle - 1), Shard(shard.department, middle, high)]
+
+    def _count(self, shard: Shard):
+        self.requests += 1
+        try:
+            return self.count(shard)
+        except Exception as e:
+            self.logger.error(f"Error counting {shard.key()}: {e}")
+            return None
@@ -0,0 +1,320 @@
+from contextlib import contextmanager
+import os, socket, sqlite3, threading, time
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .logger import Logger
+from .metrics import REGISTRY
+
+TASKS = REGISTRY.counter("bestimmo_work_tasks_total", "Work queue task events", ("source", "event"))
+
+# a task is pending, then leased; these are final
+FINAL = ("done", "failed", "skipped")
+
+
+def task_id(crawl: str, source: str, shard: str, page: int) -> str:
+    return f"{crawl}:{source}:{shard}:{page}"
+
+
+class WorkQueue:
+    """
+    The pages of a crawl as tasks shared by any number of workers, on any
+    number of machines.
+
+    The first worker to get to a source plans it: it enqueues the source's
+    (shard, page) tasks along with its page size, the others wait for that
+    plan and use it. Workers then lease tasks one at a time for
+    `lease_seconds`, keep the leases of the pages they're on alive with
+    heartbeat(), and complete them, or fail them to be retried until they
+    were leased `max_attempts` times. A task whose lease ran out (its worker
+    died or hung) is leased again by the next worker asking. Completing is
+    idempotent: a task completed twice, or by a worker that lost its lease
+    in the meantime, stays completed once.
+
+    Tasks are keyed by crawl id, so workers given the same id share a crawl
+    and a new id starts another one.
+    """
+
+    def __init__(self, lease_seconds: float = 120, max_attempts: int = 3):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.logger = Logger('WorkQueue')
+
+    def plan(self, crawl: str, source: str, items, page_size: int = None, timeout: float = 300) -> dict:
+        """
+        Enqueue `items`, (shard, page) pairs, as the tasks of `source` unless
+        another worker did. Returns the plan in use: its owner and page size.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            plan = self._claim_plan(crawl, source, page_size)
+            if plan["status"] == "ready":
+                return plan
+            if plan["owner"] == self.owner:
+                added = self._add(crawl, source, list(items))
+                self._plan_ready(crawl, source)
+                self.logger.info(f"{source}: {added} page(s) queued for crawl {crawl}.")
+                return plan
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"{plan['owner']} is still planning {source} for crawl {crawl}")
+            time.sleep(1)
+
+    def _leased(self, source: str, task: dict) -> dict:
+        # `task` as it was before the lease
+        TASKS.inc(source=source, event="leased")
+        if task["status"] == "leased":
+            TASKS.inc(source=source, event="expired")
+            self.logger.warning(f"Lease of {task['owner']} on {task['id']} ran out, taking it over.")
+        return {"id": task["id"], "shard": task["shard"], "page": task["page"], "attempts": task["attempts"] + 1}
+
+    def _failed(self, source: str, task_id: str, status: str):
+        TASKS.inc(source=source, event=status)
+        if status == "failed":
+            self.logger.error(f"{task_id} failed {self.max_attempts} time(s), giving up on it.")
+
+
+class MongoWorkQueue(WorkQueue):
+    """WorkQueue in the `work_queue` collection, plans in `work_plans`."""
+
+    def __init__(self, db, **kwargs):
+        super().__init__(**kwargs)
+        self.tasks = db.get_collection("work_queue")
+        self.plans = db.get_collection("work_plans")
+
+    def _claim_plan(self, crawl: str, source: str, page_size: int) -> dict:
+        key, now = f"{crawl}:{source}", time.time()
+        plan = {"_id": key, "status": "planning", "owner": self.owner, "page_size": page_size, "lease_until": now + self.lease_seconds}
+        try:
+            self.plans.insert_one(plan)
+            return plan
+        except DuplicateKeyError:
+            pass
+        # the planner may have died before it was done
+        taken = self.plans.update_one(
+            {"_id": key, "status": "planning", "lease_until": {"$lt": now}},
+            {"$set": {"owner": self.owner, "page_size": page_size, "lease_until": now + self.lease_seconds}}
+        )
+        return plan if taken.modified_count else self.plans.find_one({"_id": key})
+
+    def _plan_ready(self, crawl: str, source: str):
+        self.plans.update_one({"_id": f"{crawl}:{source}"}, {"$set": {"status": "ready"}})
+
+    def _add(self, crawl: str, source: str, items) -> int:
+        if not items:
+            return 0
+        result = self.tasks.bulk_write([
+            UpdateOne({"_id": task_id(crawl, source, shard, page)}, {"$setOnInsert": {
+                "crawl": crawl, "source": source, "shard": shard, "page": page,
+                "status": "pending", "owner": None, "lease_until": 0, "attempts": 0
+            }}, upsert=True)
+            for shard, page in items
+        ], ordered=False)
+        return result.upserted_count
+
+    def lease(self, crawl: str, source: str):
+        """The next task of `source` (pending, or leased and expired): id, shard, page and attempts. None if there's none."""
+        now = time.time()
+        task = self.tasks.find_one_and_update(
+            {"crawl": crawl, "source": source, "$or": [{"status": "pending"}, {"status": "leased", "lease_until": {"$lt": now}}]},
+            {"$set": {"status": "leased", "owner": self.owner, "lease_until": now + self.lease_seconds}, "$inc": {"attempts": 1}},
+            sort=[("page", ASCENDING)]
+        )
+        if task is None:
+            return None
+        task["id"] = task.pop("_id")
+        return self._leased(source, task)
+
+    def active(self, crawl: str, source: str) -> bool:
+        """Whether `source` still has tasks to lease or being worked on."""
+        return self.tasks.find_one({"crawl": crawl, "source": source, "status": {"$in": ["pending", "leased"]}}, {"_id": 1}) is not None
+
+    def heartbeat(self, task_ids) -> list:
+        """Extend the leases on `task_ids`; returns the ones this worker lost."""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        query = {"_id": {"$in": task_ids}, "status": "leased", "owner": self.owner}
+        self.tasks.update_many(query, {"$set": {"lease_until": time.time() + self.lease_seconds}})
+        held = {task["_id"] for task in self.tasks.find(query, {"_id": 1})}
+        return [key for key in task_ids if key not in held]
+
+    def complete(self, task_id: str, status: str = "done") -> bool:
+        """Mark a task done (or skipped); False if it already was."""
+        result = self.tasks.update_one(
+            {"_id": task_id, "status": {"$nin": list(FINAL)}},
+            {"$set": {"status": status, "owner": self.owner, "finished_at": time.time()}}
+        )
+        return result.modified_count == 1
+
+    def release(self, task_id: str):
+        """Give a leased task back untouched, e.g. when stopping."""
+        self.tasks.update_one({"_id": task_id, "status": "leased", "owner": self.owner}, {"$set": {"status": "pending", "owner": None, "lease_until": 0}})
+
+    def fail(self, source: str, task_id: str):
+        """Give a task back to be retried, or fail it for good after max_attempts. Returns its new status."""
+        query = {"_id": task_id, "status": "leased", "owner": self.owner}
+        if self.tasks.update_one({**query, "attempts": {"$gte": self.max_attempts}}, {"$set": {"status": "failed", "finished_at": time.time()}}).modified_count:
+            status = "failed"
+        elif self.tasks.update_one(query, {"$set": {"status": "pending", "owner": None, "lease_until": 0}}).modified_count:
+            status = "retry"
+        else:
+            return None
+        self._failed(source, task_id, status)
+        return status
+
+    def skip(self, crawl: str, source: str, shard: str) -> int:
+        """Skip the pending tasks of a shard (an incremental crawl that reached known ads)."""
+        return self.tasks.update_many(
+            {"crawl": crawl, "source": source, "shard": shard, "status": "pending"},
+            {"$set": {"status": "skipped", "finished_at": time.time()}}
+        ).modified_count
+
+    def counts(self, crawl: str, source: str) -> dict:
+        """Tasks of `source` by status."""
+        return {group["_id"]: group["count"] for group in self.tasks.aggregate([
+            {"$match": {"crawl": crawl, "source": source}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ])}
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    WorkQueue in a local SQLite file, for when MongoDB isn't available:
+    shared by the worker processes of one machine (see --processes).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY, crawl TEXT, source TEXT, shard TEXT, page INTEGER,
+            status TEXT, owner TEXT, lease_until REAL, attempts INTEGER, finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_lease ON tasks (crawl, source, status, page);
+        CREATE TABLE IF NOT EXISTS plans (id TEXT PRIMARY KEY, status TEXT, owner TEXT, page_size INTEGER, lease_until REAL);
+    """
+
+    def __init__(self, path: str = './state/work_queue.sqlite3', **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two processes can't lease the same task
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _claim_plan(self, crawl: str, source: str, page_size: int) -> dict:
+        key, now = f"{crawl}:{source}", time.time()
+        with self._transaction() as db:
+            plan = db.execute("SELECT * FROM plans WHERE id = ?", (key,)).fetchone()
+            if plan is None or (plan["status"] == "planning" and plan["lease_until"] < now):
+                db.execute("INSERT OR REPLACE INTO plans VALUES (?, 'planning', ?, ?, ?)", (key, self.owner, page_size, now + self.lease_seconds))
+                return {"status": "planning", "owner": self.owner, "page_size": page_size}
+        return dict(plan)
+
+    def _plan_ready(self, crawl: str, source: str):
+        with self._transaction() as db:
+            db.execute("UPDATE plans SET status = 'ready' WHERE id = ?", (f"{crawl}:{source}",))
+
+    def _add(self, crawl: str, source: str, items) -> int:
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, ?, 'pending', NULL, 0, 0, NULL)",
+                [(task_id(crawl, source, shard, page), crawl, source, shard, page) for shard, page in items]
+            )
+            return db.total_changes - before
+
+    def lease(self, crawl: str, source: str):
+        now = time.time()
+        with self._transaction() as db:
+            task = db.execute(
+                "SELECT * FROM tasks WHERE crawl = ? AND source = ? AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))"
+                " ORDER BY page LIMIT 1", (crawl, source, now)
+            ).fetchone()
+            if task is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (self.owner, now + self.lease_seconds, task["id"])
+            )
+        return self._leased(source, dict(task))
+
+    def active(self, crawl: str, source: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM tasks WHERE crawl = ? AND source = ? AND status IN ('pending', 'leased') LIMIT 1", (crawl, source)
+            ).fetchone() is not None
+
+    def heartbeat(self, task_ids) -> list:
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        marks = ", ".join("?" * len(task_ids))
+        with self._transaction() as db:
+            db.execute(
+                f"UPDATE tasks SET lease_until = ? WHERE id IN ({marks}) AND status = 'leased' AND owner = ?",
+                (time.time() + self.lease_seconds, *task_ids, self.owner)
+            )
+            held = {row["id"] for row in db.execute(f"SELECT id FROM tasks WHERE id IN ({marks}) AND status = 'leased' AND owner = ?", (*task_ids, self.owner))}
+        return [key for key in task_ids if key not in held]
+
+    def complete(self, task_id: str, status: str = "done") -> bool:
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET status = ?, owner = ?, finished_at = ? WHERE id = ? AND status NOT IN ('done', 'failed', 'skipped')",
+                (status, self.owner, time.time(), task_id)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, task_id: str):
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET status = 'pending', owner = NULL, lease_until = 0 WHERE id = ? AND status = 'leased' AND owner = ?", (task_id, self.owner))
+
+    def fail(self, source: str, task_id: str):
+        with self._transaction() as db:
+            task = db.execute("SELECT attempts FROM tasks WHERE id = ? AND status = 'leased' AND owner = ?", (task_id, self.owner)).fetchone()
+            if task is None:
+                return None
+            if task["attempts"] >= self.max_attempts:
+                status = "failed"
+                db.execute("UPDATE tasks SET status = 'failed', finished_at = ? WHERE id = ?", (time.time(), task_id))
+            else:
+                status = "retry"
+                db.execute("UPDATE tasks SET status = 'pending', owner = NULL, lease_until = 0 WHERE id = ?", (task_id,))
+        self._failed(source, task_id, status)
+        return status
+
+    def skip(self, crawl: str, source: str, shard: str) -> int:
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE tasks SET status = 'skipped', finished_at = ? WHERE crawl = ? AND source = ? AND shard = ? AND status = 'pending'",
+                (time.time(), crawl, source, shard)
+            ).rowcount
+
+    def counts(self, crawl: str, source: str) -> dict:
+        with self._lock:
+            return {row["status"]: row["count"] for row in self._db.execute(
+                "SELECT status, COUNT(*) AS count FROM tasks WHERE crawl = ? AND source = ? GROUP BY status", (crawl, source)
+            )}
+
+
+def open_work_queue(db=None, path: str = './state/work_queue.sqlite3', **kwargs) -> WorkQueue:
+    """The MongoDB work queue, or the SQLite one when MongoDB isn't available."""
+    if db is not None and db.db is not None:
+        return MongoWorkQueue(db, **kwargs)
+    return SqliteWorkQueue(path, **kwargs)